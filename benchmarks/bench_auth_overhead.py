@@ -0,0 +1,47 @@
+"""
+Measure the per-request cost of Auth.get_current_user with and without the verified-token cache.
+
+Redis is replaced by an in-memory stand-in and the user is served from the in-process user cache,
+so the numbers show only the token handling overhead.
+
+Run from the project root: python -m benchmarks.bench_auth_overhead
+"""
+import asyncio
+import time
+
+from src.services.auth import Auth
+from src.services.codec import CachedUser
+
+NUMBER = 20_000
+
+
+class FakeRedis:
+    async def exists(self, *keys):
+        return 0
+
+
+async def measure(auth: Auth, token: str, cached: bool) -> float:
+    started = time.perf_counter()
+    for _ in range(NUMBER):
+        if not cached:
+            auth.token_cache.clear()
+        await auth.get_current_user(token, None)
+    return (time.perf_counter() - started) / NUMBER
+
+
+async def main() -> None:
+    auth = Auth()
+    auth.cache = FakeRedis()
+    user = CachedUser(id=1, username="deadpool", email="deadpool@example.com", avatar=None, confirm=True)
+    auth.user_cache.set(user.email, user, ttl=3600)
+    token = await auth.create_access_token(data={"sub": user.email})
+
+    before = await measure(auth, token, cached=False)
+    after = await measure(auth, token, cached=True)
+    print(f"jwt.decode on every request: {before * 1e6:8.2f} us")
+    print(f"verified-token cache:        {after * 1e6:8.2f} us")
+    print(f"speed-up:                    {before / after:8.1f}x")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,63 @@
+"""
+Measure the CPU cost of serializing a page of contacts: validating the rows into response models
+before dumping them, as list endpoints did, FastAPI's response_model path (validation, then
+jsonable_encoder and json.dumps), and dump_contacts, which writes the trusted rows straight to JSON.
+
+Run from the project root: python -m benchmarks.bench_contacts_json [--page 500]
+"""
+import argparse
+import json
+import timeit
+from datetime import date, datetime
+from types import SimpleNamespace
+
+from fastapi.encoders import jsonable_encoder
+from pydantic import TypeAdapter
+
+from src.routes.contacts import FIELDS, sparse, dump_contacts
+from src.schemas.contact import ContactFieldsResponseSchema
+from src.services.codec import CachedUser
+
+NUMBER = 50
+CONTACT_LIST = TypeAdapter(list[ContactFieldsResponseSchema])
+
+
+def make_contacts(page: int) -> list:
+    # Rows only need _mapping, as sqlalchemy.Row does
+    return [SimpleNamespace(_mapping={
+        "id": i, "name": f"Name{i}", "surname": "Surname", "email": f"contact{i}@example.com",
+        "phone": "380501234567", "birthday": date(1990, 1 + i % 12, 1 + i % 28), "notes": "Met at the conference",
+        "created_at": datetime(2024, 1, 1, 12, 0, 0, 123456), "updated_at": datetime(2024, 2, 1, 8, 30)})
+        for i in range(page)]
+
+
+def validated(contacts, fields, user) -> bytes:
+    body = CONTACT_LIST.validate_python([sparse(contact, fields, user) for contact in contacts], from_attributes=True)
+    return CONTACT_LIST.dump_json(body, exclude_unset=True)
+
+
+def encoded(contacts, fields, user) -> bytes:
+    body = CONTACT_LIST.validate_python([sparse(contact, fields, user) for contact in contacts], from_attributes=True)
+    return json.dumps(jsonable_encoder(body, exclude_unset=True), separators=(",", ":")).encode()
+
+
+def main(page: int) -> None:
+    contacts = make_contacts(page)
+    user = CachedUser(id=42, username="deadpool", email="deadpool@example.com", avatar=None, confirm=True)
+    fields = FIELDS
+    assert dump_contacts(contacts, fields, user) == validated(contacts, fields, user)
+    print(f"{page} contacts per page, all fields")
+    results = {}
+    for label, dump in (("validate + dump_json", validated), ("validate + jsonable_encoder", encoded),
+                        ("dump_contacts", dump_contacts)):
+        results[label] = timeit.timeit(lambda: dump(contacts, fields, user), number=NUMBER) / NUMBER
+        print(f"{label:<28} {results[label] * 1e3:>9.2f} ms")
+    saved = results["validate + dump_json"] - results["dump_contacts"]
+    print(f"{'CPU saved per page':<28} {saved * 1e3:>9.2f} ms "
+          f"({results['validate + dump_json'] / results['dump_contacts']:.1f}x)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--page", type=int, default=500, help="contacts per page")
+    main(parser.parse_args().page)
@@ -0,0 +1,341 @@
+"""
+Load test every API route in process and compare the results with a committed baseline.
+
+The real main.app is driven over httpx.ASGITransport, so requests pass through routing, dependencies,
+validation and serialization exactly like in production, without sockets or a server process.
+The database is a seeded SQLite file by default; pass --db-url to run against a local Postgres
+migrated with alembic upgrade head. Redis is replaced by an in-memory stand-in and the rate limits
+are turned off.
+
+Run from the project root: python -m benchmarks.bench_http
+Options: --concurrency 16 --requests 400 --routes contacts_list,contacts_find --baseline FILE
+         --update-baseline to store the current numbers as the new baseline.
+
+Numbers depend on the machine, so only compare runs made on the same one. The run fails when a route
+loses more than --tolerance of its throughput, its p95 latency grows by more than that, or it starts
+answering with errors.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import sys
+import time
+from collections import deque
+from dataclasses import dataclass
+from datetime import date, timedelta
+from pathlib import Path
+from typing import Callable
+
+import httpx
+from sqlalchemy import delete
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+
+from main import app
+from src.database.db import get_db, get_read_db
+from src.entity.models import Base, Contact, User
+from src.repository.contacts import birthday_key
+from src.services.auth import auth_service
+from src.services.response_cache import response_cache
+from src.services.rate_limit import rate_limits
+from src.services.refresh_tokens import refresh_tokens
+
+BASELINE = Path(__file__).with_name("baseline_http.json")
+SQLITE_FILE = "bench.db"
+EMAIL = "bench@example.com"
+PASSWORD = "bench-password"
+
+
+class MemoryRedis:
+    """
+    The commands of redis.asyncio.Redis the application uses, kept in a dict.
+    """
+    def __init__(self):
+        self.data: dict[str, tuple[bytes, float | None]] = {}
+
+    def _alive(self, key: str) -> bytes | None:
+        item = self.data.get(key)
+        if item is None:
+            return None
+        if item[1] is not None and item[1] <= time.monotonic():
+            del self.data[key]
+            return None
+        return item[0]
+
+    async def get(self, key):
+        return self._alive(key)
+
+    async def set(self, key, value, ex=None, px=None):
+        expires = time.monotonic() + ex if ex else time.monotonic() + px / 1000 if px else None
+        self.data[key] = (value if isinstance(value, bytes) else str(value).encode(), expires)
+        return True
+
+    async def exists(self, *keys):
+        return sum(self._alive(key) is not None for key in keys)
+
+    async def delete(self, *keys):
+        return sum(self.data.pop(key, None) is not None for key in keys)
+
+    async def sadd(self, key, *members):
+        self.data.setdefault(key, (set(), None))[0].update(members)
+        return len(members)
+
+    async def smembers(self, key):
+        return self.data.get(key, (set(), None))[0]
+
+    async def expire(self, key, seconds):
+        return key in self.data
+
+    def pipeline(self, transaction=True):
+        return MemoryPipeline(self)
+
+    def register_script(self, script):
+        return RotateScript(self)
+
+
+class MemoryPipeline:
+    """
+    Queues commands and runs them on MemoryRedis when executed.
+    """
+    def __init__(self, memory: MemoryRedis):
+        self.memory = memory
+        self.commands = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        pass
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: self.commands.append(getattr(self.memory, name)(*args, **kwargs))
+
+    async def execute(self):
+        return [await command for command in self.commands]
+
+
+class RotateScript:
+    """
+    The refresh token rotation script of src.services.refresh_tokens, run in Python.
+    """
+    def __init__(self, memory: MemoryRedis):
+        self.memory = memory
+        self.registered_client = memory
+
+    async def __call__(self, keys, args):
+        current = self.memory._alive(keys[0])
+        if current is None:
+            return 0
+        if current != str(args[0]).encode():
+            await self.memory.delete(keys[0])
+            return -1
+        await self.memory.set(keys[0], args[1], ex=args[2])
+        return 1
+
+
+@dataclass
+class Scenario:
+    name: str
+    request: Callable[[int], tuple[str, str, dict]]
+    share: float = 1.0
+
+
+def percentile(latencies: list[float], q: float) -> float:
+    if not latencies:
+        return 0.0
+    return latencies[min(len(latencies) - 1, max(0, round(q * len(latencies)) - 1))]
+
+
+async def seed(session_maker, contacts: int) -> None:
+    async with session_maker() as session:
+        user_ids = [user.id for user in (await session.execute(User.__table__.select()
+                                                              .where(User.email == EMAIL))).all()]
+        if user_ids:
+            await session.execute(delete(Contact).where(Contact.user_id.in_(user_ids)))
+            await session.execute(delete(User).where(User.id.in_(user_ids)))
+        user = User(username="bench", email=EMAIL, password=auth_service.get_password_hash(PASSWORD), confirm=True)
+        session.add(user)
+        await session.flush()
+        first = date(1980, 1, 1)
+        rows = []
+        for i in range(contacts):
+            birthday = first + timedelta(days=i * 37 % 14600)
+            rows.append({"name": f"Name{i % 97}", "surname": f"Surname{i % 389}", "email": f"seed{i}@example.com",
+                         "phone": f"38050{i:07d}", "birthday": birthday, "birthday_mmdd": birthday_key(birthday),
+                         "notes": f"seeded contact {i}", "user_id": user.id})
+        for start in range(0, len(rows), 500):
+            await session.execute(Contact.__table__.insert(), rows[start:start + 500])
+        await session.commit()
+
+
+async def login(client: httpx.AsyncClient) -> dict:
+    response = await client.post("/api/auth/login", data={"username": EMAIL, "password": PASSWORD})
+    response.raise_for_status()
+    return response.json()
+
+
+def scenarios(tokens: dict, contact_ids: list[int], created: list[dict], refresh: deque) -> list[Scenario]:
+    auth = {"Authorization": f"Bearer {tokens['access_token']}"}
+
+    def contact(i: int) -> dict:
+        return {"name": "Bench", "surname": f"Created{i}", "email": f"created{i}@example.com",
+                "phone": f"38067{i:07d}", "birthday": "1990-06-15", "notes": "created by the benchmark"}
+
+    def updated(created_contact: dict, i: int) -> dict:
+        fields = ("name", "surname", "email", "phone", "birthday")
+        return dict({field: created_contact[field] for field in fields}, notes=f"update {i}")
+
+    return [
+        Scenario("auth_login", lambda i: ("POST", "/api/auth/login",
+                                          {"data": {"username": EMAIL, "password": PASSWORD}}), share=0.05),
+        # Refresh tokens are single use, every request takes one from the pool and returns its successor
+        Scenario("auth_refresh", lambda i: ("GET", "/api/auth/refresh_token",
+                                            {"headers": {"Authorization": f"Bearer {refresh.popleft()}"}}),
+                 share=0.25),
+        Scenario("users_me", lambda i: ("GET", "/api/users/me", {"headers": auth})),
+        Scenario("contacts_list", lambda i: ("GET", f"/api/contacts/?limit=50&offset={i % 10 * 50}",
+                                             {"headers": auth})),
+        Scenario("contacts_get", lambda i: ("GET", f"/api/contacts/{contact_ids[i % len(contact_ids)]}",
+                                            {"headers": auth})),
+        Scenario("contacts_find", lambda i: ("GET", f"/api/contacts/find/surname{i % 389}", {"headers": auth})),
+        Scenario("contacts_birthdays", lambda i: ("GET", "/api/contacts/upcoming_birthdays/?days=30",
+                                                  {"headers": auth})),
+        Scenario("contacts_create", lambda i: ("POST", "/api/contacts/", {"headers": auth, "json": contact(i)})),
+        Scenario("contacts_update", lambda i: ("PUT", f"/api/contacts/{created[i % len(created)]['id']}",
+                                               {"headers": auth, "json": updated(created[i % len(created)], i)})),
+        Scenario("contacts_delete", lambda i: ("DELETE", f"/api/contacts/{created[i % len(created)]['id']}",
+                                               {"headers": auth})),
+    ]
+
+
+async def run(client: httpx.AsyncClient, scenario: Scenario, requests: int, concurrency: int,
+              on_response: Callable[[httpx.Response], None] | None = None) -> dict:
+    counter = itertools.count()
+    latencies: list[float] = []
+    errors = 0
+
+    async def worker():
+        nonlocal errors
+        while (i := next(counter)) < requests:
+            method, url, kwargs = scenario.request(i)
+            started = time.perf_counter()
+            response = await client.request(method, url, **kwargs)
+            latencies.append(time.perf_counter() - started)
+            if response.status_code >= 400:
+                errors += 1
+            elif on_response is not None:
+                on_response(response)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(min(concurrency, requests))))
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        "requests": requests,
+        "errors": errors,
+        "rps": round(requests / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+    }
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list[str]:
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        if result["rps"] < base["rps"] * (1 - tolerance):
+            regressions.append(f"{name}: throughput {result['rps']} rps, baseline {base['rps']} rps")
+        if result["p95_ms"] > base["p95_ms"] * (1 + tolerance):
+            regressions.append(f"{name}: p95 {result['p95_ms']} ms, baseline {base['p95_ms']} ms")
+        if result["errors"] / result["requests"] > base["errors"] / base["requests"]:
+            regressions.append(f"{name}: {result['errors']} errors, baseline {base['errors']}")
+    for name, result in results.items():
+        # A route that fails every request measures nothing, whatever the baseline says
+        if result["errors"] == result["requests"]:
+            regressions.append(f"{name}: every request failed")
+    return regressions
+
+
+async def main(args: argparse.Namespace) -> int:
+    sqlite = args.db_url.startswith("sqlite")
+    if sqlite and os.path.exists(SQLITE_FILE):
+        os.remove(SQLITE_FILE)
+    engine = create_async_engine(args.db_url, connect_args={"timeout": 30} if sqlite else {})
+    if sqlite:
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+    session_maker = async_sessionmaker(autoflush=False, autocommit=False, bind=engine)
+    await seed(session_maker, args.contacts)
+
+    async def override_get_db():
+        async with session_maker() as session:
+            yield session
+
+    app.dependency_overrides[get_db] = override_get_db
+    app.dependency_overrides[get_read_db] = override_get_db
+    memory = MemoryRedis()
+    rate_limits.enabled = False
+    auth_service.cache = memory
+    response_cache.client = memory
+    refresh_tokens.client = memory
+
+    transport = httpx.ASGITransport(app=app, raise_app_exceptions=False)
+    results = {}
+    try:
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            tokens = await login(client)
+            listed = await client.get(f"/api/contacts/?limit=500&fields=id",
+                                      headers={"Authorization": f"Bearer {tokens['access_token']}"})
+            contact_ids = [row["id"] for row in listed.json()]
+            created: list[dict] = []
+            refresh = deque([await refresh_tokens.issue(EMAIL) for _ in range(args.concurrency)])
+            selected = set(args.routes.split(",")) if args.routes else None
+            for scenario in scenarios(tokens, contact_ids, created, refresh):
+                if selected is not None and scenario.name not in selected:
+                    continue
+                if scenario.name in ("contacts_update", "contacts_delete") and not created:
+                    print(f"{scenario.name:20} skipped, it needs contacts_create to run first")
+                    continue
+                requests = max(1, int(args.requests * scenario.share))
+                on_response = {
+                    "contacts_create": lambda response: created.append(response.json()),
+                    "auth_refresh": lambda response: refresh.append(response.json()["refresh_token"]),
+                }.get(scenario.name)
+                results[scenario.name] = await run(client, scenario, requests, args.concurrency, on_response)
+                result = results[scenario.name]
+                print(f"{scenario.name:20} {result['rps']:9.1f} rps  p50 {result['p50_ms']:8.2f} ms  "
+                      f"p95 {result['p95_ms']:8.2f} ms  p99 {result['p99_ms']:8.2f} ms  errors {result['errors']}")
+    finally:
+        app.dependency_overrides.clear()
+        auth_service.hash_pool.shutdown()
+        await engine.dispose()
+        if sqlite and os.path.exists(SQLITE_FILE):
+            os.remove(SQLITE_FILE)
+
+    if args.update_baseline:
+        args.baseline.write_text(json.dumps(results, indent=2) + "\n")
+        print(f"Baseline written to {args.baseline}")
+        return 0
+    if not args.baseline.exists():
+        return 0
+    regressions = compare(results, json.loads(args.baseline.read_text()), args.tolerance)
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db-url", default=f"sqlite+aiosqlite:///./{SQLITE_FILE}")
+    parser.add_argument("--contacts", type=int, default=2000, help="number of seeded contacts")
+    parser.add_argument("--requests", type=int, default=400, help="requests per route")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--routes", help="comma separated scenario names, all by default")
+    parser.add_argument("--baseline", type=Path, default=BASELINE)
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    parser.add_argument("--update-baseline", action="store_true")
+    sys.exit(asyncio.run(main(parser.parse_args())))
@@ -0,0 +1,68 @@
+"""
+Measure the per-request cost of the rate limit dependency: fastapi_limiter, which runs a Lua script
+on Redis for every request, against the in-process token buckets of src.services.rate_limit.
+
+Redis is replaced by a stand-in that answers after --rtt-ms, the round trip to a nearby Redis;
+the token buckets never wait for it, they only sync in the background.
+The app no longer depends on fastapi_limiter; install it (pip install fastapi-limiter) for the comparison,
+otherwise only the token buckets are measured.
+
+Run from the project root: python -m benchmarks.bench_rate_limit [--rtt-ms 0.3]
+"""
+import argparse
+import asyncio
+import time
+
+from starlette.requests import Request
+from starlette.responses import Response
+
+from main import app
+from src.services.rate_limit import RateLimiter, RateLimits
+
+NUMBER = 5_000
+
+
+class SlowRedis:
+    def __init__(self, rtt: float):
+        self.rtt = rtt
+
+    async def script_load(self, script):
+        return "sha"
+
+    async def evalsha(self, sha, numkeys, *args):
+        await asyncio.sleep(self.rtt)
+        return 0
+
+
+def make_request() -> Request:
+    return Request({"type": "http", "method": "GET", "path": "/api/contacts/", "headers": [
+        (b"authorization", b"Bearer token")], "client": ("10.0.0.1", 1234), "app": app, "query_string": b""})
+
+
+async def measure(limiter, *args) -> float:
+    started = time.perf_counter()
+    for _ in range(NUMBER):
+        await limiter(*args)
+    return (time.perf_counter() - started) / NUMBER
+
+
+async def main(rtt_ms: float) -> None:
+    request = make_request()
+    after = await measure(RateLimiter(times=NUMBER * 2, seconds=60, limits=RateLimits(maxsize=1000)), request)
+    print(f"in-process token bucket:           {after * 1e6:9.2f} us")
+    try:
+        from fastapi_limiter import FastAPILimiter
+        from fastapi_limiter.depends import RateLimiter as RedisRateLimiter
+    except ImportError:
+        print("fastapi_limiter is not installed, skipping the comparison")
+        return
+    await FastAPILimiter.init(SlowRedis(rtt_ms / 1000))
+    before = await measure(RedisRateLimiter(times=NUMBER * 2, seconds=60), request, Response())
+    print(f"fastapi_limiter, Redis round trip: {before * 1e6:9.2f} us")
+    print(f"speed-up:                          {before / after:9.1f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rtt-ms", type=float, default=0.3, help="simulated Redis round trip")
+    asyncio.run(main(parser.parse_args().rtt_ms))
@@ -0,0 +1,36 @@
+"""
+Compare the struct-packed user codec with pickling the SQLAlchemy User model.
+
+Run from the project root: python -m benchmarks.bench_user_codec
+"""
+import pickle
+import timeit
+
+from src.entity.models import User
+from src.services.codec import CachedUser, encode_user, decode_user
+
+NUMBER = 100_000
+
+
+def make_user() -> User:
+    return User(id=42, username="deadpool", email="deadpool@example.com", password="$2b$12$" + "x" * 53,
+                avatar="https://res.cloudinary.com/name/image/upload/c_fill,h_250,w_250/v1/contacts_web/"
+                       "deadpool@example.com", confirm=True)
+
+
+def bench(label: str, encode, decode, value) -> None:
+    payload = encode(value)
+    encode_time = timeit.timeit(lambda: encode(value), number=NUMBER) / NUMBER
+    decode_time = timeit.timeit(lambda: decode(payload), number=NUMBER) / NUMBER
+    print(f"{label:<10} {len(payload):>8} B {encode_time * 1e6:>10.2f} us {decode_time * 1e6:>10.2f} us")
+
+
+def main() -> None:
+    user = make_user()
+    print(f"{'codec':<10} {'payload':>10} {'encode':>13} {'decode':>13}")
+    bench("pickle", pickle.dumps, pickle.loads, user)
+    bench("struct", encode_user, decode_user, CachedUser.from_user(user))
+
+
+if __name__ == "__main__":
+    main()
@@ -3,7 +3,6 @@ from pathlib import Path
 
 import redis.asyncio as redis
 from fastapi import FastAPI, Depends, Request
-from fastapi_limiter import FastAPILimiter
 from fastapi.responses import HTMLResponse
 from fastapi.templating import Jinja2Templates
 from fastapi.staticfiles import StaticFiles
@@ -11,8 +10,16 @@ from fastapi.middleware.cors import CORSMiddleware
 from sqlalchemy import text
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from src.database.db import get_db
-from src.routes import contacts, auth, users
+from src.database.db import get_db, session_manager, QueryStatsMiddleware
+from src.routes import contacts, auth, users, internal, metrics
+from src.services.auth import auth_service
+from src.services.response_cache import response_cache
+from src.services.email import outbox_sender
+from src.services.rate_limit import rate_limits
+from src.services.refresh_tokens import refresh_tokens
+from src.services.avatars import avatar_pipeline, AvatarFiles, AVATAR_DIR
+from src.services.metrics import MetricsMiddleware, request_metrics
+from src.services.compression import CompressionMiddleware, compression_stats
 from src.conf.config import config
 
 app = FastAPI()
@@ -26,14 +33,26 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "ETag"],
 )
 
 app.include_router(auth.router, prefix='/api')
 app.include_router(users.router, prefix='/api')
 app.include_router(contacts.router, prefix='/api')
+app.include_router(internal.router, prefix='/api')
+app.include_router(metrics.router)
+
+app.add_middleware(QueryStatsMiddleware)
+app.add_middleware(CompressionMiddleware, minimum_size=config.COMPRESSION_MINIMUM_SIZE, stats=compression_stats,
+                   levels={"gzip": config.COMPRESSION_GZIP_LEVEL, "br": config.COMPRESSION_BROTLI_QUALITY,
+                           "zstd": config.COMPRESSION_ZSTD_LEVEL})
+# Added last, so it is the outermost middleware and its latency covers the whole stack
+app.add_middleware(MetricsMiddleware, metrics=request_metrics)
 
 BASE_DIR = Path(__file__).resolve().parent
 static_ = BASE_DIR.joinpath("src").joinpath("static")
+# Mounted before /static, so avatars are served with long-lived cache headers
+app.mount("/static/avatars", AvatarFiles(directory=str(AVATAR_DIR), check_dir=False), name="avatars")
 app.mount("/static", StaticFiles(directory=str(static_)), name="static")
 
 
@@ -46,8 +65,41 @@ async def startup():
     :return: A coroutine
     :doc-author: Trelent
     """
-    r = await redis.Redis(host=config.REDIS_DOMAIN, port=config.REDIS_PORT, password=config.REDIS_PASSWORD, db=0)
-    await FastAPILimiter.init(r)
+    pool = redis.ConnectionPool(host=config.REDIS_DOMAIN, port=config.REDIS_PORT, password=config.REDIS_PASSWORD,
+                                db=0, max_connections=config.REDIS_MAX_CONNECTIONS)
+    r = await redis.Redis(connection_pool=pool)
+    rate_limits.client = r
+    rate_limits.start()
+    auth_service.cache = r
+    response_cache.client = r
+    refresh_tokens.client = r
+    try:
+        await session_manager.warm_up(config.DB_POOL_WARMUP)
+    except Exception as e:
+        print(e)
+    session_manager.start_health_checks(config.DB_REPLICA_HEALTH_INTERVAL)
+    outbox_sender.start()
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    """
+    The shutdown function is called when the application stops.
+    It reports the pending rate limit hits, stops the email sender, waits for the queued avatars,
+    then closes the Redis connections shared by the rate limiter and the caches,
+    stops the worker threads and closes the database connections.
+
+    :return: A coroutine
+    :doc-author: Trelent
+    """
+    await rate_limits.stop()
+    await outbox_sender.stop()
+    await avatar_pipeline.join()
+    if auth_service.cache is not None:
+        await auth_service.cache.connection_pool.disconnect()
+    avatar_pipeline.pool.shutdown()
+    auth_service.hash_pool.shutdown()
+    await session_manager.close()
 
 
 templates_ = BASE_DIR.joinpath("src").joinpath("templates")
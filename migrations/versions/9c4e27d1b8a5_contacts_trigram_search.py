@@ -0,0 +1,35 @@
+"""Contacts trigram search index
+
+Revision ID: 9c4e27d1b8a5
+Revises: 3b1f0c9a2d41
+Create Date: 2026-10-17 11:40:27.904115
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9c4e27d1b8a5'
+down_revision: Union[str, None] = '3b1f0c9a2d41'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # The indexed expression must match SEARCH_TEXT in src/repository/contacts.py.
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    op.execute(
+        "CREATE INDEX ix_contacts_search_trgm ON contacts USING gin "
+        "(lower(name || ' ' || surname || ' ' || email || ' ' || phone) gin_trgm_ops)"
+    )
+
+
+def downgrade() -> None:
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    op.execute("DROP INDEX IF EXISTS ix_contacts_search_trgm")
@@ -0,0 +1,26 @@
+"""Users contacts_version
+
+Revision ID: a4d83f0e6b19
+Revises: e51a6d03f7c2
+Create Date: 2026-10-17 15:42:10.583104
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a4d83f0e6b19'
+down_revision: Union[str, None] = 'e51a6d03f7c2'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('users', sa.Column('contacts_version', sa.Integer(), server_default='0', nullable=False))
+
+
+def downgrade() -> None:
+    op.drop_column('users', 'contacts_version')
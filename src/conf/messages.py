@@ -1,4 +1,13 @@
 ACCOUNT_EXIST: str = "Account already exists!"
 NOT_CONFIRM: str = "Email not confirmed!"
 INVALID_CREDENTIALS: str = "Invalid credentials!"
-
+INVALID_CURSOR: str = "Invalid cursor!"
+SERVICE_BUSY: str = "Service is busy, try again later!"
+INVALID_FIELDS: str = "Unknown field requested!"
+AVATAR_TOO_LARGE: str = "Avatar file is too large!"
+AVATAR_NOT_IMAGE: str = "Avatar must be an image!"
+AVATAR_MISSING: str = "Avatar file is missing!"
+TOO_MANY_REQUESTS: str = "Too many requests, try again later!"
+TOKEN_REVOKED: str = "Refresh token was revoked, log in again!"
+TOKEN_REUSED: str = "Refresh token was already used, log in again!"
+INTERNAL_FORBIDDEN: str = "Invalid internal token!"
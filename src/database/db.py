@@ -1,17 +1,172 @@
+import asyncio
 import contextlib
+import itertools
+import time
+from contextvars import ContextVar
+from dataclasses import dataclass
 
+from sqlalchemy import event, text
+from sqlalchemy.engine import Engine
 from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from sqlalchemy.util.queue import AsyncAdaptedQueue
 
 from src.conf.config import config
+from src.services.metrics import Histogram
+
+
+@dataclass
+class QueryStats:
+    """
+    The QueryStats class adds up the statements executed while it is the current one, usually during one request.
+    """
+    count: int = 0
+    seconds: float = 0.0
+
+
+_query_stats: ContextVar[QueryStats | None] = ContextVar("query_stats", default=None)
+
+
+@contextlib.contextmanager
+def track_queries():
+
+    """
+    The track_queries function counts the statements executed inside the with block, in this task
+    and the tasks it starts. Blocks may be nested, the innermost one gets the counts.
+
+    :return: A QueryStats object that is filled while the block runs
+    :doc-author: Trelent
+    """
+    stats = QueryStats()
+    token = _query_stats.set(stats)
+    try:
+        yield stats
+    finally:
+        _query_stats.reset(token)
+
+
+def redact(parameters) -> object:
+
+    """
+    The redact function replaces the values of statement parameters with their type names,
+    so slow queries can be logged without leaking emails, password hashes or notes.
+
+    :param parameters: The parameters of a statement, a dict, a sequence, or a list of them for executemany
+    :return: The parameters with every value replaced
+    :doc-author: Trelent
+    """
+    if isinstance(parameters, dict):
+        return {key: type(value).__name__ for key, value in parameters.items()}
+    if isinstance(parameters, list):
+        return [redact(item) for item in parameters[:3]] + (["..."] if len(parameters) > 3 else [])
+    if isinstance(parameters, tuple):
+        return tuple(type(value).__name__ for value in parameters)
+    return type(parameters).__name__
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    context._query_started = time.perf_counter()
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - context._query_started
+    stats = _query_stats.get()
+    if stats is not None:
+        stats.count += 1
+        stats.seconds += elapsed
+    if elapsed * 1000 >= config.SLOW_QUERY_MS:
+        print(f"Slow query ({elapsed * 1000:.1f} ms): {' '.join(statement.split())} | params {redact(parameters)}")
+
+
+class QueryStatsMiddleware:
+    """
+    The QueryStatsMiddleware class is an ASGI middleware that counts the statements every request executes.
+    With DEBUG on, the count and the time spent in the database go out in the X-DB-Queries and X-DB-Time-Ms
+    response headers. Statements run after the headers were sent, like those of a streamed export, are not included.
+
+    :param app: The ASGI application to wrap
+    """
+    def __init__(self, app):
+
+        """
+        The __init__ function wraps the application.
+
+        :param self: Represent the instance of the class
+        :param app: The ASGI application to wrap
+        :return: None
+        :doc-author: Trelent
+        """
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+
+        """
+        The __call__ function serves a request through the wrapped application while counting its statements.
+
+        :param self: Represent the instance of the class
+        :param scope: The ASGI scope
+        :param receive: The ASGI receive channel
+        :param send: The ASGI send channel
+        :return: None
+        :doc-author: Trelent
+        """
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        with track_queries() as stats:
+
+            async def send_with_stats(message):
+                if message["type"] == "http.response.start" and config.DEBUG:
+                    message["headers"] = [*message.get("headers", []),
+                                          (b"x-db-queries", str(stats.count).encode()),
+                                          (b"x-db-time-ms", f"{stats.seconds * 1000:.2f}".encode())]
+                await send(message)
+
+            await self.app(scope, receive, send_with_stats)
+
+
+class TimedQueue(AsyncAdaptedQueue):
+    """
+    The TimedQueue class is the queue of idle connections inside InstrumentedQueuePool.
+    It records how long every get waited on the queue into the wait_time histogram of its pool.
+    """
+    wait_time: Histogram
+
+    def get(self, block: bool = True, timeout: float | None = None):
+        started = time.perf_counter()
+        try:
+            return super().get(block, timeout)
+        finally:
+            self.wait_time.observe(time.perf_counter() - started)
+
+
+class InstrumentedQueuePool(AsyncAdaptedQueuePool):
+    """
+    The InstrumentedQueuePool class is the default async queue pool that also records
+    how long each checkout waited for a connection. Only the wait on the queue of idle
+    connections is timed, opening a new connection is not.
+    """
+    _queue_class = TimedQueue
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.wait_time = Histogram()
+        self._pool.wait_time = self.wait_time
 
 
 class DBSessionManager:
     """
     The DBSessionManager class is a context manager that manages a database session.
+    Writes always go to the primary database. Reads may be spread over read replicas,
+    replicas that fail their health check are skipped until they recover.
 
     :param url: str: Specify the URL of the database
+    :param replica_urls: list[str]: URLs of read replicas of the database
+    :param engine_options: Extra keyword arguments for create_async_engine, such as the pool settings
     """
-    def __init__(self, url: str):
+    def __init__(self, url: str, replica_urls: list[str] = (), **engine_options):
 
         """
         The __init__ function is the constructor for a class. It is called when an object of that class
@@ -20,12 +175,21 @@ class DBSessionManager:
 
         :param self: Represent the instance of the class
         :param url: str: Create the engine
+        :param replica_urls: list[str]: Create one engine per read replica
+        :param engine_options: Pool size, overflow, timeout, recycle and pre-ping settings of the engines
         :return: A session_maker object
         :doc-author: Trelent
         """
-        self._engine: AsyncEngine | None = create_async_engine(url)
+        self._engine: AsyncEngine | None = create_async_engine(url, **engine_options)
         self._session_maker: async_sessionmaker = async_sessionmaker(autoflush=False, autocommit=False,
                                                                      bind=self._engine)
+        self._replicas: list[AsyncEngine] = [create_async_engine(replica, **engine_options)
+                                             for replica in replica_urls]
+        self._replica_session_makers = [async_sessionmaker(autoflush=False, autocommit=False, bind=replica)
+                                        for replica in self._replicas]
+        self._replica_healthy = [True] * len(self._replicas)
+        self._next_replica = itertools.count()
+        self._health_task: asyncio.Task | None = None
 
     @contextlib.asynccontextmanager
     async def session(self):
@@ -47,8 +211,163 @@ class DBSessionManager:
         finally:
             await session.close()
 
+    def _read_session_maker(self) -> async_sessionmaker:
+
+        """
+        The _read_session_maker function picks the session maker for the next read.
+        Healthy replicas take turns; when none is healthy the primary is used.
+
+        :param self: Represent the instance of the class
+        :return: The session maker of a healthy replica or of the primary
+        :doc-author: Trelent
+        """
+        healthy = [maker for maker, ok in zip(self._replica_session_makers, self._replica_healthy) if ok]
+        if not healthy:
+            return self._session_maker
+        return healthy[next(self._next_replica) % len(healthy)]
+
+    @contextlib.asynccontextmanager
+    async def read_session(self):
+        """
+        The read_session function is like session, but the session may be bound to a read replica.
+        Use it only for queries that can tolerate replication lag.
+
+        :param self: Represent the instance of the class
+        :return: A session object
+        :doc-author: Trelent
+        """
+        if self._session_maker is None:
+            raise Exception("Session is not initialized")
+        session = self._read_session_maker()()
+        try:
+            yield session
+        except:
+            await session.rollback()
+        finally:
+            await session.close()
+
+    async def check_replicas(self, timeout: float = 5) -> None:
+
+        """
+        The check_replicas function runs SELECT 1 on every replica and marks it healthy or not.
+        Unhealthy replicas get no reads until a later check succeeds.
+
+        :param self: Represent the instance of the class
+        :param timeout: float: Seconds a replica has to answer
+        :return: None
+        :doc-author: Trelent
+        """
+        for index, replica in enumerate(self._replicas):
+            try:
+                await asyncio.wait_for(self._ping(replica), timeout)
+                healthy = True
+            except Exception as e:
+                healthy = False
+                print(f"Replica {index} failed its health check: {e}")
+            self._replica_healthy[index] = healthy
+
+    @staticmethod
+    async def _ping(engine: AsyncEngine) -> None:
+        async with engine.connect() as connection:
+            await connection.execute(text("SELECT 1"))
+
+    def start_health_checks(self, interval: float) -> None:
+
+        """
+        The start_health_checks function checks the replicas every interval seconds in a background task.
+
+        :param self: Represent the instance of the class
+        :param interval: float: Seconds between two checks
+        :return: None
+        :doc-author: Trelent
+        """
+        if self._replicas and self._health_task is None:
+            self._health_task = asyncio.create_task(self._health_loop(interval))
+
+    async def _health_loop(self, interval: float) -> None:
+        while True:
+            await self.check_replicas()
+            await asyncio.sleep(interval)
+
+    async def warm_up(self, connections: int) -> None:
+
+        """
+        The warm_up function opens connections eagerly and returns them to the pool,
+        so the first requests after startup don't pay for connecting.
+        At most pool size connections are opened, extra ones would be dropped again on return.
+        If any connection fails, the ones that did open are closed before the first error is raised.
+
+        :param self: Represent the instance of the class
+        :param connections: int: Number of connections to open
+        :return: None
+        :doc-author: Trelent
+        """
+        for engine in (self._engine, *self._replicas):
+            pool = engine.pool
+            count = min(connections, pool.size()) if hasattr(pool, "size") else connections
+            opened = await asyncio.gather(*(engine.connect() for _ in range(count)), return_exceptions=True)
+            errors = [result for result in opened if isinstance(result, BaseException)]
+            for connection in opened:
+                if not isinstance(connection, BaseException):
+                    await connection.close()
+            if errors:
+                raise errors[0]
+
+    def stats(self) -> dict:
+
+        """
+        The stats function reports the live state of the connection pools:
+        size, connections checked in and out, the current overflow and the checkout wait time histogram
+        of the primary, and the same plus the health of every replica.
+
+        :param self: Represent the instance of the class
+        :return: A dictionary with the pool statistics
+        :doc-author: Trelent
+        """
+        stats = self._pool_stats(self._engine)
+        stats["replicas"] = [dict(self._pool_stats(replica), healthy=healthy)
+                             for replica, healthy in zip(self._replicas, self._replica_healthy)]
+        return stats
 
-session_manager = DBSessionManager(config.DB_URL)
+    @staticmethod
+    def _pool_stats(engine: AsyncEngine) -> dict:
+        pool = engine.pool
+        if not isinstance(pool, InstrumentedQueuePool):
+            return {"pool": pool.status()}
+        return {
+            "size": pool.size(),
+            "checked_in": pool.checkedin(),
+            "checked_out": pool.checkedout(),
+            "overflow": pool.overflow(),
+            "wait_time": pool.wait_time.stats(),
+        }
+
+    async def close(self) -> None:
+
+        """
+        The close function stops the replica health checks and closes every pooled connection of the engines.
+
+        :param self: Represent the instance of the class
+        :return: None
+        :doc-author: Trelent
+        """
+        if self._health_task is not None:
+            self._health_task.cancel()
+            self._health_task = None
+        for engine in (self._engine, *self._replicas):
+            await engine.dispose()
+
+
+session_manager = DBSessionManager(
+    config.DB_URL,
+    config.DB_REPLICA_URLS,
+    poolclass=InstrumentedQueuePool,
+    pool_size=config.DB_POOL_SIZE,
+    max_overflow=config.DB_MAX_OVERFLOW,
+    pool_timeout=config.DB_POOL_TIMEOUT,
+    pool_recycle=config.DB_POOL_RECYCLE,
+    pool_pre_ping=config.DB_POOL_PRE_PING,
+)
 
 
 async def get_db():
@@ -60,3 +379,14 @@ async def get_db():
     """
     async with session_manager.session() as session:
         return session
+
+
+async def get_read_db():
+    """
+    The get_read_db function returns a session for read-only queries.
+    It is bound to a healthy read replica when there is one, otherwise to the primary database.
+    :return: A session object
+    :doc-author: Trelent
+    """
+    async with session_manager.read_session() as session:
+        return session
@@ -1,8 +1,8 @@
 import enum
-from datetime import date
+from datetime import date, datetime
 
 from sqlalchemy.orm import Mapped, mapped_column, relationship
-from sqlalchemy import String, Date, DateTime, func, Enum, ForeignKey, Integer, Boolean
+from sqlalchemy import String, Date, DateTime, func, Enum, ForeignKey, Integer, Boolean, Index, JSON
 from sqlalchemy.orm import DeclarativeBase
 
 
@@ -18,6 +18,7 @@ class Contact(Base):
     email: Mapped[str] = mapped_column(String(150), unique=True, index=True)
     phone: Mapped[str] = mapped_column(String(15), unique=True, index=True)
     birthday: Mapped[Date] = mapped_column(Date, nullable=True)
+    birthday_mmdd: Mapped[int] = mapped_column(Integer, nullable=True)
     notes: Mapped[str] = mapped_column(String(500), nullable=True)
     created_at: Mapped[date] = mapped_column('created_at', DateTime, default=func.now(), nullable=True)
     updated_at: Mapped[date] = mapped_column('updated_at', DateTime, default=func.now(), onupdate=func.now(), nullable=True)
@@ -27,6 +28,11 @@ class Contact(Base):
     user_id: Mapped[int] = mapped_column(Integer, ForeignKey('users.id'), nullable=True)
     user: Mapped["User"] = relationship("User", backref="contacts", lazy="joined")
 
+    __table_args__ = (
+        Index('ix_contacts_user_id_surname_name_id', 'user_id', 'surname', 'name', 'id'),
+        Index('ix_contacts_user_id_birthday_mmdd', 'user_id', 'birthday_mmdd'),
+    )
+
 
 class User(Base):
     __tablename__ = 'users'
@@ -37,4 +43,26 @@ class User(Base):
     avatar: Mapped[str] = mapped_column(String(255), nullable=True)
     created_at: Mapped[date] = mapped_column('created_at', DateTime, default=func.now())
     updated_at: Mapped[date] = mapped_column('updated_at', DateTime, default=func.now(), onupdate=func.now())
-    confirm: Mapped[bool] = mapped_column(Boolean, default=False, nullable=True)
\ No newline at end of file
+    confirm: Mapped[bool] = mapped_column(Boolean, default=False, nullable=True)
+    contacts_version: Mapped[int] = mapped_column(Integer, default=0, server_default="0", nullable=False)
+
+
+class OutboxEmail(Base):
+    # Emails waiting to be sent. Rows are added in the transaction of the change that causes them,
+    # so no email is lost when the process dies, and sent by the outbox sender in the background.
+    __tablename__ = 'email_outbox'
+    id: Mapped[int] = mapped_column(primary_key=True)
+    template: Mapped[str] = mapped_column(String(50))
+    recipient: Mapped[str] = mapped_column(String(150))
+    subject: Mapped[str] = mapped_column(String(255))
+    payload: Mapped[dict] = mapped_column(JSON, default=dict)
+    status: Mapped[str] = mapped_column(String(10), default="pending")
+    attempts: Mapped[int] = mapped_column(Integer, default=0)
+    next_attempt_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    last_error: Mapped[str] = mapped_column(String(500), nullable=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    sent_at: Mapped[datetime] = mapped_column(DateTime, nullable=True)
+
+    __table_args__ = (
+        Index('ix_email_outbox_status_next_attempt_at', 'status', 'next_attempt_at'),
+    )
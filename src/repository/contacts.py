@@ -1,30 +1,195 @@
+import base64
+import json
 from datetime import date, timedelta
+from typing import AsyncIterator, Sequence
 
-from sqlalchemy import select, or_, and_, extract
+from sqlalchemy import select, or_, tuple_, func, literal_column, case, insert, update, delete, Row
+from sqlalchemy.dialects import postgresql, sqlite
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from src.entity.models import Contact, User
-from src.schemas.contact import ContactSchema, ContactUpdateSchema
+from src.schemas.contact import ContactSchema, ContactUpdateSchema, ContactBatchChangesSchema
 
+# Columns of a contact as returned by the API, selected or RETURNed without touching the users table
+CONTACT_COLUMNS = (Contact.id, Contact.name, Contact.surname, Contact.email, Contact.phone, Contact.birthday,
+                  Contact.notes, Contact.created_at, Contact.updated_at)
+CONTACT_FIELDS = {column.key: column for column in CONTACT_COLUMNS}
 
-async def get_contacts(limit: int, offset: int, db: AsyncSession, user: User):
+# Must stay identical to the expression of the ix_contacts_search_trgm index, otherwise Postgres won't use it.
+SEPARATOR = literal_column("' '")
+SEARCH_TEXT = func.lower(
+    Contact.name + SEPARATOR + Contact.surname + SEPARATOR + Contact.email + SEPARATOR + Contact.phone
+)
 
+
+def birthday_key(birthday: date | None) -> int | None:
+
+    """
+    The birthday_key function turns a birthday into the MMDD number stored in Contact.birthday_mmdd.
+    The year is dropped, so the number orders birthdays by their position in any calendar year.
+
+    :param birthday: date | None: The birthday of the contact
+    :return: The month * 100 + day of the birthday, or None
+    :doc-author: Trelent
+    """
+    if birthday is None:
+        return None
+    return birthday.month * 100 + birthday.day
+
+
+def project(fields: Sequence[str] | None, *required: str) -> list:
+
+    """
+    The project function picks the columns to select for the requested fields.
+    Required fields are always selected, names that are not contact columns (like user) are skipped.
+
+    :param fields: Sequence[str] | None: Names of the requested fields, None means every column
+    :param required: str: Names of the fields the query itself needs
+    :return: A list of Contact columns
+    :doc-author: Trelent
+    """
+    if fields is None:
+        return list(CONTACT_COLUMNS)
+    names = dict.fromkeys(name for name in (*required, *fields) if name in CONTACT_FIELDS)
+    return [CONTACT_FIELDS[name] for name in names]
+
+
+def encode_cursor(contact: Contact) -> str:
+
+    """
+    The encode_cursor function builds an opaque pagination cursor from the last contact of a page.
+    The cursor holds the (surname, name, id) sort key, so the next page can continue right after it.
+
+    :param contact: Contact: The last contact of the current page
+    :return: A url-safe cursor string
+    :doc-author: Trelent
+    """
+    key = json.dumps([contact.surname, contact.name, contact.id], separators=(",", ":"))
+    return base64.urlsafe_b64encode(key.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> tuple[str, str, int]:
+
+    """
+    The decode_cursor function turns a cursor made by encode_cursor back into a (surname, name, id) sort key.
+
+    :param cursor: str: The cursor received from the client
+    :return: A tuple of surname, name and id
+    :raises ValueError: If the cursor is malformed
+    :doc-author: Trelent
     """
-    The get_contacts function returns a list of contacts for the user.
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        surname, name, contact_id = json.loads(raw)
+    except (ValueError, TypeError) as err:
+        raise ValueError("Invalid cursor") from err
+    if not isinstance(surname, str) or not isinstance(name, str) or not isinstance(contact_id, int):
+        raise ValueError("Invalid cursor")
+    return surname, name, contact_id
+
+
+async def write_version(db: AsyncSession, user: User) -> int:
+
+    """
+    The write_version function reads the write version of the user's contacts, a primary key lookup.
+
+    :param db: AsyncSession: Pass the database session to the function
+    :param user: User: Whose version to read
+    :return: The number of contact writes of the user so far, 0 if a replica doesn't have the user yet
+    :doc-author: Trelent
+    """
+    result = await db.execute(select(User.contacts_version).where(User.id == user.id))
+    return result.scalar() or 0
+
+
+async def contact_version(contact_id: int, db: AsyncSession, user: User) -> Row | None:
+
+    """
+    The contact_version function reads the updated_at of one contact of the user, along with the write
+    version of the user, without loading the contact itself.
+
+    :param contact_id: int: Specify the id of the contact
+    :param db: AsyncSession: Pass the database session to the function
+    :param user: User: Only a contact of this user is looked at
+    :return: An (updated_at, version) row, or None if the user has no such contact
+    :doc-author: Trelent
+    """
+    stmt = (select(Contact.updated_at, User.contacts_version)
+            .join(User, Contact.user_id == User.id)
+            .where(Contact.id == contact_id, Contact.user_id == user.id))
+    result = await db.execute(stmt)
+    return result.one_or_none()
+
+
+async def bump_version(db: AsyncSession, user: User) -> None:
+
+    """
+    The bump_version function increments the write version of the user, which changes the ETags of
+    every contact response of that user. Call it in the same transaction as the write, before the commit.
+
+    :param db: AsyncSession: Pass the database session to the function
+    :param user: User: Whose contacts were written
+    :return: None
+    :doc-author: Trelent
+    """
+    stmt = (update(User)
+            .where(User.id == user.id)
+            .values(contacts_version=User.contacts_version + 1, updated_at=User.updated_at)
+            .execution_options(synchronize_session=False))
+    await db.execute(stmt)
+
+
+async def get_contacts(limit: int, offset: int, db: AsyncSession, user: User, cursor: str | None = None,
+                       fields: Sequence[str] | None = None):
+
+    """
+    The get_contacts function returns a list of contacts for the user, ordered by surname, name and id.
+    When a cursor is given the page starts right after it (keyset pagination) and the offset is ignored.
+    Paging with offset is kept for backwards compatibility, but it is the slow path:
+    the database still has to walk over every skipped row.
 
     :param limit: int: Limit the number of contacts returned
     :param offset: int: Specify the number of records to skip
     :param db: AsyncSession: Pass the database session to the function
     :param user: User: Filter the contacts by user
-    :return: A list of contacts
+    :param cursor: str | None: Continue after the contact encoded in the cursor
+    :param fields: Sequence[str] | None: Select only these columns, plus the ones the cursor needs
+    :return: A list of contact rows
     :doc-author: Trelent
     """
-    stmt = select(Contact).filter_by(user=user).offset(offset).limit(limit)
+    stmt = (select(*project(fields, "id", "surname", "name")).filter(Contact.user_id == user.id)
+            .order_by(Contact.surname, Contact.name, Contact.id))
+    if cursor is not None:
+        stmt = stmt.filter(tuple_(Contact.surname, Contact.name, Contact.id) > tuple_(*decode_cursor(cursor)))
+    else:
+        stmt = stmt.offset(offset)
+    stmt = stmt.limit(limit)
     contacts = await db.execute(stmt)
-    return contacts.scalars().all()
+    return contacts.all()
 
 
-async def get_contact(contact_id: int, db: AsyncSession, user: User):
+async def stream_contacts(db: AsyncSession, user: User, batch_size: int = 1000) -> AsyncIterator[list[Row]]:
+
+    """
+    The stream_contacts function reads all contacts of the user through a server-side cursor.
+    Only plain column rows are fetched (no ORM objects, no join to users) and they arrive
+    in batches of batch_size, so memory use does not depend on the number of contacts.
+
+    :param db: AsyncSession: Pass the database session to the function
+    :param user: User: Filter the contacts by user
+    :param batch_size: int: Number of rows fetched per round trip
+    :return: An async iterator of row batches in CONTACT_COLUMNS order
+    :doc-author: Trelent
+    """
+    stmt = (select(*CONTACT_COLUMNS).filter(Contact.user_id == user.id)
+            .order_by(Contact.surname, Contact.name, Contact.id)
+            .execution_options(yield_per=batch_size))
+    result = await db.stream(stmt)
+    async for rows in result.partitions():
+        yield rows
+
+
+async def get_contact(contact_id: int, db: AsyncSession, user: User, fields: Sequence[str] | None = None):
 
 
 
@@ -34,131 +199,227 @@ async def get_contact(contact_id: int, db: AsyncSession, user: User):
     :param contact_id: int: Specify the id of the contact we want to get
     :param db: AsyncSession: Pass the database connection to the function
     :param user: User: Ensure that the user is only able to get contacts they have created
-    :return: The contact that matches the id and user
+    :param fields: Sequence[str] | None: Select only these columns
+    :return: The contact row that matches the id and user
     :doc-author: Trelent
     """
-    stmt = select(Contact).filter_by(id=contact_id, user=user)
+    stmt = select(*project(fields, "id")).filter(Contact.id == contact_id, Contact.user_id == user.id)
     contact = await db.execute(stmt)
-    return contact.scalar_one_or_none()
+    return contact.one_or_none()
 
 
-async def create_contact(body: ContactSchema, db: AsyncSession, user: User):
+async def create_contact(body: ContactSchema, db: AsyncSession, user: User) -> Row:
 
     """
     The create_contact function creates a new contact in the database.
+    It is a single INSERT ... RETURNING statement, the returned row is ready to serialize.
 
     :param body: ContactSchema: Validate the request body
     :param db: AsyncSession: Pass the database session to the function
     :param user: User: Get the user id from the token
-    :return: A contact object
+    :return: The new contact as a row of CONTACT_COLUMNS
     :doc-author: Trelent
     """
-    contact = Contact(**body.model_dump(exclude_unset=True), user=user)
-    db.add(contact)
+    stmt = (insert(Contact)
+            .values(**body.model_dump(exclude_unset=True), birthday_mmdd=birthday_key(body.birthday),
+                    user_id=user.id)
+            .returning(*CONTACT_COLUMNS))
+    result = await db.execute(stmt)
+    contact = result.one()
+    await bump_version(db, user)
     await db.commit()
-    await db.refresh(contact)
     return contact
 
 
-async def update_contact(contact_id: int, body: ContactUpdateSchema, db: AsyncSession, user: User):
+async def create_contacts(bodies: list[ContactSchema], db: AsyncSession, user: User) -> list[bool]:
+
+    """
+    The create_contacts function inserts many contacts with one multi-row INSERT and commits them.
+    Rows whose email or phone is already taken are skipped (ON CONFLICT DO NOTHING) instead of
+    failing the whole batch. Bodies must not repeat an email among themselves.
+
+    :param bodies: list[ContactSchema]: The validated contacts to insert
+    :param db: AsyncSession: Pass the database session to the function
+    :param user: User: The owner of the new contacts
+    :return: For each body, whether it was inserted
+    :doc-author: Trelent
+    """
+    if not bodies:
+        return []
+    rows = [dict(body.model_dump(), birthday_mmdd=birthday_key(body.birthday), user_id=user.id) for body in bodies]
+    dialect = db.get_bind().dialect.name
+    if dialect == "postgresql":
+        stmt = postgresql.insert(Contact).values(rows).on_conflict_do_nothing()
+    elif dialect == "sqlite":
+        stmt = sqlite.insert(Contact).values(rows).on_conflict_do_nothing()
+    else:
+        stmt = insert(Contact).values(rows)
+    result = await db.execute(stmt.returning(Contact.email))
+    inserted = set(result.scalars().all())
+    if inserted:
+        await bump_version(db, user)
+    await db.commit()
+    return [row["email"] in inserted for row in rows]
+
+
+async def update_contact(contact_id: int, body: ContactUpdateSchema, db: AsyncSession, user: User) -> Row | None:
 
     """
     The update_contact function updates a contact in the database.
+    It is a single UPDATE ... RETURNING statement with the ownership check in the WHERE clause.
 
-    :param contact_id: int: Identify the contact to be deleted
+    :param contact_id: int: Identify the contact to be updated
     :param body: ContactUpdateSchema: Pass the data that will be used to update the contact
     :param db: AsyncSession: Pass the database session to the function
     :param user: User: Check if the contact belongs to the user
-    :return: The contact object
+    :return: The updated contact as a row of CONTACT_COLUMNS, or None if the user has no such contact
     :doc-author: Trelent
     """
-    stmt = select(Contact).filter_by(id=contact_id, user=user)
+    stmt = (update(Contact)
+            .where(Contact.id == contact_id, Contact.user_id == user.id)
+            .values(name=body.name, surname=body.surname, email=body.email, phone=body.phone,
+                    birthday=body.birthday, birthday_mmdd=birthday_key(body.birthday), notes=body.notes)
+            .returning(*CONTACT_COLUMNS)
+            .execution_options(synchronize_session=False))
     result = await db.execute(stmt)
-    contact = result.scalar_one_or_none()
-    if contact:
-        contact.name = body.name
-        contact.surname = body.surname
-        contact.email = body.email
-        contact.phone = body.phone
-        contact.birthday = body.birthday
-        contact.notes = body.notes
-        await db.commit()
-        await db.refresh(contact)
+    contact = result.one_or_none()
+    if contact is not None:
+        await bump_version(db, user)
+    await db.commit()
     return contact
 
 
-async def delete_contact(contact_id: int, db: AsyncSession, user: User):
+async def delete_contact(contact_id: int, db: AsyncSession, user: User) -> Row | None:
 
     """
     The delete_contact function deletes a contact from the database.
+    It is a single DELETE ... RETURNING statement with the ownership check in the WHERE clause.
 
     :param contact_id: int: Specify the id of the contact to be deleted
     :param db: AsyncSession: Pass in the database session
-    :param user: User: Get the user object from the database
-    :return: The deleted contact if it exists, otherwise none
+    :param user: User: Only a contact of this user is deleted
+    :return: The deleted contact as a row of CONTACT_COLUMNS if it existed, otherwise none
     :doc-author: Trelent
     """
-    stmt = select(Contact).filter_by(id=contact_id, user=user)
-    contact = await db.execute(stmt)
-    contact = contact.scalar_one_or_none()
-    if contact:
-        await db.delete(contact)
-        await db.commit()
+    stmt = (delete(Contact)
+            .where(Contact.id == contact_id, Contact.user_id == user.id)
+            .returning(*CONTACT_COLUMNS)
+            .execution_options(synchronize_session=False))
+    result = await db.execute(stmt)
+    contact = result.one_or_none()
+    if contact is not None:
+        await bump_version(db, user)
+    await db.commit()
     return contact
 
 
-async def find_contacts(query: str, db: AsyncSession, user: User):
+async def update_contacts(contact_ids: list[int], changes: ContactBatchChangesSchema, db: AsyncSession,
+                          user: User) -> list[int]:
 
     """
-    The find_contacts function takes in a query string, an async database session, and a user object.
-    It then creates an SQLAlchemy statement that filters the Contact table by the query string.
-    The function returns all contacts that match the filter.
+    The update_contacts function applies the same changes to many contacts of the user
+    with a single UPDATE ... RETURNING statement in one transaction.
+
+    :param contact_ids: list[int]: Identify the contacts to update
+    :param changes: ContactBatchChangesSchema: The fields to set, only the ones sent by the client are used
+    :param db: AsyncSession: Pass the database session to the function
+    :param user: User: Only contacts of this user are updated
+    :return: The ids of the updated contacts
+    :doc-author: Trelent
+    """
+    values = changes.model_dump(exclude_unset=True)
+    if "birthday" in values:
+        values["birthday_mmdd"] = birthday_key(values["birthday"])
+    stmt = (update(Contact)
+            .where(Contact.id.in_(contact_ids), Contact.user_id == user.id)
+            .values(**values)
+            .returning(Contact.id)
+            .execution_options(synchronize_session=False))
+    result = await db.execute(stmt)
+    updated = list(result.scalars().all())
+    if updated:
+        await bump_version(db, user)
+    await db.commit()
+    return updated
+
+
+async def delete_contacts(contact_ids: list[int], db: AsyncSession, user: User) -> list[int]:
+
+    """
+    The delete_contacts function deletes many contacts of the user with a single DELETE ... RETURNING statement.
+
+    :param contact_ids: list[int]: Identify the contacts to delete
+    :param db: AsyncSession: Pass the database session to the function
+    :param user: User: Only contacts of this user are deleted
+    :return: The ids of the deleted contacts
+    :doc-author: Trelent
+    """
+    stmt = (delete(Contact)
+            .where(Contact.id.in_(contact_ids), Contact.user_id == user.id)
+            .returning(Contact.id)
+            .execution_options(synchronize_session=False))
+    result = await db.execute(stmt)
+    deleted = list(result.scalars().all())
+    if deleted:
+        await bump_version(db, user)
+    await db.commit()
+    return deleted
+
+
+async def find_contacts(query: str, db: AsyncSession, user: User, limit: int = 50,
+                        fields: Sequence[str] | None = None):
+
+    """
+    The find_contacts function looks for contacts whose name, surname, email or phone contain the query string.
+    On Postgres the substring match is served by the pg_trgm GIN index on SEARCH_TEXT and the results
+    are ranked by trigram similarity. Other databases (SQLite in tests) get the same LIKE filter
+    without the index, ordered by surname and name.
 
     :param query: str: Search for contacts
     :param db: AsyncSession: Pass the database session to the function
     :param user: User: Filter the contacts by user
-    :return: A list of contact objects
-    :doc-author: Trelent
-    """
-    # stmt = select(Contact).filter(or_(
-    #     Contact.name.ilike(f"%{query}%"),
-    #     Contact.surname.ilike(f"%{query}"),
-    #     Contact.email.ilike(f"%{query}%"),
-    #     Contact.phone.ilike(f"%{query}%")
-    # ).filter_by(user=user)
-    # )
-    stmt = select(Contact).filter(
-        or_(
-            Contact.name.ilike(f"%{query}%"),
-            Contact.surname.ilike(f"%{query}"),
-            Contact.email.ilike(f"%{query}%"),
-            Contact.phone.ilike(f"%{query}%")
-            )
-        ).filter(
-            Contact.user == user
-        )
+    :param limit: int: Limit the number of contacts returned
+    :param fields: Sequence[str] | None: Select only these columns
+    :return: A list of contact rows
+    :doc-author: Trelent
+    """
+    needle = query.lower().replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    stmt = select(*project(fields, "id")).filter(
+        SEARCH_TEXT.like(f"%{needle}%", escape="\\"),
+        Contact.user_id == user.id,
+    )
+    if db.get_bind().dialect.name == "postgresql":
+        stmt = stmt.order_by(func.similarity(SEARCH_TEXT, query.lower()).desc(), Contact.id)
+    else:
+        stmt = stmt.order_by(Contact.surname, Contact.name, Contact.id)
+    stmt = stmt.limit(limit)
     contacts = await db.execute(stmt)
-    return contacts.scalars().all()
+    return contacts.all()
 
 
-async def upcoming_birthday(db: AsyncSession, user: User):
+async def upcoming_birthday(db: AsyncSession, user: User, days: int = 7, fields: Sequence[str] | None = None):
 
     """
-    The upcoming_birthday function returns a list of contacts that have birthdays within the next week.
+    The upcoming_birthday function returns a list of contacts that have birthdays within the next days.
+    The window is compared against the indexed birthday_mmdd column, so it is one range scan on
+    (user_id, birthday_mmdd), or two when the window wraps from December into January.
 
     :param db: AsyncSession: Pass the database session to the function
     :param user: User: Filter the contacts by user
-    :return: A list of contacts that have a birthday in the next week
+    :param days: int: Length of the window in days, today included
+    :param fields: Sequence[str] | None: Select only these columns
+    :return: A list of contact rows that have a birthday in the window, soonest first
     :doc-author: Trelent
     """
     current_date = date.today()
-    next_week = current_date + timedelta(days=7)
-    stmt = (select(Contact).filter(and_(
-        extract("month", Contact.birthday) >= current_date.month,
-        extract("day", Contact.birthday) >= current_date.day,
-        extract("month", Contact.birthday) <= next_week.month,
-        extract("day", Contact.birthday) <= next_week.day
-    )
-    ).filter_by(user=user))
+    start = birthday_key(current_date)
+    end = birthday_key(current_date + timedelta(days=days))
+    if start <= end and days < 365:
+        window = Contact.birthday_mmdd.between(start, end)
+        order = [Contact.birthday_mmdd]
+    else:
+        window = or_(Contact.birthday_mmdd >= start, Contact.birthday_mmdd <= end)
+        order = [case((Contact.birthday_mmdd >= start, 0), else_=1), Contact.birthday_mmdd]
+    stmt = select(*project(fields, "id")).filter(Contact.user_id == user.id, window).order_by(*order, Contact.id)
     contacts = await db.execute(stmt)
-    return contacts.scalars().all()
+    return contacts.all()
@@ -0,0 +1,98 @@
+from datetime import datetime, timedelta
+
+from sqlalchemy import select, update, Row
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.entity.models import OutboxEmail
+
+
+async def add_emails(emails: list[OutboxEmail], db: AsyncSession) -> None:
+
+    """
+    The add_emails function puts emails into the outbox and commits them.
+    To send emails only if another change is saved, add them to that change's transaction instead,
+    like create_user does.
+
+    :param emails: list[OutboxEmail]: The emails to send
+    :param db: AsyncSession: Pass the database session to the function
+    :return: None
+    :doc-author: Trelent
+    """
+    db.add_all(emails)
+    await db.commit()
+
+
+async def claim_emails(db: AsyncSession, limit: int, lease: float) -> list[Row]:
+
+    """
+    The claim_emails function takes the pending emails that are due and hides them from other senders
+    for lease seconds, by moving their next attempt into the future. An email whose sender dies
+    is picked up again once the lease ends, so every email is sent at least once.
+    On Postgres concurrent senders skip the rows another sender is claiming (FOR UPDATE SKIP LOCKED).
+
+    :param db: AsyncSession: Pass the database session to the function
+    :param limit: int: Claim at most this many emails
+    :param lease: float: Seconds the emails are reserved for this sender
+    :return: The claimed emails as rows of id, template, recipient, subject, payload and attempts
+    :doc-author: Trelent
+    """
+    now = datetime.utcnow()
+    stmt = (select(OutboxEmail.id, OutboxEmail.template, OutboxEmail.recipient, OutboxEmail.subject,
+                   OutboxEmail.payload, OutboxEmail.attempts)
+            .where(OutboxEmail.status == "pending", OutboxEmail.next_attempt_at <= now)
+            .order_by(OutboxEmail.next_attempt_at, OutboxEmail.id)
+            .limit(limit)
+            .with_for_update(skip_locked=True))
+    emails = (await db.execute(stmt)).all()
+    if emails:
+        await db.execute(update(OutboxEmail)
+                         .where(OutboxEmail.id.in_([email.id for email in emails]))
+                         .values(next_attempt_at=now + timedelta(seconds=lease))
+                         .execution_options(synchronize_session=False))
+    await db.commit()
+    return emails
+
+
+async def mark_sent(email_ids: list[int], db: AsyncSession) -> None:
+
+    """
+    The mark_sent function records that emails were accepted by the SMTP server.
+
+    :param email_ids: list[int]: The sent emails
+    :param db: AsyncSession: Pass the database session to the function
+    :return: None
+    :doc-author: Trelent
+    """
+    if not email_ids:
+        return
+    await db.execute(update(OutboxEmail)
+                     .where(OutboxEmail.id.in_(email_ids))
+                     .values(status="sent", sent_at=datetime.utcnow(), last_error=None)
+                     .execution_options(synchronize_session=False))
+    await db.commit()
+
+
+async def mark_failed(email_id: int, attempts: int, error: str, retry_at: datetime | None, db: AsyncSession) -> None:
+
+    """
+    The mark_failed function records a failed attempt. The email is tried again at retry_at,
+    or given up on (status dead) when retry_at is None.
+
+    :param email_id: int: The failed email
+    :param attempts: int: Number of attempts made so far, this one included
+    :param error: str: What went wrong
+    :param retry_at: datetime | None: When to try again, None to stop trying
+    :param db: AsyncSession: Pass the database session to the function
+    :return: None
+    :doc-author: Trelent
+    """
+    values = {"attempts": attempts, "last_error": error[:500]}
+    if retry_at is None:
+        values["status"] = "dead"
+    else:
+        values["next_attempt_at"] = retry_at
+    await db.execute(update(OutboxEmail)
+                     .where(OutboxEmail.id == email_id)
+                     .values(**values)
+                     .execution_options(synchronize_session=False))
+    await db.commit()
@@ -4,7 +4,7 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from libgravatar import Gravatar
 
 from src.database.db import get_db
-from src.entity.models import User
+from src.entity.models import User, OutboxEmail
 from src.schemas.user import UserSchema
 
 
@@ -25,13 +25,15 @@ async def get_user_by_email(email: str, db: AsyncSession = Depends(get_db)):
     return user
 
 
-async def create_user(body: UserSchema, db: AsyncSession = Depends(get_db)):
+async def create_user(body: UserSchema, db: AsyncSession = Depends(get_db), emails: list[OutboxEmail] = ()):
 
     """
     The create_user function creates a new user in the database.
+    The emails are put into the outbox in the same transaction, so they are sent if and only if the user is saved.
 
     :param body: UserSchema: Validate the request body
     :param db: AsyncSession: Create a database session
+    :param emails: list[OutboxEmail]: Emails to send about the new user, like the confirmation email
     :return: A user object
     :doc-author: Trelent
     """
@@ -44,26 +46,12 @@ async def create_user(body: UserSchema, db: AsyncSession = Depends(get_db)):
 
     new_user = User(**body.model_dump(), avatar=avatar)
     db.add(new_user)
+    db.add_all(emails)
     await db.commit()
     await db.refresh(new_user)
     return new_user
 
 
-async def update_token(user: User, token: str | None, db: AsyncSession):
-
-    """
-    The update_token function updates the refresh token for a user.
-
-    :param user: User: Specify the user that we are updating
-    :param token: str | None: Set the refresh token of the user to a new value
-    :param db: AsyncSession: Pass the database session into the function
-    :return: A boolean value
-    :doc-author: Trelent
-    """
-    user.refresh_token = token
-    await db.commit()
-
-
 async def confirmed_email(email: str, db: AsyncSession) -> None:
 
     """
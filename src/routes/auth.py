@@ -4,11 +4,9 @@ from fastapi import (
     Depends,
     status,
     Security,
-    BackgroundTasks,
     Request,
     Response,
 )
-from fastapi_limiter.depends import RateLimiter
 from sqlalchemy.ext.asyncio import AsyncSession
 from fastapi.security import (
     OAuth2PasswordRequestForm,
@@ -18,6 +16,7 @@ from fastapi.security import (
 
 from src.database.db import get_db
 from src.repository import users as rep_users
+from src.repository import outbox as rep_outbox
 from src.schemas.user import (
     UserSchema,
     TokenSchema,
@@ -26,7 +25,9 @@ from src.schemas.user import (
     RequestEmail,
 )
 from src.services.auth import auth_service
-from src.services.email import send_email
+from src.services.email import verification_email, outbox_sender
+from src.services.rate_limit import RateLimiter, ip_identifier
+from src.services.refresh_tokens import refresh_tokens
 from src.conf import messages
 
 router = APIRouter(prefix="/auth", tags=["auth"])
@@ -36,12 +37,12 @@ get_refresh_token = HTTPBearer()
 @router.post(
     "/signup",
     response_model=UserResponseSchema,
-    status_code=status.HTTP_201_CREATED, dependencies=[Depends(RateLimiter(times=1, seconds=15))],
+    status_code=status.HTTP_201_CREATED,
+    dependencies=[Depends(RateLimiter(times=1, seconds=15, identifier=ip_identifier))],
 )
 async def signup(
 
     body: UserSchema,
-    bt: BackgroundTasks,
     request: Request,
     db: AsyncSession = Depends(get_db),
 ):
@@ -49,11 +50,11 @@ async def signup(
     """
     The signup function creates a new user in the database.
     It takes an email, username and password as input.
+    The confirmation email is saved to the outbox together with the user and sent by the outbox sender.
     The function then checks if the email is already taken by another user. If it is,
     it returns a 409 Conflict error message to indicate that this account already exists.
 
     :param body: UserSchema: Get the data from the request body
-    :param bt: BackgroundTasks: Add a task to the background tasks queue
     :param request: Request: Get the base_url of the request
     :param db: AsyncSession: Get the database session
     :param : Get the user id from the path
@@ -65,15 +66,17 @@ async def signup(
         raise HTTPException(
             status_code=status.HTTP_409_CONFLICT, detail=messages.ACCOUNT_EXIST
         )
-    body.password = auth_service.get_password_hash(body.password)
-    new_user = await rep_users.create_user(body, db)
-    bt.add_task(send_email, new_user.email, new_user.username, str(request.base_url))
+    body.password = await auth_service.get_password_hash_async(body.password)
+    new_user = await rep_users.create_user(
+        body, db, emails=[verification_email(body.email, body.username, str(request.base_url))]
+    )
+    outbox_sender.wake()
     return new_user
 
 
 @router.post(
     "/login",
-    response_model=TokenSchema, dependencies=[Depends(RateLimiter(times=1, seconds=15))],
+    response_model=TokenSchema, dependencies=[Depends(RateLimiter(times=1, seconds=15, identifier=ip_identifier))],
 )
 async def login(
     body: OAuth2PasswordRequestForm = Depends(), db: AsyncSession = Depends(get_db)
@@ -96,13 +99,12 @@ async def login(
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED, detail=messages.NOT_CONFIRM  # "Not confirmed"
         )
-    if not auth_service.verify_password(body.password, user.password):
+    if not await auth_service.verify_password_async(body.password, user.password):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED, detail=messages.INVALID_CREDENTIALS
         )
     access_token = await auth_service.create_access_token(data={"sub": user.email})
-    refresh_token = await auth_service.create_refresh_token(data={"sub": user.email})
-    await rep_users.update_token(user, refresh_token, db)
+    refresh_token = await refresh_tokens.issue(user.email)
     return {
         "access_token": access_token,
         "refresh_token": refresh_token,
@@ -114,31 +116,21 @@ async def login(
             )
 async def refresh_token(
     credentials: HTTPAuthorizationCredentials = Security(get_refresh_token),
-    db: AsyncSession = Depends(get_db),
 ):
 
     """
     The refresh_token function is used to refresh the access token.
         The function takes in a refresh token and returns a new access_token,
         refresh_token, and the type of bearer.
+        The refresh token is rotated in Redis, the database is not used.
+        A refresh token can be used once; using it again revokes every token that followed it.
 
     :param credentials: HTTPAuthorizationCredentials: Get the token from the request header
-    :param db: AsyncSession: Get the database session
-    :param : Get the user from the database
     :return: A new access token and refresh token
     :doc-author: Trelent
     """
-    token = credentials.credentials
-    email = await auth_service.decode_refresh_token(token)
-    user = await rep_users.get_user_by_email(email, db)
-    if user.refresh_token != token:
-        await rep_users.update_token(user, None, db)
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid credentials"
-        )
-    access_token = await auth_service.create_access_token(data={"sub": user.email})
-    refresh_token = await auth_service.create_refresh_token(data={"sub": user.email})
-    await rep_users.update_token(user, refresh_token, db)
+    email, refresh_token = await refresh_tokens.rotate(credentials.credentials)
+    access_token = await auth_service.create_access_token(data={"sub": email})
     return {
         "access_token": access_token,
         "refresh_token": refresh_token,
@@ -151,26 +143,26 @@ async def refresh_token(
 )
 async def logout(
     user=Depends(auth_service.get_current_user),
-    db=Depends(get_db),
+    token: str = Depends(auth_service.oauth2_scheme),
 ):
 
     """
-    The logout function will logout the user by removing their refresh token from the database.
+    The logout function will logout the user by revoking their refresh tokens
+    and the access token used for this request.
 
     :param user: Get the current user
-    :param db: Access the database
-    :param : Get the current user from the database
+    :param token: str: Get the access token from the authorization header
     :return: A dictionary with the result
     :doc-author: Trelent
     """
-    user.refresh_token = None
-    await db.commit()
+    await auth_service.revoke_token(token)
+    await refresh_tokens.revoke_user(user.email)
 
     return {"result": "Logout success"}
 
 
 @router.get(
-    "/confirmed_email/{token}", dependencies=[Depends(RateLimiter(times=1, hours=24))]
+    "/confirmed_email/{token}", dependencies=[Depends(RateLimiter(times=1, hours=24, identifier=ip_identifier))]
 )
 async def confirmed_email(token: str, db: AsyncSession = Depends(get_db)):
 
@@ -203,7 +195,6 @@ async def confirmed_email(token: str, db: AsyncSession = Depends(get_db)):
              )
 async def request_email(
     body: RequestEmail,
-    background_tasks: BackgroundTasks,
     request: Request,
     db: AsyncSession = Depends(get_db),
 ):
@@ -212,10 +203,9 @@ async def request_email(
     The request_email function is used to send an email to the user with a link that will confirm their account.
         The function takes in a RequestEmail object, which contains the user's email address.
         It then checks if there is already a confirmed account associated with that email address, and returns an error message if so.
-        If not, it sends an email containing a confirmation link.
+        If not, it puts an email containing a confirmation link into the outbox.
 
     :param body: RequestEmail: Get the email from the request body
-    :param background_tasks: BackgroundTasks: Add tasks to the background task queue
     :param request: Request: Get the base url of the server
     :param db: AsyncSession: Pass the database connection to the function
     :param : Get the user's email address
@@ -224,10 +214,9 @@ async def request_email(
     """
     user = await rep_users.get_user_by_email(body.email, db)
 
-    if user.confirm:
+    if user and user.confirm:
         return {"message": "Your email is already confirmed"}
     if user:
-        background_tasks.add_task(
-            send_email, user.email, user.username, str(request.base_url)
-        )
+        await rep_outbox.add_emails([verification_email(user.email, user.username, str(request.base_url))], db)
+        outbox_sender.wake()
     return {"message": "Check your email for confirmation."}
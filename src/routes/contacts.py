@@ -1,61 +1,280 @@
-from fastapi import APIRouter, HTTPException, Depends, status, Path, Query
-from fastapi_limiter.depends import RateLimiter
+from datetime import date
+
+from fastapi import APIRouter, HTTPException, Depends, status, Path, Query, Response, Request, Header
+from fastapi.responses import StreamingResponse
+from pydantic import TypeAdapter
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from src.database.db import get_db
+from src.database.db import get_db, get_read_db
 from src.entity.models import User
 from src.repository import contacts as rep_contacts
-from src.schemas.contact import ContactSchema, ContactUpdateSchema, ContactResponseSchema
+from src.schemas.contact import (
+    ContactSchema,
+    ContactUpdateSchema,
+    ContactResponseSchema,
+    ContactFieldsResponseSchema,
+    ContactRow,
+    ImportResponseSchema,
+    ContactBatchUpdateSchema,
+    ContactBatchDeleteSchema,
+    ContactBatchUpdateResponseSchema,
+    ContactBatchDeleteResponseSchema,
+)
 from src.services.auth import auth_service
+from src.services.etag import make_etag, etag_matches, not_modified, CACHE_CONTROL
+from src.services.response_cache import response_cache
+from src.services.contacts_io import ContactsFormat, MEDIA_TYPES, import_contacts, export_contacts
+from src.services.rate_limit import RateLimiter
+from src.conf import messages
 
 router = APIRouter(prefix='/contacts', tags=['contacts'])
 
+FIELDS = [*rep_contacts.CONTACT_FIELDS, "user"]
+DEFAULT_FIELDS = list(rep_contacts.CONTACT_FIELDS)
+CONTACT_ROWS = TypeAdapter(list[ContactRow])
+
+
+def contact_fields(
+        fields: str | None = Query(None, description=f"Comma separated fields to return, any of {', '.join(FIELDS)}. "
+                                                     f"By default every field except user is returned."),
+) -> list[str]:
+
+    """
+    The contact_fields function is a dependency that parses the fields query parameter of the read endpoints.
+
+    :param fields: str | None: Comma separated names of the fields to return
+    :return: The list of requested fields, or the default projection
+    :doc-author: Trelent
+    """
+    if fields is None:
+        return DEFAULT_FIELDS
+    requested = list(dict.fromkeys(name.strip() for name in fields.split(",") if name.strip()))
+    if not requested or not set(requested) <= set(FIELDS):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=messages.INVALID_FIELDS)
+    return requested
+
+
+def sparse(contact, fields: list[str], user) -> dict:
+
+    """
+    The sparse function builds a response body with only the requested fields of a contact row.
+    The owner is the current user, so user is filled in without a join when it is requested.
+
+    :param contact: Row: The contact row
+    :param fields: list[str]: The requested fields
+    :param user: User: The current user
+    :return: A dictionary matching ContactFieldsResponseSchema
+    :doc-author: Trelent
+    """
+    row = contact._mapping
+    return {name: user if name == "user" else row[name] for name in fields}
+
+
+def contacts_etag(version, fields: list[str], user) -> str:
+
+    """
+    The contacts_etag function builds the ETag of a contact response from the values it depends on.
+    The owner only changes the response when user is one of the requested fields.
+
+    :param version: tuple: The values the response depends on, such as ids and write versions
+    :param fields: list[str]: The requested fields
+    :param user: User: The current user
+    :return: A weak ETag
+    :doc-author: Trelent
+    """
+    return make_etag(*version, *owner(fields, user))
+
+
+def owner(fields: list[str], user) -> tuple:
+
+    """
+    The owner function lists the user columns a contact response contains.
+    They are empty unless user is one of the requested fields.
+
+    :param fields: list[str]: The requested fields
+    :param user: User: The current user
+    :return: A tuple of user columns
+    :doc-author: Trelent
+    """
+    return (user.username, user.email, user.avatar) if "user" in fields else ()
+
+
+def dump_contacts(contacts, fields: list[str], user) -> bytes:
+
+    """
+    The dump_contacts function serializes contact rows to the JSON body of a list endpoint,
+    so the same bytes can be sent and stored in the response cache.
+
+    The rows come from the database, so they are written straight to JSON without being validated
+    into response models first; the owner is converted to a dictionary once for the whole page.
+
+    :param contacts: list[Row]: The contact rows
+    :param fields: list[str]: The requested fields
+    :param user: User: The current user
+    :return: The JSON body
+    :doc-author: Trelent
+    """
+    if "user" in fields:
+        user = {"id": user.id, "username": user.username, "email": user.email, "avatar": user.avatar}
+    return CONTACT_ROWS.dump_json([sparse(contact, fields, user) for contact in contacts])
+
+
+async def rows_session(db: AsyncSession, primary: AsyncSession, user: User, version: int) -> AsyncSession:
+
+    """
+    The rows_session function picks the session the contact rows of a response are read from.
+    The version in the ETag and the cache key is read from the primary, so a client sees its own writes.
+    The read replica serves the rows only once it has replicated that version, otherwise the primary does,
+    so a response is never stored under a version its rows don't include yet.
+
+    :param db: AsyncSession: The read session, possibly bound to a replica
+    :param primary: AsyncSession: The session bound to the primary database
+    :param user: User: Whose contacts are read
+    :param version: int: The write version read from the primary
+    :return: The session to read the rows with
+    :doc-author: Trelent
+    """
+    if db.get_bind() is primary.get_bind():
+        return db
+    return db if await rep_contacts.write_version(db, user) >= version else primary
+
+
+def with_owner(contact, user) -> dict:
+
+    """
+    The with_owner function turns a contact row returned by a write into a response body.
+    The owner is the current user, so it is filled in without loading it from the database.
+
+    :param contact: Row: The contact row
+    :param user: User: The current user
+    :return: A dictionary matching ContactResponseSchema
+    :doc-author: Trelent
+    """
+    return {**contact._mapping, "user": user}
+
 
-@router.get("/", response_model=list[ContactResponseSchema],
+@router.get("/", response_model=list[ContactFieldsResponseSchema], response_model_exclude_unset=True,
             dependencies=[Depends(RateLimiter(times=3, seconds=60))])
 async def get_contacts(
+        if_none_match: str | None = Header(None),
         limit: int = Query(10, ge=10, le=500),
-        offset: int = Query(0, ge=0),
-        db: AsyncSession = Depends(get_db),
+        offset: int = Query(0, ge=0, description="Slow path, kept for backwards compatibility. Prefer cursor."),
+        cursor: str | None = Query(None, description="Opaque cursor taken from the X-Next-Cursor header"),
+        fields: list[str] = Depends(contact_fields),
+        db: AsyncSession = Depends(get_read_db),
+        primary: AsyncSession = Depends(get_db),
         user: User = Depends(auth_service.get_current_user),
 ):
 
     """
     The get_contacts function returns a list of contacts for the current user.
+        Pages are walked with the opaque cursor returned in the X-Next-Cursor header,
+        so every page costs the same regardless of depth. The offset parameter still works,
+        but deep offsets make the database skip every previous row.
+        Only the requested fields are selected and returned.
+        The response carries an ETag derived from the write version of the user, which every contact write bumps;
+        when If-None-Match already holds it, 304 is answered after a single primary key lookup.
+        Serialized pages are cached in Redis until the next write of the user.
+        The version is read from the primary database and the rows from a replica that has caught up with it.
 
+    :param if_none_match: str | None: ETag of the copy the client already has
     :param limit: int: Specify the number of contacts to return
     :param ge: Specify the minimum value of a parameter
     :param le: Limit the number of contacts returned to 500
     :param offset: int: Specify the number of records to skip
     :param ge: Specify a minimum value for the parameter
-    :param db: AsyncSession: Get the database session
+    :param cursor: str | None: Continue after the last contact of the previous page
+    :param fields: list[str]: The fields to return
+    :param db: AsyncSession: Get the read database session
+    :param primary: AsyncSession: Get the primary database session
     :param user: User: Get the current user from the database
     :param : Get the contact id from the url
     :return: A list of contacts
     :doc-author: Trelent
     """
-    contacts = await rep_contacts.get_contacts(limit, offset, db, user)
-    return contacts
+    # The version is read before the rows: a concurrent write can only make the ETag stale, never wrong.
+    version = await rep_contacts.write_version(primary, user)
+    etag = contacts_etag((user.id, version), fields, user)
+    if etag_matches(if_none_match, etag):
+        return not_modified(etag)
+    key = response_cache.key(user.id, version, "get_contacts", limit=limit, offset=offset, cursor=cursor,
+                             fields=fields, owner=owner(fields, user))
+    cached = await response_cache.get(key)
+    if cached is not None:
+        return cached
+    db = await rows_session(db, primary, user, version)
+    try:
+        contacts = await rep_contacts.get_contacts(limit, offset, db, user, cursor, fields)
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=messages.INVALID_CURSOR)
+    headers = {"ETag": etag, "Cache-Control": CACHE_CONTROL}
+    if len(contacts) == limit:
+        headers["X-Next-Cursor"] = rep_contacts.encode_cursor(contacts[-1])
+    return await response_cache.put(key, dump_contacts(contacts, fields, user), headers)
+
+
+@router.get("/export", response_class=StreamingResponse,
+            dependencies=[Depends(RateLimiter(times=1, seconds=60))])
+async def export_contact_file(fmt: ContactsFormat = Query(ContactsFormat.ndjson, alias="format"),
+                              db: AsyncSession = Depends(get_read_db),
+                              user: User = Depends(auth_service.get_current_user)):
+
+    """
+    The export_contact_file function streams all contacts of the current user as NDJSON or CSV.
+        Rows are read through a server-side cursor and sent with chunked encoding as they arrive,
+        so even a million contacts are exported with bounded memory. The CSV output can be
+        loaded back with POST /api/contacts/import.
+
+    :param fmt: ContactsFormat: The format of the export, ndjson or csv
+    :param db: AsyncSession: Get the database session
+    :param user: User: Get the current user
+    :return: A streaming response with the contacts
+    :doc-author: Trelent
+    """
+    return StreamingResponse(
+        export_contacts(fmt, db, user),
+        media_type=MEDIA_TYPES[fmt],
+        headers={"Content-Disposition": f'attachment; filename="contacts.{fmt.value}"'},
+    )
 
 
-@router.get("/{contact_id}", response_model=ContactResponseSchema,
+@router.get("/{contact_id}", response_model=ContactFieldsResponseSchema, response_model_exclude_unset=True,
             dependencies=[Depends(RateLimiter(times=3, seconds=60))])
-async def get_contact(contact_id: int = Path(ge=1), db: AsyncSession = Depends(get_db),
+async def get_contact(response: Response, contact_id: int = Path(ge=1), fields: list[str] = Depends(contact_fields),
+                      if_none_match: str | None = Header(None),
+                      db: AsyncSession = Depends(get_read_db),
+                      primary: AsyncSession = Depends(get_db),
                       user: User = Depends(auth_service.get_current_user)):
 
     """
     The get_contact function returns a contact by its id.
+        The ETag is derived from the updated_at of the contact and the write version of the user;
+        a matching If-None-Match is answered with 304 without loading the contact.
+        Both are read from the primary database, the contact itself from a replica that has caught up.
 
+    :param response: Response: Set the ETag header
     :param contact_id: int: Get the contact id from the path
-    :param db: AsyncSession: Pass the database session to the function
+    :param fields: list[str]: The fields to return
+    :param if_none_match: str | None: ETag of the copy the client already has
+    :param db: AsyncSession: Pass the read database session to the function
+    :param primary: AsyncSession: Pass the primary database session to the function
     :param user: User: Get the user from the auth_service
     :return: A contact object
     :doc-author: Trelent
     """
-    contact = await rep_contacts.get_contact(contact_id, db, user)
+    version = await rep_contacts.contact_version(contact_id, primary, user)
+    if version is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="NOT FOUND")
+    etag = contacts_etag((contact_id, *version), fields, user)
+    if etag_matches(if_none_match, etag):
+        return not_modified(etag)
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = CACHE_CONTROL
+    db = await rows_session(db, primary, user, version[1])
+    contact = await rep_contacts.get_contact(contact_id, db, user, fields)
     if contact is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="NOT FOUND")
-    return contact
+    return sparse(contact, fields, user)
 
 
 @router.post("/", response_model=ContactResponseSchema, status_code=status.HTTP_201_CREATED,
@@ -73,10 +292,73 @@ async def create_contact(body: ContactSchema, db: AsyncSession = Depends(get_db)
     :doc-author: Trelent
     """
     contact = await rep_contacts.create_contact(body, db, user)
-    return contact
+    return with_owner(contact, user)
+
+
+@router.post("/import", response_model=ImportResponseSchema,
+             dependencies=[Depends(RateLimiter(times=1, seconds=60))])
+async def import_contact_file(request: Request,
+                              fmt: ContactsFormat = Query(ContactsFormat.csv, alias="format"),
+                              db: AsyncSession = Depends(get_db),
+                              user: User = Depends(auth_service.get_current_user)):
 
+    """
+    The import_contact_file function loads many contacts from the raw request body.
+        The body is a CSV file with a header row (name, surname, email, phone, birthday, notes)
+        or NDJSON with one contact object per line. It is read as a stream, validated row by row
+        and inserted in batches, so large address books load in one request with constant memory.
+
+    :param request: Request: Read the body as a stream
+    :param fmt: ContactsFormat: The format of the body, csv or ndjson
+    :param db: AsyncSession: Get the database session
+    :param user: User: Get the current user
+    :return: The number of imported and failed rows with the errors of each failed row
+    :doc-author: Trelent
+    """
+    return await import_contacts(request.stream(), fmt, db, user)
 
-@router.put("/{contact_id}", dependencies=[Depends(RateLimiter(times=3, seconds=60))])
+
+@router.patch("/batch", response_model=ContactBatchUpdateResponseSchema,
+              dependencies=[Depends(RateLimiter(times=3, seconds=60))])
+async def update_contacts(body: ContactBatchUpdateSchema, db: AsyncSession = Depends(get_db),
+                          user: User = Depends(auth_service.get_current_user)):
+
+    """
+    The update_contacts function applies the same changes to many contacts in one round trip.
+        Only name, surname, birthday and notes can be changed this way. Ids that don't exist
+        or belong to another user are reported as missing.
+
+    :param body: ContactBatchUpdateSchema: The ids of the contacts and the changes to apply
+    :param db: AsyncSession: Get the database session
+    :param user: User: Get the current user
+    :return: The updated and the missing ids
+    :doc-author: Trelent
+    """
+    updated = await rep_contacts.update_contacts(body.ids, body.changes, db, user)
+    return {"updated": sorted(updated), "missing": sorted(set(body.ids) - set(updated))}
+
+
+@router.delete("/batch", response_model=ContactBatchDeleteResponseSchema,
+               dependencies=[Depends(RateLimiter(times=3, seconds=60))])
+async def delete_contacts(body: ContactBatchDeleteSchema, db: AsyncSession = Depends(get_db),
+                          user: User = Depends(auth_service.get_current_user)):
+
+    """
+    The delete_contacts function deletes many contacts in one round trip.
+        Ids that don't exist or belong to another user are reported as missing.
+
+    :param body: ContactBatchDeleteSchema: The ids of the contacts to delete
+    :param db: AsyncSession: Get the database session
+    :param user: User: Get the current user
+    :return: The deleted and the missing ids
+    :doc-author: Trelent
+    """
+    deleted = await rep_contacts.delete_contacts(body.ids, db, user)
+    return {"deleted": sorted(deleted), "missing": sorted(set(body.ids) - set(deleted))}
+
+
+@router.put("/{contact_id}", response_model=ContactResponseSchema,
+            dependencies=[Depends(RateLimiter(times=3, seconds=60))])
 async def update_contact(body: ContactUpdateSchema, contact_id: int = Path(ge=1),
                          db: AsyncSession = Depends(get_db),
                          user: User = Depends(auth_service.get_current_user)
@@ -98,10 +380,11 @@ async def update_contact(body: ContactUpdateSchema, contact_id: int = Path(ge=1)
     contact = await rep_contacts.update_contact(contact_id, body, db, user)
     if contact is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="NOT FOUND")
-    return contact
+    return with_owner(contact, user)
 
 
-@router.delete("/{contact_id}", dependencies=[Depends(RateLimiter(times=3, seconds=60))])
+@router.delete("/{contact_id}", response_model=ContactResponseSchema | None,
+               dependencies=[Depends(RateLimiter(times=3, seconds=60))])
 async def delete_contact(
         contact_id: int = Path(ge=1), db: AsyncSession = Depends(get_db),
         user: User = Depends(auth_service.get_current_user)
@@ -117,33 +400,50 @@ async def delete_contact(
     :doc-author: Trelent
     """
     contact = await rep_contacts.delete_contact(contact_id, db, user)
-    return contact
+    return with_owner(contact, user) if contact else None
 
 
-@router.get("/find/{query}", response_model=list[ContactResponseSchema],
+@router.get("/find/{query}", response_model=list[ContactFieldsResponseSchema], response_model_exclude_unset=True,
             dependencies=[Depends(RateLimiter(times=3, seconds=60))])
-async def find_contact(query: str, db: AsyncSession = Depends(get_db),
+async def find_contact(query: str, limit: int = Query(50, ge=1, le=500),
+                       fields: list[str] = Depends(contact_fields),
+                       db: AsyncSession = Depends(get_read_db),
+                       primary: AsyncSession = Depends(get_db),
                        user: User = Depends(auth_service.get_current_user)):
 
     """
     The find_contact function is used to find a contact in the database.
-        It takes a query string as an argument and returns all contacts that match the query.
+        It takes a query string as an argument and returns the contacts that match the query,
+        best matches first. Results are cached in Redis until the next write of the user,
+        whose version is read from the primary database.
 
     :param query: str: Search for a contact by name
-    :param db: AsyncSession: Get the database connection from the dependency injection
+    :param limit: int: Specify the number of contacts to return
+    :param fields: list[str]: The fields to return
+    :param db: AsyncSession: Get the read database connection from the dependency injection
+    :param primary: AsyncSession: Get the primary database connection from the dependency injection
     :param user: User: Get the current user
     :return: A list of dictionaries, where each dictionary represents a contact
     :doc-author: Trelent
     """
-    contacts = await rep_contacts.find_contacts(query, db, user)
+    version = await rep_contacts.write_version(primary, user)
+    key = response_cache.key(user.id, version, "find_contacts", query=query, limit=limit, fields=fields,
+                             owner=owner(fields, user))
+    cached = await response_cache.get(key)
+    if cached is not None:
+        return cached
+    db = await rows_session(db, primary, user, version)
+    contacts = await rep_contacts.find_contacts(query, db, user, limit, fields)
     if contacts is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="NOT FOUND")
-    return contacts
+    return await response_cache.put(key, dump_contacts(contacts, fields, user), {})
 
 
-@router.get("/upcoming_birthdays/", response_model=list[ContactResponseSchema],
-            dependencies=[Depends(RateLimiter(times=3, seconds=60))])
-async def upconming_birthday(db: AsyncSession = Depends(get_db),
+@router.get("/upcoming_birthdays/", response_model=list[ContactFieldsResponseSchema],
+            response_model_exclude_unset=True, dependencies=[Depends(RateLimiter(times=3, seconds=60))])
+async def upconming_birthday(days: int = Query(7, ge=1, le=365), fields: list[str] = Depends(contact_fields),
+                             db: AsyncSession = Depends(get_read_db),
+                             primary: AsyncSession = Depends(get_db),
                              user: User = Depends(auth_service.get_current_user)):
 
     """
@@ -151,13 +451,25 @@ async def upconming_birthday(db: AsyncSession = Depends(get_db),
         The function takes in the database session and the current user as parameters.
         It then calls the upcoming_birthday method from rep_contacts to get a list of contacts with upcoming birthdays.
         If no contact is found, it raises an HTTPException 404 NOT FOUND error.
+        Results are cached in Redis for the day, until the next write of the user,
+        whose version is read from the primary database.
 
-    :param db: AsyncSession: Get the database session
+    :param days: int: Specify how many days ahead to look
+    :param fields: list[str]: The fields to return
+    :param db: AsyncSession: Get the read database session
+    :param primary: AsyncSession: Get the primary database session
     :param user: User: Get the current user
     :return: A list of contacts that have upcoming birthdays
     :doc-author: Trelent
     """
-    contacts = await rep_contacts.upcoming_birthday(db, user)
+    version = await rep_contacts.write_version(primary, user)
+    key = response_cache.key(user.id, version, "upcoming_birthday", today=date.today(), days=days, fields=fields,
+                             owner=owner(fields, user))
+    cached = await response_cache.get(key)
+    if cached is not None:
+        return cached
+    db = await rows_session(db, primary, user, version)
+    contacts = await rep_contacts.upcoming_birthday(db, user, days, fields)
     if contacts is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="NOT FOUND")
-    return contacts
+    return await response_cache.put(key, dump_contacts(contacts, fields, user), {})
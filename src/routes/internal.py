@@ -0,0 +1,38 @@
+from fastapi import APIRouter, Depends
+
+from src.database.db import session_manager
+from src.services.auth import auth_service, require_internal_token
+from src.services.response_cache import response_cache
+from src.services.email import outbox_sender
+from src.services.avatars import avatar_pipeline
+from src.services.rate_limit import rate_limits
+from src.services.refresh_tokens import refresh_tokens
+from src.services.compression import compression_stats
+
+router = APIRouter(prefix="/internal", tags=["internal"], dependencies=[Depends(require_internal_token)])
+
+
+@router.get("/stats")
+async def stats():
+
+    """
+    The stats function reports internal counters of the running worker.
+    The numbers are per process, every worker keeps its own.
+    Only requests with the INTERNAL_TOKEN bearer token are answered.
+
+    :return: A dictionary with the cache, response cache, email sender, avatar pipeline, rate limiter,
+        refresh token, compression, password hash pool and database pool counters
+    :doc-author: Trelent
+    """
+    return {
+        "user_cache": auth_service.user_cache.stats(),
+        "token_cache": auth_service.token_cache.stats(),
+        "response_cache": response_cache.stats(),
+        "email_sender": outbox_sender.stats(),
+        "avatar_pipeline": avatar_pipeline.stats(),
+        "rate_limits": rate_limits.stats(),
+        "refresh_tokens": refresh_tokens.stats(),
+        "compression": compression_stats.stats(),
+        "password_hash_pool": auth_service.hash_pool.stats(),
+        "db_pool": session_manager.stats(),
+    }
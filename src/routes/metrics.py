@@ -0,0 +1,119 @@
+from fastapi import APIRouter, Depends
+from fastapi.responses import PlainTextResponse
+
+from src.database.db import session_manager
+from src.services.auth import auth_service, require_internal_token
+from src.services.metrics import request_metrics, format_metric, format_histograms
+from src.services.response_cache import response_cache
+from src.services.email import outbox_sender
+from src.services.rate_limit import rate_limits
+from src.services.refresh_tokens import refresh_tokens
+from src.services.compression import compression_stats
+
+router = APIRouter(tags=["internal"], dependencies=[Depends(require_internal_token)])
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def pool_metrics() -> str:
+
+    """
+    The pool_metrics function renders the state of the database connection pools.
+    The primary pool is labelled primary, replicas replica0, replica1 and so on.
+
+    :return: The rendered metrics
+    :doc-author: Trelent
+    """
+    stats = session_manager.stats()
+    pools = [("primary", stats)] + [(f"replica{index}", replica) for index, replica in enumerate(stats["replicas"])]
+    text = ""
+    for name, key, help_text in (("db_pool_size", "size", "Number of connections the pool keeps open."),
+                                 ("db_pool_checked_out", "checked_out", "Connections in use."),
+                                 ("db_pool_checked_in", "checked_in", "Idle connections in the pool."),
+                                 ("db_pool_overflow", "overflow", "Connections opened beyond the pool size.")):
+        text += format_metric(name, "gauge", help_text,
+                              [({"pool": pool}, pool_stats[key]) for pool, pool_stats in pools if key in pool_stats])
+    text += format_metric("db_replica_healthy", "gauge", "Whether the replica passed its last health check.",
+                          [({"pool": pool}, int(pool_stats["healthy"])) for pool, pool_stats in pools[1:]])
+    text += format_histograms("db_pool_wait_seconds", "Time spent waiting for a pooled connection.",
+                              [({"pool": pool}, pool_stats["wait_time"]) for pool, pool_stats in pools
+                               if "wait_time" in pool_stats])
+    return text
+
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+
+    """
+    The metrics function serves the counters of the running worker in the Prometheus text format:
+    request latency, status codes and in-flight requests per route template, the auth caches, the refresh tokens,
+    the response cache, the rate limiter, the email sender, the password hash pool and the database pools.
+    Prometheus must send the INTERNAL_TOKEN as its bearer token.
+    The numbers are per process, Prometheus should scrape every worker.
+
+    :return: A plain text response
+    :doc-author: Trelent
+    """
+    text = format_metric("http_requests_in_flight", "gauge", "Requests being served.",
+                         request_metrics.in_flight.samples())
+    text += format_metric("http_requests_total", "counter", "Finished requests by status code.",
+                          request_metrics.responses.samples())
+    text += format_histograms("http_request_duration_seconds", "Request latency.",
+                              [({"method": method, "route": route}, histogram.stats())
+                               for (method, route), histogram in request_metrics.latency.items()])
+
+    for name, cache in (("token", auth_service.token_cache), ("user", auth_service.user_cache)):
+        text += format_metric(f"auth_{name}_cache_hits_total", "counter", f"In-process {name} cache hits.",
+                              [({}, cache.hits)])
+        text += format_metric(f"auth_{name}_cache_misses_total", "counter", f"In-process {name} cache misses.",
+                              [({}, cache.misses)])
+    text += format_metric("auth_user_lookups_total", "counter", "Where authenticated users were loaded from.",
+                          auth_service.user_lookups.samples())
+
+    tokens = refresh_tokens.stats()
+    text += format_metric("refresh_token_events_total", "counter", "Refresh token families started, rotated, "
+                                                                   "migrated from legacy tokens and revoked for reuse.",
+                          [({"event": event}, count) for event, count in tokens.items()])
+
+    cache = response_cache.stats()
+    text += format_metric("response_cache_hits_total", "counter", "Responses served from Redis.",
+                          [({}, cache["hits"])])
+    text += format_metric("response_cache_misses_total", "counter", "Responses computed and stored in Redis.",
+                          [({}, cache["misses"])])
+    text += format_metric("response_cache_errors_total", "counter", "Failed Redis calls of the response cache.",
+                          [({}, cache["errors"])])
+    text += format_metric("response_cache_served_bytes_total", "counter", "Body bytes served from Redis.",
+                          [({}, cache["bytes_served"])])
+
+    limits = rate_limits.stats()
+    text += format_metric("rate_limit_requests_total", "counter", "Requests checked by the rate limiter.",
+                          [({"result": "allowed"}, limits["allowed"]), ({"result": "limited"}, limits["limited"])])
+    text += format_metric("rate_limit_buckets", "gauge", "Token buckets kept by the worker.",
+                          [({}, limits["buckets"])])
+    text += format_metric("rate_limit_sync_errors_total", "counter", "Failed syncs of the rate limits with Redis.",
+                          [({}, limits["errors"])])
+
+    text += format_metric("http_compressed_responses_total", "counter", "Responses compressed by content coding.",
+                          compression_stats.responses.samples())
+    text += format_metric("http_compression_input_bytes_total", "counter", "Body bytes before compression.",
+                          compression_stats.bytes_in.samples())
+    text += format_metric("http_compression_output_bytes_total", "counter", "Body bytes after compression.",
+                          compression_stats.bytes_out.samples())
+
+    sender = outbox_sender.stats()
+    text += format_metric("emails_sent_total", "counter", "Emails accepted by the SMTP server.",
+                          [({}, sender["sent"])])
+    text += format_metric("emails_failed_total", "counter", "Failed email attempts.", [({}, sender["failed"])])
+    text += format_metric("smtp_connections_total", "counter", "SMTP connections opened.",
+                          [({}, sender["connections"])])
+
+    pool = auth_service.hash_pool.stats()
+    text += format_metric("password_hash_in_flight", "gauge", "Password hashes being computed.",
+                          [({}, pool["in_flight"])])
+    text += format_metric("password_hash_queue_depth", "gauge", "Password hashes waiting for a worker.",
+                          [({}, pool["queue_depth"])])
+    text += format_metric("password_hash_rejected_total", "counter", "Password hashes refused because the pool "
+                                                                     "was full.", [({}, pool["rejected"])])
+
+    text += pool_metrics()
+    return PlainTextResponse(text, media_type=CONTENT_TYPE)
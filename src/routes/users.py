@@ -1,5 +1,3 @@
-import pickle
-
 from fastapi import (
     APIRouter,
     HTTPException,
@@ -7,30 +5,17 @@ from fastapi import (
     status,
     Path,
     Query,
-    UploadFile,
-    File,
+    Request,
 )
-from fastapi_limiter.depends import RateLimiter
-from sqlalchemy.ext.asyncio import AsyncSession
-import cloudinary
-import cloudinary.uploader
 
-from src.database.db import get_db
 from src.entity.models import User
 from src.schemas.user import UserResponseSchema
 from src.services.auth import auth_service
-from src.conf.config import config
-from src.repository import users as rep_users
+from src.services.avatars import avatar_pipeline
+from src.services.rate_limit import RateLimiter
 
 router = APIRouter(prefix="/users", tags=["users"])
 
-cloudinary.config(
-    cloud_name=config.CLD_NAME,
-    api_key=config.CLD_API_KEY,
-    api_secret=config.CLD_API_SECRET,
-    secure=True,
-)
-
 
 @router.get(
     "/me",
@@ -54,33 +39,27 @@ async def get_current_user(user: User = Depends(auth_service.get_current_user)):
 @router.patch(
     "/avatar",
     response_model=UserResponseSchema,
+    status_code=status.HTTP_202_ACCEPTED,
     dependencies=[Depends(RateLimiter(times=1, seconds=20))],
+    openapi_extra={"requestBody": {"required": True, "content": {"multipart/form-data": {"schema": {
+        "type": "object", "required": ["file"], "properties": {"file": {"type": "string", "format": "binary"}},
+    }}}}},
 )
-async def get_current_user(
-    file: UploadFile = File(),
+async def update_avatar(
+    request: Request,
     user: User = Depends(auth_service.get_current_user),
-    db: AsyncSession = Depends(get_db),
 ):
 
     """
-    The get_current_user function is a dependency that will be used in the
-        protected endpoints. It uses the auth_service to get the current user,
-        and then it returns that user object.
+    The update_avatar function accepts a new avatar and queues it for processing.
+    It answers as soon as the upload is spooled: the image is resized, deduplicated and stored
+    in the background, and the user's avatar url changes once that is done.
+    The form is read from the request stream, so an upload over AVATAR_MAX_BYTES is refused as it arrives.
 
-    :param file: UploadFile: Get the file from the request
+    :param request: Request: The multipart/form-data request with the image in its file field
     :param user: User: Get the current user
-    :param db: AsyncSession: Get the database session from the dependency injection
-    :param : Get the current user
-    :return: The current user,
+    :return: The current user, still with the previous avatar
     :doc-author: Trelent
     """
-    public_id = f"contacts_web/{user.email}"
-    res = cloudinary.uploader.upload(file.file, public_id=public_id, owerite=True)
-    print(res)
-    res_url = cloudinary.CloudinaryImage(public_id).build_url(
-        width=250, height=250, crop="fill", version=res.get("version")
-    )
-    user = await rep_users.update_avatar_url(user.email, res_url, db)
-    auth_service.cache.set(user.email, pickle.dumps(user))
-    auth_service.cache.expire(user.email, 300)
+    await avatar_pipeline.submit(user.email, request)
     return user
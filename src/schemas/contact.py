@@ -1,8 +1,10 @@
 from datetime import date, datetime
 from typing import Optional
 
-from pydantic import BaseModel, EmailStr, Field, ConfigDict
+from pydantic import BaseModel, EmailStr, Field, ConfigDict, model_validator
+from typing_extensions import TypedDict
 
+from src.conf.config import config
 from src.schemas.user import UserResponseSchema
 
 
@@ -26,7 +28,7 @@ class ContactResponseSchema(BaseModel):
     email: EmailStr
     phone: str
     birthday: date
-    notes: str
+    notes: str | None
     created_at: datetime | None
     updated_at: datetime | None
     user: UserResponseSchema | None
@@ -34,3 +36,84 @@ class ContactResponseSchema(BaseModel):
 
     # class Config:
     #     from_attributes = True
+
+
+class ContactFieldsResponseSchema(BaseModel):
+    # Read endpoints return only the requested fields, the others are left unset and dropped
+    id: int = None
+    name: str = None
+    surname: str = None
+    email: EmailStr = None
+    phone: str = None
+    birthday: date | None = None
+    notes: str | None = None
+    created_at: datetime | None = None
+    updated_at: datetime | None = None
+    user: UserResponseSchema | None = None
+
+
+class UserRow(TypedDict):
+    id: int
+    username: str
+    email: str
+    avatar: str | None
+
+
+class ContactRow(TypedDict, total=False):
+    # Serialization-only twin of ContactFieldsResponseSchema for rows read from the database:
+    # they are trusted, so they are dumped as they are instead of being validated into models first
+    id: int
+    name: str
+    surname: str
+    email: str
+    phone: str
+    birthday: date | None
+    notes: str | None
+    created_at: datetime | None
+    updated_at: datetime | None
+    user: UserRow | None
+
+
+class ImportRowErrorSchema(BaseModel):
+    row: int
+    errors: list[str]
+
+
+class ImportResponseSchema(BaseModel):
+    imported: int
+    failed: int
+    errors: list[ImportRowErrorSchema]
+    errors_truncated: bool = False
+
+
+class ContactBatchChangesSchema(BaseModel):
+    # email and phone are unique, so they can't be set on many contacts at once
+    name: str = Field(None, min_length=2, max_length=25)
+    surname: str = Field(None, min_length=2, max_length=50)
+    birthday: date = Field(None)
+    notes: Optional[str] = Field(None, max_length=500)
+
+    @model_validator(mode="after")
+    def check_not_empty(self):
+        if not self.model_fields_set:
+            raise ValueError("At least one field must be changed")
+        return self
+
+
+class ContactBatchUpdateSchema(BaseModel):
+    ids: list[int] = Field(min_length=1, max_length=config.BATCH_MAX_IDS)
+    changes: ContactBatchChangesSchema
+
+
+class ContactBatchDeleteSchema(BaseModel):
+    ids: list[int] = Field(min_length=1, max_length=config.BATCH_MAX_IDS)
+
+
+class ContactBatchUpdateResponseSchema(BaseModel):
+    updated: list[int]
+    missing: list[int]
+
+
+class ContactBatchDeleteResponseSchema(BaseModel):
+    deleted: list[int]
+    missing: list[int]
@@ -1,31 +1,41 @@
+import hashlib
+import hmac
+import time
 from datetime import datetime, timedelta
 from typing import Optional
-import pickle
 
-import redis
+import redis.asyncio as redis
 from fastapi import Depends, HTTPException, status
 from passlib.context import CryptContext
-from fastapi.security import OAuth2PasswordBearer
+from fastapi.security import OAuth2PasswordBearer, HTTPBearer, HTTPAuthorizationCredentials
 from sqlalchemy.ext.asyncio import AsyncSession
 from jose import JWTError, jwt
 
 from src.database.db import get_db
 from src.repository import users as rep_users
 from src.conf.config import config
+from src.conf import messages
+from src.services.cache import TTLCache
+from src.services.codec import CachedUser, encode_user, decode_user
+from src.services.metrics import Counter
+from src.services.workers import BoundedPool, PoolSaturated
 
 
 class Auth:
     pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
     SECRET_KEY = config.SECRET_KEY
     ALGORITHM = config.ALGORITHM
-    cache = redis.Redis(
-        host=config.REDIS_DOMAIN,
-        port=config.REDIS_PORT,
-        db=0,
-        password=config.REDIS_PASSWORD,
-    )
-    SECRET_KEY = config.SECRET_KEY
-    ALGORITHM = config.ALGORITHM
+    # Bound to the shared connection pool on application startup, see main.startup
+    cache: redis.Redis | None = None
+    user_cache = TTLCache(maxsize=config.USER_L1_CACHE_SIZE, ttl=config.USER_L1_CACHE_TTL)
+    # Decoded access token claims keyed by token digest. Entries live until the token expires,
+    # but at most TOKEN_CACHE_TTL seconds, which bounds how late other workers notice a logout.
+    token_cache = TTLCache(maxsize=config.TOKEN_CACHE_SIZE, ttl=config.TOKEN_CACHE_TTL)
+    # Where get_current_user found the user: the in-process cache (l1), Redis or the database
+    user_lookups = Counter(("source",))
+    # bcrypt releases the GIL, so worker threads hash in parallel without blocking the event loop
+    hash_pool = BoundedPool(workers=config.PASSWORD_HASH_WORKERS, queue_size=config.PASSWORD_HASH_QUEUE,
+                            name="bcrypt")
 
     def verify_password(self, plain_password, hashed_password):
 
@@ -55,6 +65,52 @@ class Auth:
         """
         return self.pwd_context.hash(password)
 
+    async def _run_in_hash_pool(self, fn, *args):
+
+        """
+        The _run_in_hash_pool function runs a password function on the bounded hash pool.
+        When the pool and its queue are full the request is refused with 503 instead of waiting.
+
+        :param self: Represent the instance of the class
+        :param fn: The blocking password function
+        :param args: Arguments for the function
+        :return: The result of the function
+        :doc-author: Trelent
+        """
+        try:
+            return await self.hash_pool.run(fn, *args)
+        except PoolSaturated:
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail=messages.SERVICE_BUSY,
+                headers={"Retry-After": "1"},
+            )
+
+    async def verify_password_async(self, plain_password, hashed_password):
+
+        """
+        The verify_password_async function is verify_password run on the hash pool, off the event loop.
+
+        :param self: Represent the instance of the class
+        :param plain_password: The password entered by the user
+        :param hashed_password: The hashed password stored in the database
+        :return: A boolean value
+        :doc-author: Trelent
+        """
+        return await self._run_in_hash_pool(self.verify_password, plain_password, hashed_password)
+
+    async def get_password_hash_async(self, password: str):
+
+        """
+        The get_password_hash_async function is get_password_hash run on the hash pool, off the event loop.
+
+        :param self: Represent the instance of the class
+        :param password: str: Pass in the password that we want to hash
+        :return: A hash of the password
+        :doc-author: Trelent
+        """
+        return await self._run_in_hash_pool(self.get_password_hash, password)
+
     oauth2_scheme = OAuth2PasswordBearer(tokenUrl="api/auth/login")
 
     async def create_access_token(
@@ -93,7 +149,7 @@ class Auth:
         The create_refresh_token function creates a refresh token for the user.
             Args:
                 data (dict): A dictionary containing the user's id and username.
-                expires_telta (Optional[float]): The number of seconds until the token expires. Defaults to None, which sets it to 7 days from now.
+                expires_telta (Optional[float]): The number of seconds until the token expires. Defaults to None, which sets it to REFRESH_TOKEN_TTL seconds (7 days) from now.
 
         :param self: Represent the instance of the class
         :param data: dict: Pass the user information
@@ -105,7 +161,7 @@ class Auth:
         if expires_telta:
             expire = datetime.utcnow() + timedelta(seconds=expires_telta)
         else:
-            expire = datetime.utcnow() + timedelta(days=7)
+            expire = datetime.utcnow() + timedelta(seconds=config.REFRESH_TOKEN_TTL)
         to_encode.update(
             {"iat": datetime.utcnow(), "exp": expire, "scope": "refresh_token"}
         )
@@ -122,11 +178,14 @@ class Auth:
         The get_current_user function is a dependency that will be used in the
             protected endpoints. It takes a token as an argument and returns the user
             associated with that token. If no user is found, it raises an exception.
+            Users missing from the caches are loaded from the primary database, never from a replica,
+            which may not have a user who just signed up or confirmed the email yet. Routes that write
+            get the same session, FastAPI caches the dependency per request.
 
         :param self: Refer to the class itself
         :param token: str: Get the token from the authorization header
         :param db: AsyncSession: Create a database session
-        :return: A user object
+        :return: A CachedUser object
         :doc-author: Trelent
         """
         credentials_exception = HTTPException(
@@ -135,59 +194,155 @@ class Auth:
             headers={"WWW-Authenticate": "Bearer"},
         )
 
-        try:
-            # Decode JWT
-            payload = jwt.decode(token, self.SECRET_KEY, algorithms=[self.ALGORITHM])
-            if payload["scope"] == "access_token":
-                email = payload["sub"]
-                if email is None:
+        token_key = self.token_digest(token)
+        payload = self.token_cache.get(token_key)
+        if payload is None:
+            try:
+                # Decode JWT
+                payload = jwt.decode(token, self.SECRET_KEY, algorithms=[self.ALGORITHM])
+                if payload["scope"] == "access_token":
+                    if payload["sub"] is None:
+                        raise credentials_exception
+                else:
                     raise credentials_exception
-            else:
+            except JWTError as e:
                 raise credentials_exception
-        except JWTError as e:
-            raise credentials_exception
+            if await self.cache.exists(f"revoked:{token_key}"):
+                raise credentials_exception
+            self.token_cache.set(token_key, payload, ttl=min(self.token_cache.ttl, payload["exp"] - time.time()))
+        email = payload["sub"]
         user_hash = str(email)
-        user = self.cache.get(user_hash)
+        user = self.user_cache.get(user_hash)
+        if user is not None:
+            self.user_lookups.inc("l1")
+            return user
+        user = await self.cache.get(user_hash)
+        if user is not None:
+            user = decode_user(user)
 
         if user is None:
             user = await rep_users.get_user_by_email(email, db)
-            print("from db")
+            self.user_lookups.inc("db")
             if user is None:
                 raise credentials_exception
-            self.cache.set(user_hash, pickle.dumps(user))
-            self.cache.expire(user_hash, 300)
+            user = await self.cache_user(user)
         else:
-            user = pickle.loads(user)
-            print("from cache")
+            self.user_cache.set(user_hash, user)
+            self.user_lookups.inc("redis")
         return user
 
-    async def decode_refresh_token(self, refresh_token: str):
+    def access_token_subject(self, token: str) -> str | None:
 
         """
-        The decode_refresh_token function is used to decode the refresh token.
-        It will raise an exception if the token is invalid or has expired.
+        The access_token_subject function returns the user of an access token whose signature and expiry
+        check out, without loading the user or asking Redis whether the token was revoked.
+        It is meant for deciding whose request it is before the request is authenticated.
+
+        :param self: Represent the instance of the class
+        :param token: str: The encoded JWT
+        :return: The email of the user, or None if the token is not a valid access token
+        :doc-author: Trelent
+        """
+        payload = self.token_cache.get(self.token_digest(token))
+        if payload is None:
+            try:
+                payload = jwt.decode(token, self.SECRET_KEY, algorithms=[self.ALGORITHM])
+            except JWTError:
+                return None
+            if payload.get("scope") != "access_token":
+                return None
+        return payload.get("sub")
+
+    @staticmethod
+    def token_digest(token: str) -> str:
+
+        """
+        The token_digest function returns the key under which a token is cached or revoked.
+        Only the digest is kept, never the token itself.
+
+        :param token: str: The encoded JWT
+        :return: The hex sha256 digest of the token
+        :doc-author: Trelent
+        """
+        return hashlib.sha256(token.encode()).hexdigest()
+
+    async def revoke_token(self, token: str) -> None:
+
+        """
+        The revoke_token function revokes an access token before it expires, for example on logout.
+        The token is dropped from the verified-token cache and its digest is kept in Redis
+        until the token would have expired, so no worker accepts it again.
+
+        :param self: Represent the instance of the class
+        :param token: str: The access token to revoke
+        :return: None
+        :doc-author: Trelent
+        """
+        token_key = self.token_digest(token)
+        self.token_cache.pop(token_key)
+        try:
+            payload = jwt.decode(token, self.SECRET_KEY, algorithms=[self.ALGORITHM])
+        except JWTError:
+            return
+        ttl = int(payload["exp"] - time.time()) + 1
+        if ttl > 0:
+            await self.cache.set(f"revoked:{token_key}", 1, ex=ttl)
+
+    async def cache_user(self, user) -> CachedUser:
+
+        """
+        The cache_user function stores the user in the in-process cache and in Redis with a single SET EX call.
+        It is also used to refresh both caches after the user has been changed.
+
+        :param self: Represent the instance of the class
+        :param user: User | CachedUser: The user to cache
+        :return: The CachedUser that was stored
+        :doc-author: Trelent
+        """
+        if not isinstance(user, CachedUser):
+            user = CachedUser.from_user(user)
+        self.user_cache.set(user.email, user)
+        await self.cache.set(user.email, encode_user(user), ex=config.USER_CACHE_TTL)
+        return user
+
+    async def decode_refresh_claims(self, refresh_token: str) -> dict:
+
+        """
+        The decode_refresh_claims function verifies a refresh token and returns its claims.
 
         :param self: Represent the instance of the class
         :param refresh_token: str: Pass the refresh token to the function
-        :return: The email address of the user who requested a refresh token
+        :return: The claims of the token
         :doc-author: Trelent
         """
         try:
             payload = jwt.decode(
-                refresh_token, self.SECRET_KEY, algorithm=[self.ALGORITHM]
+                refresh_token, self.SECRET_KEY, algorithms=[self.ALGORITHM]
             )
-            if payload["scope"] == "refresh_token":
-                email = payload["sub"]
-                return email
+        except JWTError:
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
-                detail="Invalid scope for token",
+                detail="Could not validate credentials",
             )
-        except JWTError:
+        if payload.get("scope") != "refresh_token":
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
-                detail="Could not validate credentials",
+                detail="Invalid scope for token",
             )
+        return payload
+
+    async def decode_refresh_token(self, refresh_token: str):
+
+        """
+        The decode_refresh_token function is used to decode the refresh token.
+        It will raise an exception if the token is invalid or has expired.
+
+        :param self: Represent the instance of the class
+        :param refresh_token: str: Pass the refresh token to the function
+        :return: The email address of the user who requested a refresh token
+        :doc-author: Trelent
+        """
+        return (await self.decode_refresh_claims(refresh_token))["sub"]
 
     def create_email_token(self, data: dict):
 
@@ -252,3 +407,27 @@ class Auth:
 
 
 auth_service = Auth()
+
+
+internal_bearer = HTTPBearer(auto_error=False)
+
+
+async def require_internal_token(
+    credentials: HTTPAuthorizationCredentials | None = Depends(internal_bearer),
+) -> None:
+
+    """
+    The require_internal_token function is a dependency that guards the endpoints exposing the internals
+    of the worker. They are hidden with 404 unless INTERNAL_TOKEN is configured, and then answer only
+    requests that send it as a bearer token, as Prometheus does with its bearer_token setting.
+
+    :param credentials: HTTPAuthorizationCredentials | None: The bearer token of the request
+    :return: None
+    :doc-author: Trelent
+    """
+    if not config.INTERNAL_TOKEN:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not Found")
+    if credentials is None or not hmac.compare_digest(credentials.credentials.encode(),
+                                                      config.INTERNAL_TOKEN.encode()):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail=messages.INTERNAL_FORBIDDEN,
+                            headers={"WWW-Authenticate": "Bearer"})
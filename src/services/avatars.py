@@ -0,0 +1,383 @@
+import asyncio
+import hashlib
+import threading
+from abc import ABC, abstractmethod
+from io import BytesIO
+from pathlib import Path
+from typing import AsyncContextManager, BinaryIO, Callable
+
+import cloudinary
+import cloudinary.api
+import cloudinary.uploader
+from cloudinary.exceptions import NotFound, RateLimited
+from fastapi import HTTPException, Request, status
+from fastapi.staticfiles import StaticFiles
+from PIL import Image, ImageOps
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.datastructures import UploadFile
+from starlette.formparsers import MultiPartException, MultiPartParser
+from starlette.types import Scope
+
+from src.conf import messages
+from src.conf.config import config
+from src.database.db import session_manager
+from src.repository import users as rep_users
+from src.services.auth import auth_service
+from src.services.cache import TTLCache
+from src.services.workers import BoundedPool
+
+CHUNK_SIZE = 64 * 1024
+IMMUTABLE = "public, max-age=31536000, immutable"
+# Room for the multipart boundaries and part headers around the file itself
+FORM_OVERHEAD = 16 * 1024
+
+
+class AvatarStorage(ABC):
+    """
+    The AvatarStorage class is the interface of the places avatars are kept in.
+    Keys are content hashes, so a stored file never changes and may be cached forever.
+    The methods block; the pipeline calls them on its worker pool, never on the event loop.
+    """
+    @abstractmethod
+    def exists(self, key: str) -> bool:
+
+        """
+        The exists function tells whether a file was stored under the key.
+
+        :param self: Represent the instance of the class
+        :param key: str: The key of the file
+        :return: True if the file is stored
+        :doc-author: Trelent
+        """
+
+    @abstractmethod
+    def save(self, key: str, data: bytes) -> None:
+
+        """
+        The save function stores a JPEG image under the key.
+
+        :param self: Represent the instance of the class
+        :param key: str: The key of the file
+        :param data: bytes: The image
+        :return: None
+        :doc-author: Trelent
+        """
+
+    @abstractmethod
+    def url(self, key: str) -> str:
+
+        """
+        The url function returns the address the stored file is served from.
+
+        :param self: Represent the instance of the class
+        :param key: str: The key of the file
+        :return: The url
+        :doc-author: Trelent
+        """
+
+
+class CloudinaryStorage(AvatarStorage):
+    """
+    The CloudinaryStorage class keeps avatars in Cloudinary, in the given folder.
+    Looking a file up goes through the Admin API, which Cloudinary limits to a few hundred calls
+    an hour per account. Keys known to be stored are therefore remembered for a while, and a
+    rate-limited lookup is treated as a miss, since uploading again is allowed and harmless.
+
+    :param folder: str: Folder of the public ids
+    """
+    def __init__(self, folder: str = "contacts_web/avatars"):
+        self.folder = folder
+        self.known = TTLCache(maxsize=config.AVATAR_KNOWN_KEYS_SIZE, ttl=config.AVATAR_KNOWN_KEYS_TTL)
+        self._lock = threading.Lock()
+
+    def exists(self, key: str) -> bool:
+        with self._lock:
+            if self.known.get(key):
+                return True
+        try:
+            cloudinary.api.resource(f"{self.folder}/{key}")
+        except (NotFound, RateLimited):
+            return False
+        with self._lock:
+            self.known.set(key, True)
+        return True
+
+    def save(self, key: str, data: bytes) -> None:
+        cloudinary.uploader.upload(data, public_id=f"{self.folder}/{key}", overwrite=True)
+        with self._lock:
+            self.known.set(key, True)
+
+    def url(self, key: str) -> str:
+        return cloudinary.CloudinaryImage(f"{self.folder}/{key}").build_url(format="jpg", secure=True)
+
+
+class LocalStorage(AvatarStorage):
+    """
+    The LocalStorage class keeps avatars as files in a directory that the application serves itself,
+    see AvatarFiles.
+
+    :param directory: Path: Where the files are written
+    :param base_url: str: The url the directory is mounted at
+    """
+    def __init__(self, directory: Path, base_url: str):
+        self.directory = Path(directory)
+        self.base_url = base_url.rstrip("/")
+
+    def exists(self, key: str) -> bool:
+        return (self.directory / f"{key}.jpg").exists()
+
+    def save(self, key: str, data: bytes) -> None:
+        self.directory.mkdir(parents=True, exist_ok=True)
+        path = self.directory / f"{key}.jpg"
+        partial = path.with_suffix(".part")
+        partial.write_bytes(data)
+        partial.replace(path)
+
+    def url(self, key: str) -> str:
+        return f"{self.base_url}/{key}.jpg"
+
+
+class AvatarFiles(StaticFiles):
+    """
+    The AvatarFiles class serves the directory of LocalStorage. Files are named after their content,
+    so browsers and proxies are told to keep them for a year without revalidating.
+    """
+    async def get_response(self, path: str, scope: Scope):
+        response = await super().get_response(path, scope)
+        if response.status_code in (200, 304):
+            response.headers["Cache-Control"] = IMMUTABLE
+        return response
+
+
+def content_hash(source: BinaryIO) -> str:
+
+    """
+    The content_hash function hashes the uploaded file, reading it in chunks.
+
+    :param source: BinaryIO: The uploaded file
+    :return: The hex digest
+    :doc-author: Trelent
+    """
+    source.seek(0)
+    digest = hashlib.sha256()
+    while chunk := source.read(CHUNK_SIZE):
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
+def render_avatar(source: BinaryIO, sizes: tuple[int, ...]) -> dict[int, bytes]:
+
+    """
+    The render_avatar function crops the uploaded image to squares of the given sizes,
+    honouring the EXIF orientation, and encodes them as JPEG.
+
+    :param source: BinaryIO: The uploaded file
+    :param sizes: tuple[int, ...]: Side lengths in pixels
+    :return: The JPEG bytes by size
+    :raises PIL.UnidentifiedImageError: If the file is not an image
+    :doc-author: Trelent
+    """
+    source.seek(0)
+    with Image.open(source) as image:
+        image.draft("RGB", (max(sizes), max(sizes)))
+        image = ImageOps.exif_transpose(image).convert("RGB")
+        renditions = {}
+        for size in sizes:
+            buffer = BytesIO()
+            ImageOps.fit(image, (size, size), Image.LANCZOS).save(buffer, "JPEG", quality=85, optimize=True)
+            renditions[size] = buffer.getvalue()
+    return renditions
+
+
+class UploadTooLarge(MultiPartException):
+    """
+    The UploadTooLarge exception stops the multipart parser once the body grows past the limit.
+    It is a MultiPartException, so the parser closes the files it has spooled so far.
+    """
+
+
+async def receive_upload(request: Request, field: str, max_bytes: int) -> UploadFile:
+
+    """
+    The receive_upload function reads one file from a multipart/form-data request body.
+    The size is checked while the body arrives: a Content-Length over the limit is refused before
+    anything is read, and a body that turns out larger is dropped at the first chunk past the limit.
+    The file is spooled once; small files stay in memory, larger ones go to disk. The caller owns it
+    and must close it.
+
+    :param request: Request: The request with the form
+    :param field: str: Name of the file field
+    :param max_bytes: int: Largest accepted file
+    :return: The uploaded file
+    :raises HTTPException: 413 if the file is larger than max_bytes, 400 if the form is malformed,
+        422 if the field is missing
+    :doc-author: Trelent
+    """
+    limit = max_bytes + FORM_OVERHEAD
+    length = request.headers.get("content-length", "")
+    if length.isdigit() and int(length) > limit:
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=messages.AVATAR_TOO_LARGE)
+    if not request.headers.get("content-type", "").startswith("multipart/form-data"):
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=messages.AVATAR_MISSING)
+
+    async def limited():
+        received = 0
+        async for chunk in request.stream():
+            received += len(chunk)
+            if received > limit:
+                raise UploadTooLarge(messages.AVATAR_TOO_LARGE)
+            yield chunk
+
+    parser = MultiPartParser(request.headers, limited(), max_files=1, max_fields=10)
+    parser.max_file_size = config.AVATAR_SPOOL_BYTES
+    try:
+        form = await parser.parse()
+    except UploadTooLarge:
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=messages.AVATAR_TOO_LARGE)
+    except MultiPartException as err:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=err.message)
+    upload = form.get(field)
+    if not isinstance(upload, UploadFile):
+        for value in form.values():
+            if isinstance(value, UploadFile):
+                value.file.close()
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=messages.AVATAR_MISSING)
+    if upload.size > max_bytes:
+        upload.file.close()
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=messages.AVATAR_TOO_LARGE)
+    return upload
+
+
+class AvatarPipeline:
+    """
+    The AvatarPipeline class processes uploaded avatars in the background.
+    A job hashes the upload, skips the work when an image with the same content is stored already,
+    otherwise renders the avatar and its thumbnail, stores both and points the user at the new avatar.
+    The blocking steps run on a bounded worker pool; when the pool is full, new uploads are refused with 503.
+
+    :param storage: AvatarStorage: Where the images are kept
+    :param pool: BoundedPool: Runs the blocking steps
+    :param session: Callable: Opens a database session, session_manager.session by default
+    """
+    def __init__(self, storage: AvatarStorage, pool: BoundedPool,
+                 session: Callable[[], AsyncContextManager[AsyncSession]] = session_manager.session):
+
+        """
+        The __init__ function stores the collaborators and zeroes the counters.
+
+        :param self: Represent the instance of the class
+        :param storage: AvatarStorage: Where the images are kept
+        :param pool: BoundedPool: Runs the blocking steps
+        :param session: Callable: Opens a database session
+        :return: None
+        :doc-author: Trelent
+        """
+        self.storage = storage
+        self.pool = pool
+        self.session = session
+        self.processed = 0
+        self.deduplicated = 0
+        self.failed = 0
+        self.rejected = 0
+        self._jobs: set[asyncio.Task] = set()
+
+    async def submit(self, email: str, request: Request) -> None:
+
+        """
+        The submit function receives the file field of the request form and queues its processing.
+        A busy pipeline refuses the upload before reading the body. It returns before the image is processed.
+
+        :param self: Represent the instance of the class
+        :param email: str: The user the avatar belongs to
+        :param request: Request: The multipart/form-data request with the image in its file field
+        :return: None
+        :raises HTTPException: 415 if the upload is not an image, 413 if it is too large, 503 if too many jobs wait
+        :doc-author: Trelent
+        """
+        if len(self._jobs) >= self.pool.workers + self.pool.queue_size:
+            self.rejected += 1
+            raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=messages.SERVICE_BUSY,
+                                headers={"Retry-After": "1"})
+        upload = await receive_upload(request, "file", config.AVATAR_MAX_BYTES)
+        if not (upload.content_type or "").startswith("image/"):
+            upload.file.close()
+            raise HTTPException(status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE, detail=messages.AVATAR_NOT_IMAGE)
+        job = asyncio.create_task(self.process(email, upload.file))
+        self._jobs.add(job)
+        job.add_done_callback(self._jobs.discard)
+
+    async def process(self, email: str, source: BinaryIO) -> str | None:
+
+        """
+        The process function runs one job and closes the spooled upload. Failures are logged, the avatar stays as it was.
+
+        :param self: Represent the instance of the class
+        :param email: str: The user the avatar belongs to
+        :param source: BinaryIO: The spooled upload
+        :return: The new avatar url, or None if the job failed
+        :doc-author: Trelent
+        """
+        try:
+            digest = (await self.pool.run(content_hash, source))[:32]
+            avatar_key = f"{digest}_{config.AVATAR_SIZE}"
+            if await self.pool.run(self.storage.exists, avatar_key):
+                self.deduplicated += 1
+            else:
+                renditions = await self.pool.run(render_avatar, source,
+                                                 (config.AVATAR_SIZE, config.AVATAR_THUMBNAIL_SIZE))
+                # The avatar goes last, so once it exists the thumbnail does too
+                await self.pool.run(self.storage.save, f"{digest}_{config.AVATAR_THUMBNAIL_SIZE}",
+                                    renditions[config.AVATAR_THUMBNAIL_SIZE])
+                await self.pool.run(self.storage.save, avatar_key, renditions[config.AVATAR_SIZE])
+            url = self.storage.url(avatar_key)
+            async with self.session() as db:
+                user = await rep_users.update_avatar_url(email, url, db)
+            await auth_service.cache_user(user)
+            self.processed += 1
+            return url
+        except Exception as e:
+            self.failed += 1
+            print(f"Avatar of {email} failed: {e!r}")
+            return None
+        finally:
+            source.close()
+
+    async def join(self) -> None:
+
+        """
+        The join function waits until the queued jobs are done.
+
+        :param self: Represent the instance of the class
+        :return: None
+        :doc-author: Trelent
+        """
+        if self._jobs:
+            await asyncio.wait(set(self._jobs))
+
+    def stats(self) -> dict:
+
+        """
+        The stats function reports the job counters and the state of the worker pool.
+
+        :param self: Represent the instance of the class
+        :return: A dictionary with the counters
+        :doc-author: Trelent
+        """
+        return {"queued": len(self._jobs), "processed": self.processed, "deduplicated": self.deduplicated,
+                "failed": self.failed, "rejected": self.rejected, "pool": self.pool.stats()}
+
+
+AVATAR_DIR = Path(__file__).resolve().parent.parent / "static" / "avatars"
+AVATAR_URL = "/static/avatars"
+
+cloudinary.config(
+    cloud_name=config.CLD_NAME,
+    api_key=config.CLD_API_KEY,
+    api_secret=config.CLD_API_SECRET,
+    secure=True,
+)
+
+avatar_pipeline = AvatarPipeline(
+    LocalStorage(AVATAR_DIR, AVATAR_URL) if config.AVATAR_STORAGE == "local" else CloudinaryStorage(),
+    BoundedPool(workers=config.AVATAR_WORKERS, queue_size=config.AVATAR_QUEUE, name="avatar"),
+)
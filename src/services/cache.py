@@ -0,0 +1,115 @@
+import time
+from collections import OrderedDict
+from typing import Any, Hashable
+
+
+class TTLCache:
+    """
+    The TTLCache class is a small in-process LRU cache whose entries also expire after a fixed time.
+    It is not shared between workers, so it only suits data that may be a few seconds stale.
+
+    :param maxsize: int: Maximum number of entries kept, the least recently used ones are evicted first
+    :param ttl: float: Number of seconds an entry stays valid
+    """
+    def __init__(self, maxsize: int, ttl: float):
+
+        """
+        The __init__ function sets up an empty cache and zeroes the hit and miss counters.
+
+        :param self: Represent the instance of the class
+        :param maxsize: int: Maximum number of entries
+        :param ttl: float: Lifetime of an entry in seconds
+        :return: None
+        :doc-author: Trelent
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+
+        """
+        The get function returns the cached value for the key and marks it as recently used.
+        Expired entries are dropped and count as a miss.
+
+        :param self: Represent the instance of the class
+        :param key: Hashable: The key to look up
+        :param default: Any: Returned when the key is missing or expired
+        :return: The cached value or the default
+        :doc-author: Trelent
+        """
+        item = self._data.get(key)
+        if item is None or item[0] <= time.monotonic():
+            if item is not None:
+                del self._data[key]
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return item[1]
+
+    def set(self, key: Hashable, value: Any, ttl: float | None = None) -> None:
+
+        """
+        The set function stores a value, evicting the least recently used entry when the cache is full.
+
+        :param self: Represent the instance of the class
+        :param key: Hashable: The key to store the value under
+        :param value: Any: The value to cache
+        :param ttl: float | None: Override the default lifetime for this entry
+        :return: None
+        :doc-author: Trelent
+        """
+        self._data[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key: Hashable) -> Any:
+
+        """
+        The pop function removes a key from the cache.
+
+        :param self: Represent the instance of the class
+        :param key: Hashable: The key to remove
+        :return: The removed value, or None
+        :doc-author: Trelent
+        """
+        item = self._data.pop(key, None)
+        return item[1] if item is not None else None
+
+    def clear(self) -> None:
+
+        """
+        The clear function drops every entry and resets the counters.
+
+        :param self: Represent the instance of the class
+        :return: None
+        :doc-author: Trelent
+        """
+        self._data.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self) -> dict:
+
+        """
+        The stats function reports the size of the cache and its hit and miss counters.
+
+        :param self: Represent the instance of the class
+        :return: A dictionary with size, maxsize, hits, misses and hit_ratio
+        :doc-author: Trelent
+        """
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / total if total else 0.0,
+        }
+
+    def __len__(self) -> int:
+        return len(self._data)
@@ -0,0 +1,86 @@
+import struct
+from dataclasses import dataclass
+
+from src.entity.models import User
+
+# Bump on every layout change. Entries written with another version are treated as cache misses,
+# so old and new workers can share one Redis during a rolling deploy.
+SCHEMA_VERSION = 1
+
+_HEADER = struct.Struct("!BqBHHH")
+_CONFIRM = 0x01
+_HAS_AVATAR = 0x02
+
+
+@dataclass(frozen=True, slots=True)
+class CachedUser:
+    """
+    The CachedUser class is the immutable view of a user kept in the user caches.
+    It holds only the columns an authenticated request needs, never the password hash.
+    """
+    id: int
+    username: str
+    email: str
+    avatar: str | None
+    confirm: bool
+
+    @classmethod
+    def from_user(cls, user: User) -> "CachedUser":
+
+        """
+        The from_user function copies the cached columns out of a User model.
+
+        :param cls: Represent the class itself
+        :param user: User: The user loaded from the database
+        :return: A CachedUser object
+        :doc-author: Trelent
+        """
+        return cls(id=user.id, username=user.username, email=user.email, avatar=user.avatar,
+                   confirm=bool(user.confirm))
+
+
+def encode_user(user: CachedUser) -> bytes:
+
+    """
+    The encode_user function packs a CachedUser into bytes.
+    The layout is a fixed header (version, id, flags and three string lengths)
+    followed by the utf-8 encoded username, email and avatar.
+
+    :param user: CachedUser: The user to encode
+    :return: The encoded user
+    :doc-author: Trelent
+    """
+    username = user.username.encode()
+    email = user.email.encode()
+    avatar = user.avatar.encode() if user.avatar is not None else b""
+    flags = (_CONFIRM if user.confirm else 0) | (_HAS_AVATAR if user.avatar is not None else 0)
+    header = _HEADER.pack(SCHEMA_VERSION, user.id, flags, len(username), len(email), len(avatar))
+    return b"".join((header, username, email, avatar))
+
+
+def decode_user(data: bytes) -> CachedUser | None:
+
+    """
+    The decode_user function unpacks bytes made by encode_user.
+    Payloads of another schema version, or anything else that is not a valid entry
+    (for example users pickled by older releases), decode to None and should be treated as a miss.
+
+    :param data: bytes: The cached payload
+    :return: A CachedUser object or None
+    :doc-author: Trelent
+    """
+    if not data or data[0] != SCHEMA_VERSION or len(data) < _HEADER.size:
+        return None
+    _, user_id, flags, username_len, email_len, avatar_len = _HEADER.unpack_from(data)
+    offset = _HEADER.size
+    if len(data) != offset + username_len + email_len + avatar_len:
+        return None
+    try:
+        username = data[offset:offset + username_len].decode()
+        offset += username_len
+        email = data[offset:offset + email_len].decode()
+        offset += email_len
+        avatar = data[offset:offset + avatar_len].decode() if flags & _HAS_AVATAR else None
+    except UnicodeDecodeError:
+        return None
+    return CachedUser(id=user_id, username=username, email=email, avatar=avatar, confirm=bool(flags & _CONFIRM))
@@ -0,0 +1,278 @@
+import zlib
+
+from starlette.datastructures import Headers, MutableHeaders
+
+from src.services.metrics import Counter
+
+# br and zstd are offered only when their libraries are installed, gzip always is
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Bodies of these types are compressed already, or are binary and would not shrink
+INCOMPRESSIBLE_TYPES = ("image/", "video/", "audio/", "font/woff", "application/zip", "application/gzip",
+                        "application/x-gzip", "application/zstd", "application/octet-stream")
+COMPRESSIBLE_IMAGES = ("image/svg+xml",)
+
+
+class GzipEncoder:
+    """
+    The GzipEncoder class compresses one response body with gzip, chunk by chunk.
+    BrotliEncoder and ZstdEncoder do the same for br and zstd.
+    """
+    name = "gzip"
+
+    def __init__(self, level: int):
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.compress(data)
+
+    def flush(self) -> bytes:
+        return self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        return self._compressor.flush(zlib.Z_FINISH)
+
+
+class BrotliEncoder:
+    name = "br"
+
+    def __init__(self, level: int):
+        self._compressor = brotli.Compressor(quality=level)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.process(data)
+
+    def flush(self) -> bytes:
+        return self._compressor.flush()
+
+    def finish(self) -> bytes:
+        return self._compressor.finish()
+
+
+class ZstdEncoder:
+    name = "zstd"
+
+    def __init__(self, level: int):
+        self._compressor = zstandard.ZstdCompressor(level=level).compressobj()
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.compress(data)
+
+    def flush(self) -> bytes:
+        return self._compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+    def finish(self) -> bytes:
+        return self._compressor.flush(zstandard.COMPRESSOBJ_FLUSH_FINISH)
+
+
+def available_encoders() -> dict:
+
+    """
+    The available_encoders function lists the encodings the installed libraries support,
+    in the order the server prefers them when the client accepts several equally.
+
+    :return: A dictionary of encoder classes by content coding
+    :doc-author: Trelent
+    """
+    encoders = {}
+    if zstandard is not None:
+        encoders[ZstdEncoder.name] = ZstdEncoder
+    if brotli is not None:
+        encoders[BrotliEncoder.name] = BrotliEncoder
+    encoders[GzipEncoder.name] = GzipEncoder
+    return encoders
+
+
+def negotiate(accept_encoding: str, supported) -> str | None:
+
+    """
+    The negotiate function picks the content coding of a response from the Accept-Encoding header.
+    The coding with the highest q-value wins, ties go to the first one in supported;
+    * stands for every coding the header does not name, and q=0 refuses a coding.
+
+    :param accept_encoding: str: The Accept-Encoding header of the request
+    :param supported: Sequence[str]: The codings the server can produce, preferred first
+    :return: The coding to use, or None to send the body as it is
+    :doc-author: Trelent
+    """
+    weights = {}
+    for item in accept_encoding.lower().split(","):
+        coding, _, params = item.partition(";")
+        coding = coding.strip()
+        if not coding:
+            continue
+        weight = 1.0
+        for param in params.split(";"):
+            name, _, value = param.partition("=")
+            if name.strip() == "q":
+                try:
+                    weight = float(value)
+                except ValueError:
+                    weight = 0.0
+        weights[coding] = weight
+    best, best_weight = None, 0.0
+    for coding in supported:
+        weight = weights.get(coding, weights.get("*", 0.0))
+        if weight > best_weight:
+            best, best_weight = coding, weight
+    return best
+
+
+class CompressionStats:
+    """
+    The CompressionStats class counts the responses CompressionMiddleware compressed,
+    and their size before and after, per content coding.
+    """
+    def __init__(self):
+
+        """
+        The __init__ function creates empty counters.
+
+        :param self: Represent the instance of the class
+        :return: None
+        :doc-author: Trelent
+        """
+        self.responses = Counter(("encoding",))
+        self.bytes_in = Counter(("encoding",))
+        self.bytes_out = Counter(("encoding",))
+
+    def stats(self) -> dict:
+
+        """
+        The stats function reports the counters per content coding.
+
+        :param self: Represent the instance of the class
+        :return: A dictionary with the responses, bytes_in and bytes_out of every coding
+        :doc-author: Trelent
+        """
+        return {encoding: {"responses": self.responses.values.get((encoding,), 0),
+                           "bytes_in": self.bytes_in.values.get((encoding,), 0),
+                           "bytes_out": self.bytes_out.values.get((encoding,), 0)}
+                for (encoding,) in self.responses.values}
+
+
+class CompressionMiddleware:
+    """
+    The CompressionMiddleware class is an ASGI middleware that compresses response bodies with the best
+    content coding the client accepts: zstd, br or gzip, as far as the libraries are installed.
+
+    A response sent in one piece is compressed only if it reaches minimum_size. A streaming response is
+    compressed chunk by chunk and every chunk is flushed, so the client receives it as soon as the
+    application sends it and the body is never buffered. Responses that already have a Content-Encoding,
+    bodies of incompressible types such as images, partial content and HEAD requests are left alone.
+
+    :param app: The ASGI application to wrap
+    :param minimum_size: int: Smallest body in bytes worth compressing
+    :param levels: dict: Compression level by content coding, for the codings that should not use the default
+    :param stats: CompressionStats: Where to count the compressed responses
+    """
+    def __init__(self, app, minimum_size: int = 1024, levels: dict | None = None,
+                 stats: "CompressionStats | None" = None):
+
+        """
+        The __init__ function wraps the application.
+
+        :param self: Represent the instance of the class
+        :param app: The ASGI application to wrap
+        :param minimum_size: int: Smallest body in bytes worth compressing
+        :param levels: dict: Compression level by content coding
+        :param stats: CompressionStats: Where to count the compressed responses
+        :return: None
+        :doc-author: Trelent
+        """
+        self.app = app
+        self.minimum_size = minimum_size
+        self.levels = {"gzip": 6, "br": 4, "zstd": 3, **(levels or {})}
+        self.encoders = available_encoders()
+        self.stats = stats if stats is not None else CompressionStats()
+
+    async def __call__(self, scope, receive, send):
+
+        """
+        The __call__ function serves a request through the wrapped application and compresses its response
+        when the client accepts a coding the server supports.
+
+        :param self: Represent the instance of the class
+        :param scope: The ASGI scope
+        :param receive: The ASGI receive channel
+        :param send: The ASGI send channel
+        :return: None
+        :doc-author: Trelent
+        """
+        if scope["type"] != "http" or scope["method"] == "HEAD":
+            await self.app(scope, receive, send)
+            return
+        coding = negotiate(Headers(scope=scope).get("accept-encoding", ""), self.encoders)
+        if coding is None:
+            await self.app(scope, receive, send)
+            return
+        start = None
+        encoder = None
+        passthrough = False
+
+        async def send_compressed(message):
+            nonlocal start, encoder, passthrough
+            if passthrough:
+                await send(message)
+                return
+            if message["type"] == "http.response.start":
+                # Held back until the first body chunk shows whether the body is worth compressing
+                start = message
+                return
+            if message["type"] != "http.response.body":
+                await send(message)
+                return
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+            if encoder is None:
+                if not self._compressible(start) or (not more_body and len(body) < self.minimum_size):
+                    passthrough = True
+                    await send(start)
+                    await send(message)
+                    return
+                encoder = self.encoders[coding](self.levels[coding])
+                headers = MutableHeaders(raw=start["headers"])
+                headers["Content-Encoding"] = coding
+                headers.add_vary_header("Accept-Encoding")
+                if more_body:
+                    del headers["Content-Length"]
+                else:
+                    compressed = encoder.compress(body) + encoder.finish()
+                    headers["Content-Length"] = str(len(compressed))
+                    self._count(coding, len(body), len(compressed))
+                    await send(start)
+                    await send({"type": "http.response.body", "body": compressed})
+                    return
+                await send(start)
+            chunk = encoder.compress(body) + (encoder.flush() if more_body else encoder.finish())
+            self._count(coding, len(body), len(chunk), response=not more_body)
+            await send({"type": "http.response.body", "body": chunk, "more_body": more_body})
+
+        await self.app(scope, receive, send_compressed)
+
+    @staticmethod
+    def _compressible(start: dict) -> bool:
+        if start["status"] < 200 or start["status"] in (204, 206, 304):
+            return False
+        headers = Headers(raw=start["headers"])
+        if "content-encoding" in headers:
+            return False
+        content_type = headers.get("content-type", "").lower()
+        return content_type.startswith(COMPRESSIBLE_IMAGES) or not content_type.startswith(INCOMPRESSIBLE_TYPES)
+
+    def _count(self, coding: str, size: int, compressed: int, response: bool = True) -> None:
+        if response:
+            self.stats.responses.inc(coding)
+        self.stats.bytes_in.inc(coding, amount=size)
+        self.stats.bytes_out.inc(coding, amount=compressed)
+
+
+compression_stats = CompressionStats()
@@ -0,0 +1,258 @@
+import codecs
+import csv
+import enum
+import io
+import json
+from typing import AsyncIterator
+
+from pydantic import TypeAdapter, ValidationError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.conf.config import config
+from src.entity.models import User
+from src.repository import contacts as rep_contacts
+from src.schemas.contact import ContactSchema, ContactRow
+
+
+class ContactsFormat(str, enum.Enum):
+    csv = "csv"
+    ndjson = "ndjson"
+
+
+class BadLine(enum.Enum):
+    too_long = "is longer than {} bytes"
+    not_utf8 = "is not valid UTF-8"
+
+    def message(self, what: str) -> str:
+        return f"{what} {self.value.format(config.IMPORT_MAX_LINE_BYTES)}"
+
+
+# Exported rows are written like the JSON API writes them, dates and datetimes in ISO 8601
+CONTACT_ROW = TypeAdapter(ContactRow)
+
+MEDIA_TYPES = {
+    ContactsFormat.csv: "text/csv; charset=utf-8",
+    ContactsFormat.ndjson: "application/x-ndjson",
+}
+
+
+async def iter_lines(chunks: AsyncIterator[bytes], max_bytes: int | None = None) -> AsyncIterator[str | BadLine]:
+
+    """
+    The iter_lines function splits a stream of utf-8 encoded chunks into lines without reading it all.
+    Only the current chunk and the unfinished last line are held in memory. A line longer than max_bytes
+    is dropped as it arrives and stands as BadLine.too_long in the output, so one line can't take up
+    the memory of the worker. A line that is not valid utf-8 stands as BadLine.not_utf8.
+
+    :param chunks: AsyncIterator[bytes]: The raw body, for example request.stream()
+    :param max_bytes: int: The longest line accepted, IMPORT_MAX_LINE_BYTES by default
+    :return: An async iterator of lines without their line endings, or BadLine for a line that can't be read
+    :doc-author: Trelent
+    """
+    max_bytes = max_bytes or config.IMPORT_MAX_LINE_BYTES
+    pending = b""
+    skipping = False
+    first = True
+    async for chunk in chunks:
+        if skipping and b"\n" not in chunk:
+            continue
+        # b"\n" never occurs inside a multi-byte utf-8 sequence, so the bytes can be split before decoding
+        *lines, pending = (pending + chunk).split(b"\n")
+        for line in lines:
+            if first:
+                line, first = line.removeprefix(codecs.BOM_UTF8), False
+            if skipping or len(line) > max_bytes:
+                skipping = False
+                yield BadLine.too_long
+                continue
+            yield _decode(line)
+        if len(pending) > max_bytes:
+            pending, skipping, first = b"", True, False
+    if first:
+        pending = pending.removeprefix(codecs.BOM_UTF8)
+    if skipping:
+        yield BadLine.too_long
+    elif pending:
+        yield _decode(pending)
+
+
+def _decode(line: bytes) -> str | BadLine:
+    try:
+        return line.decode().removesuffix("\r")
+    except UnicodeDecodeError:
+        return BadLine.not_utf8
+
+
+async def iter_csv_records(lines: AsyncIterator[str | BadLine]) -> AsyncIterator[tuple[int, dict | str]]:
+
+    """
+    The iter_csv_records function reads CSV records with a header row from a stream of lines.
+    A quoted field may span several lines; the record ends once its quotes are balanced.
+    A record longer than IMPORT_MAX_LINE_BYTES, for example one with an unclosed quote, or one that is
+    not valid utf-8 is reported as an error and reading goes on with the next line.
+
+    :param lines: AsyncIterator[str | BadLine]: The lines of the CSV file, BadLine for a line that can't be read
+    :return: An async iterator of (record number, row dict) or (record number, error message)
+    :doc-author: Trelent
+    """
+    header = None
+    buffer: list[str] = []
+    size = 0
+    quotes = 0
+    number = 0
+    async for line in lines:
+        if isinstance(line, str) and size + len(line) > config.IMPORT_MAX_LINE_BYTES:
+            line = BadLine.too_long
+        if isinstance(line, BadLine):
+            buffer.clear()
+            size = quotes = 0
+            number += 1
+            yield number, line.message("Record")
+            continue
+        buffer.append(line)
+        size += len(line) + 1
+        quotes += line.count('"')
+        if quotes % 2:
+            continue
+        record = "\n".join(buffer)
+        buffer.clear()
+        size = quotes = 0
+        if not record.strip():
+            continue
+        values = next(csv.reader([record]))
+        if header is None:
+            header = [name.strip() for name in values]
+            continue
+        number += 1
+        if len(values) != len(header):
+            yield number, f"Expected {len(header)} fields, got {len(values)}"
+            continue
+        yield number, dict(zip(header, values))
+    if buffer:
+        yield number + 1, "Unterminated quoted field"
+
+
+async def iter_ndjson_records(lines: AsyncIterator[str | BadLine]) -> AsyncIterator[tuple[int, dict | str]]:
+
+    """
+    The iter_ndjson_records function reads one JSON object per line. Blank lines are skipped.
+
+    :param lines: AsyncIterator[str | BadLine]: The lines of the NDJSON file, BadLine for a line that can't be read
+    :return: An async iterator of (record number, row dict) or (record number, error message)
+    :doc-author: Trelent
+    """
+    number = 0
+    async for line in lines:
+        if isinstance(line, BadLine):
+            number += 1
+            yield number, line.message("Line")
+            continue
+        if not line.strip():
+            continue
+        number += 1
+        try:
+            row = json.loads(line)
+        except ValueError as err:
+            yield number, f"Invalid JSON: {err}"
+            continue
+        if not isinstance(row, dict):
+            yield number, "Expected a JSON object"
+            continue
+        yield number, row
+
+
+def _validation_messages(err: ValidationError) -> list[str]:
+    return [f"{'.'.join(str(part) for part in error['loc'])}: {error['msg']}" for error in err.errors()]
+
+
+async def import_contacts(chunks: AsyncIterator[bytes], fmt: ContactsFormat, db: AsyncSession, user: User) -> dict:
+
+    """
+    The import_contacts function streams contacts from an upload into the database.
+    Records are validated with ContactSchema and inserted in chunks of IMPORT_CHUNK_SIZE rows,
+    one multi-row INSERT and one commit per chunk, so memory use does not grow with the file.
+    Only the first IMPORT_MAX_ERRORS row errors are kept in the report.
+
+    :param chunks: AsyncIterator[bytes]: The raw upload
+    :param fmt: ContactsFormat: Whether the upload is CSV (with a header row) or NDJSON
+    :param db: AsyncSession: Pass the database session to the function
+    :param user: User: The owner of the imported contacts
+    :return: A report with the imported and failed counts and the per-row errors
+    :doc-author: Trelent
+    """
+    report = {"imported": 0, "failed": 0, "errors": [], "errors_truncated": False}
+
+    def fail(number: int, errors: list[str]) -> None:
+        report["failed"] += 1
+        if len(report["errors"]) < config.IMPORT_MAX_ERRORS:
+            report["errors"].append({"row": number, "errors": errors})
+        else:
+            report["errors_truncated"] = True
+
+    async def flush(batch: list[tuple[int, ContactSchema]]) -> None:
+        inserted = await rep_contacts.create_contacts([body for _, body in batch], db, user)
+        for (number, _), ok in zip(batch, inserted):
+            if ok:
+                report["imported"] += 1
+            else:
+                fail(number, ["Contact with this email or phone already exists"])
+        batch.clear()
+
+    reader = iter_csv_records if fmt == ContactsFormat.csv else iter_ndjson_records
+    batch: list[tuple[int, ContactSchema]] = []
+    emails: set[str] = set()
+    async for number, row in reader(iter_lines(chunks)):
+        if isinstance(row, str):
+            fail(number, [row])
+            continue
+        try:
+            body = ContactSchema.model_validate(row)
+        except ValidationError as err:
+            fail(number, _validation_messages(err))
+            continue
+        if body.email in emails:
+            fail(number, ["Duplicate email in the upload"])
+            continue
+        emails.add(body.email)
+        batch.append((number, body))
+        if len(batch) >= config.IMPORT_CHUNK_SIZE:
+            await flush(batch)
+            emails.clear()
+    await flush(batch)
+    report["errors"].sort(key=lambda error: error["row"])
+    return report
+
+
+async def export_contacts(fmt: ContactsFormat, db: AsyncSession, user: User) -> AsyncIterator[bytes]:
+
+    """
+    The export_contacts function streams every contact of the user as CSV (with a header row) or NDJSON.
+    Each batch read from the database cursor is encoded into one chunk and handed on right away,
+    so the first bytes go out immediately and memory stays bounded however many contacts there are.
+    Values are serialized as the JSON API serializes them, so dates and datetimes are in ISO 8601.
+    The session is closed when the stream ends, because it outlives the request handler.
+
+    :param fmt: ContactsFormat: The output format
+    :param db: AsyncSession: Pass the database session to the function
+    :param user: User: Whose contacts to export
+    :return: An async iterator of encoded chunks
+    :doc-author: Trelent
+    """
+    fields = [column.key for column in rep_contacts.CONTACT_COLUMNS]
+    try:
+        if fmt == ContactsFormat.csv:
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            writer.writerow(fields)
+            yield buffer.getvalue().encode()
+        async for rows in rep_contacts.stream_contacts(db, user):
+            if fmt == ContactsFormat.csv:
+                buffer.seek(0)
+                buffer.truncate()
+                writer.writerows(CONTACT_ROW.dump_python(dict(zip(fields, row)), mode="json").values()
+                                 for row in rows)
+                yield buffer.getvalue().encode()
+            else:
+                yield b"".join(CONTACT_ROW.dump_json(dict(zip(fields, row))) + b"\n" for row in rows)
+    finally:
+        await db.close()
@@ -1,51 +1,310 @@
-
-from pathlib import Path
-
-from fastapi_mail import FastMail, MessageSchema, ConnectionConfig, MessageType
-from fastapi_mail.errors import ConnectionErrors
-from pydantic import EmailStr
-
-from src.services.auth import auth_service
-from src.conf.config import config
-
-conf = ConnectionConfig(
-    MAIL_USERNAME=config.MAIL_USERNAME,
-    MAIL_PASSWORD=config.MAIL_PASSWORD,
-    MAIL_FROM=config.MAIL_FROM,
-    MAIL_SERVER=config.MAIL_SERVER,
-    MAIL_FROM_NAME=config.MAIL_FROM_NAME,
-    MAIL_PORT=config.MAIL_PORT,
-    MAIL_STARTTLS=False,
-    MAIL_SSL_TLS=config.MAIL_SSL_TLS,
-    TEMPLATE_FOLDER=Path(__file__).parent / 'templates'
-)
-
-
-async def send_email(email: EmailStr, username: str, host: str):
-
-    """
-    The send_email function sends an email to the user with a link that they can click on to verify their email address.
-    The function takes in three parameters:
-        -email: The user's email address, which is used as the recipient of the message.
-        -username: The username of the user, which is used in both the subject line and body of the message.  This helps personalize it for them!
-        -host: The hostname (or IP) where this service is running, so that we can construct a valid URL for them to click on.
-
-    :param email: EmailStr: Specify the email address of the recipient
-    :param username: str: Pass the username of the user to be verified
-    :param host: str: Pass the hostname of the server to the email template
-    :return: A coroutine object
-    :doc-author: Trelent
-    """
-    try:
-        token_verification = auth_service.create_email_token({"sub": email})
-        message = MessageSchema(
-            subject="Email confirmation service notification",
-            recipients=[email],
-            template_body={"host": host, "username": username, "token": token_verification},
-            subtype=MessageType.html
-        )
-
-        fm = FastMail(conf)
-        await fm.send_message(message, template_name='verify_email.html')
-    except ConnectionErrors as e:
-        print(e)
\ No newline at end of file
+import asyncio
+import time
+from datetime import datetime, timedelta
+from email.message import EmailMessage
+from email.utils import formataddr
+from pathlib import Path
+from typing import AsyncContextManager, Callable
+
+import aiosmtplib
+from jinja2 import Environment, FileSystemLoader, select_autoescape
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.database.db import session_manager
+from src.entity.models import OutboxEmail
+from src.repository import outbox as rep_outbox
+from src.services.auth import auth_service
+from src.conf.config import config
+
+templates = Environment(loader=FileSystemLoader(Path(__file__).parent / 'templates'),
+                        autoescape=select_autoescape(["html"]))
+
+# Errors after which the connection can't be trusted anymore, the next email opens a new one
+CONNECTION_ERRORS = (aiosmtplib.SMTPServerDisconnected, aiosmtplib.SMTPConnectError, aiosmtplib.SMTPTimeoutError,
+                     OSError)
+
+
+def verification_email(email: str, username: str, host: str) -> OutboxEmail:
+
+    """
+    The verification_email function builds the outbox entry of the email with the link that confirms an account.
+    The confirmation token is created when the email is sent, so no token is stored in the outbox.
+
+    :param email: str: Specify the email address of the recipient
+    :param username: str: Pass the username of the user to be verified
+    :param host: str: Pass the hostname of the server to the email template
+    :return: An OutboxEmail object, not yet added to a session
+    :doc-author: Trelent
+    """
+    return OutboxEmail(template="verify_email", recipient=email, subject="Email confirmation service notification",
+                       payload={"username": username, "host": host})
+
+
+def render(email) -> EmailMessage:
+
+    """
+    The render function turns an outbox entry into the message to send.
+
+    :param email: Row: The claimed outbox entry
+    :return: An EmailMessage object
+    :doc-author: Trelent
+    """
+    context = dict(email.payload)
+    if email.template == "verify_email":
+        context["token"] = auth_service.create_email_token({"sub": email.recipient})
+    message = EmailMessage()
+    message["From"] = formataddr((config.MAIL_FROM_NAME, config.MAIL_FROM))
+    message["To"] = email.recipient
+    message["Subject"] = email.subject
+    message.set_content(templates.get_template(f"{email.template}.html").render(**context), subtype="html")
+    return message
+
+
+def is_permanent(error: Exception) -> bool:
+
+    """
+    The is_permanent function tells whether retrying an email is pointless, which is the case
+    when the server answered with a 5xx code, like for an unknown mailbox.
+
+    :param error: Exception: The error raised while sending
+    :return: True if the email should not be retried
+    :doc-author: Trelent
+    """
+    if isinstance(error, aiosmtplib.SMTPRecipientsRefused):
+        return all(recipient.code >= 500 for recipient in error.recipients)
+    return isinstance(error, aiosmtplib.SMTPResponseException) and error.code >= 500
+
+
+class OutboxSender:
+    """
+    The OutboxSender class sends the emails of the outbox in the background.
+    It keeps one authenticated SMTP connection open while there is mail to send and closes it after
+    MAIL_IDLE_TIMEOUT seconds without any, sends at most MAIL_RATE_LIMIT emails per second,
+    and retries failed emails with exponential backoff until MAIL_MAX_ATTEMPTS.
+
+    :param session: Callable: Opens a database session, session_manager.session by default
+    :param hostname: str: The SMTP server
+    :param port: int: The SMTP port
+    :param username: str | None: The SMTP login, None to skip authentication
+    :param password: str | None: The SMTP password
+    :param use_tls: bool: Connect over TLS
+    :param start_tls: bool: Upgrade the connection with STARTTLS
+    """
+    def __init__(self, session: Callable[[], AsyncContextManager[AsyncSession]] = session_manager.session,
+                 hostname: str = config.MAIL_SERVER, port: int = config.MAIL_PORT,
+                 username: str | None = config.MAIL_USERNAME, password: str | None = config.MAIL_PASSWORD,
+                 use_tls: bool = config.MAIL_SSL_TLS, start_tls: bool = config.MAIL_STARTTLS):
+
+        """
+        The __init__ function stores the settings. Nothing is connected until there is mail to send.
+
+        :param self: Represent the instance of the class
+        :param session: Callable: Opens a database session
+        :param hostname: str: The SMTP server
+        :param port: int: The SMTP port
+        :param username: str | None: The SMTP login
+        :param password: str | None: The SMTP password
+        :param use_tls: bool: Connect over TLS
+        :param start_tls: bool: Upgrade the connection with STARTTLS
+        :return: None
+        :doc-author: Trelent
+        """
+        self.session = session
+        self.hostname = hostname
+        self.port = port
+        self.username = username
+        self.password = password
+        self.use_tls = use_tls
+        self.start_tls = start_tls
+        self.sent = 0
+        self.failed = 0
+        self.connections = 0
+        self._smtp: aiosmtplib.SMTP | None = None
+        self._last_send = 0.0
+        self._wake = asyncio.Event()
+        self._task: asyncio.Task | None = None
+
+    async def _connection(self) -> aiosmtplib.SMTP:
+        if self._smtp is None or not self._smtp.is_connected:
+            smtp = aiosmtplib.SMTP(hostname=self.hostname, port=self.port, use_tls=self.use_tls,
+                                   start_tls=self.start_tls)
+            await smtp.connect()
+            if self.username:
+                await smtp.login(self.username, self.password)
+            self._smtp = smtp
+            self.connections += 1
+        return self._smtp
+
+    async def disconnect(self) -> None:
+
+        """
+        The disconnect function closes the SMTP connection, politely if the server still listens.
+
+        :param self: Represent the instance of the class
+        :return: None
+        :doc-author: Trelent
+        """
+        smtp, self._smtp = self._smtp, None
+        if smtp is None or not smtp.is_connected:
+            return
+        try:
+            await smtp.quit()
+        except aiosmtplib.SMTPException:
+            smtp.close()
+
+    async def _throttle(self) -> None:
+        delay = self._last_send + 1 / config.MAIL_RATE_LIMIT - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        self._last_send = time.monotonic()
+
+    @staticmethod
+    def retry_at(attempts: int) -> datetime | None:
+
+        """
+        The retry_at function picks when a failed email is tried again: the backoff doubles with every attempt,
+        up to MAIL_RETRY_BACKOFF_MAX. After MAIL_MAX_ATTEMPTS attempts the email is given up.
+
+        :param attempts: int: Number of attempts made so far
+        :return: The time of the next attempt, or None to give up
+        :doc-author: Trelent
+        """
+        if attempts >= config.MAIL_MAX_ATTEMPTS:
+            return None
+        backoff = min(config.MAIL_RETRY_BACKOFF * 2 ** (attempts - 1), config.MAIL_RETRY_BACKOFF_MAX)
+        return datetime.utcnow() + timedelta(seconds=backoff)
+
+    async def drain(self) -> int:
+
+        """
+        The drain function claims one batch of due emails and sends them over the shared connection.
+        Sent emails are marked in one statement per batch, even if the batch is interrupted;
+        failures are recorded one by one. An email that can't be rendered is given up at once,
+        so it doesn't come back with every lease.
+
+        :param self: Represent the instance of the class
+        :return: The number of emails claimed
+        :doc-author: Trelent
+        """
+        emails = []
+        async with self.session() as db:
+            emails = await rep_outbox.claim_emails(db, config.MAIL_BATCH_SIZE, config.MAIL_LEASE)
+            sent = []
+            try:
+                for email in emails:
+                    try:
+                        message = render(email)
+                    except Exception as error:
+                        await self._failed(email, error, None, db)
+                        continue
+                    await self._throttle()
+                    try:
+                        smtp = await self._connection()
+                        await smtp.send_message(message)
+                    except (aiosmtplib.SMTPException, OSError) as error:
+                        if isinstance(error, CONNECTION_ERRORS):
+                            await self.disconnect()
+                        retry_at = None if is_permanent(error) else self.retry_at(email.attempts + 1)
+                        await self._failed(email, error, retry_at, db)
+                        continue
+                    except Exception as error:
+                        # Not a delivery problem, the message itself can't be sent; the connection
+                        # may be mid-transaction, so it is opened again for the next email
+                        await self.disconnect()
+                        await self._failed(email, error, None, db)
+                        continue
+                    sent.append(email.id)
+                    self.sent += 1
+            finally:
+                await rep_outbox.mark_sent(sent, db)
+        return len(emails)
+
+    async def _failed(self, email, error: Exception, retry_at: datetime | None, db) -> None:
+        attempts = email.attempts + 1
+        print(f"Email {email.id} to {email.recipient} failed (attempt {attempts}): {error}")
+        await rep_outbox.mark_failed(email.id, attempts, str(error) or repr(error), retry_at, db)
+        self.failed += 1
+
+    def wake(self) -> None:
+
+        """
+        The wake function makes the running sender look at the outbox now instead of after the poll interval.
+
+        :param self: Represent the instance of the class
+        :return: None
+        :doc-author: Trelent
+        """
+        self._wake.set()
+
+    async def run(self) -> None:
+
+        """
+        The run function drains the outbox until cancelled. Between empty polls it waits up to
+        MAIL_POLL_INTERVAL seconds, and it closes the connection once it was idle for MAIL_IDLE_TIMEOUT seconds.
+
+        :param self: Represent the instance of the class
+        :return: None
+        :doc-author: Trelent
+        """
+        idle_since = time.monotonic()
+        while True:
+            try:
+                claimed = await self.drain()
+            except Exception as e:
+                print(f"Outbox sender failed: {e}")
+                claimed = 0
+            if claimed:
+                idle_since = time.monotonic()
+                continue
+            if self._smtp is not None and time.monotonic() - idle_since >= config.MAIL_IDLE_TIMEOUT:
+                await self.disconnect()
+            self._wake.clear()
+            try:
+                await asyncio.wait_for(self._wake.wait(), config.MAIL_POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+
+    def start(self) -> None:
+
+        """
+        The start function runs the sender in a background task.
+
+        :param self: Represent the instance of the class
+        :return: None
+        :doc-author: Trelent
+        """
+        if self._task is None:
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self) -> None:
+
+        """
+        The stop function cancels the background task and closes the SMTP connection.
+        Emails claimed but not sent yet are picked up again once their lease ends.
+
+        :param self: Represent the instance of the class
+        :return: None
+        :doc-author: Trelent
+        """
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.disconnect()
+
+    def stats(self) -> dict:
+
+        """
+        The stats function reports the sent and failed counters and the number of SMTP connections opened.
+
+        :param self: Represent the instance of the class
+        :return: A dictionary with the counters
+        :doc-author: Trelent
+        """
+        return {"sent": self.sent, "failed": self.failed, "connections": self.connections}
+
+
+outbox_sender = OutboxSender()
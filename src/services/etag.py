@@ -0,0 +1,51 @@
+import hashlib
+
+from fastapi import Response, status
+
+# Responses are per user and must be revalidated before a cached copy is reused.
+CACHE_CONTROL = "private, no-cache"
+
+
+def make_etag(*parts) -> str:
+
+    """
+    The make_etag function builds a weak ETag from the values a response depends on.
+    The values are hashed, so the tag does not reveal them and stays short.
+
+    :param parts: Values such as versions, counts and timestamps
+    :return: A weak ETag, quoted as it goes into the header
+    :doc-author: Trelent
+    """
+    digest = hashlib.sha1("|".join(str(part) for part in parts).encode()).hexdigest()[:20]
+    return f'W/"{digest}"'
+
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+
+    """
+    The etag_matches function checks an If-None-Match header against the current ETag.
+    It uses the weak comparison HTTP prescribes for If-None-Match, so the W/ prefix is ignored.
+
+    :param if_none_match: str | None: The header sent by the client
+    :param etag: str: The current ETag of the resource
+    :return: True if the client already has the current representation
+    :doc-author: Trelent
+    """
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    opaque = etag.removeprefix("W/")
+    return any(tag.strip().removeprefix("W/") == opaque for tag in if_none_match.split(","))
+
+
+def not_modified(etag: str) -> Response:
+
+    """
+    The not_modified function builds an empty 304 Not Modified response carrying the ETag.
+
+    :param etag: str: The current ETag of the resource
+    :return: A Response object
+    :doc-author: Trelent
+    """
+    return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag, "Cache-Control": CACHE_CONTROL})
@@ -0,0 +1,272 @@
+import bisect
+import time
+from typing import Sequence
+
+from starlette.routing import Match
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    """
+    The Histogram class counts observed values into fixed buckets, like a Prometheus histogram.
+    Bucket counts are not cumulative here; stats() adds them up when reporting.
+
+    :param buckets: Sequence[float]: Upper bounds of the buckets, in increasing order
+    """
+    def __init__(self, buckets: Sequence[float] = DEFAULT_BUCKETS):
+
+        """
+        The __init__ function creates an empty histogram with one extra bucket for values above the last bound.
+
+        :param self: Represent the instance of the class
+        :param buckets: Sequence[float]: Upper bounds of the buckets
+        :return: None
+        :doc-author: Trelent
+        """
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+
+        """
+        The observe function records one value.
+
+        :param self: Represent the instance of the class
+        :param value: float: The observed value, for example a duration in seconds
+        :return: None
+        :doc-author: Trelent
+        """
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def stats(self) -> dict:
+
+        """
+        The stats function reports the cumulative bucket counts, the sum and the count of observed values.
+
+        :param self: Represent the instance of the class
+        :return: A dictionary with buckets (upper bound to cumulative count), sum and count
+        :doc-author: Trelent
+        """
+        cumulative = 0
+        buckets = {}
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            cumulative += count
+            buckets["+Inf" if bound == float("inf") else str(bound)] = cumulative
+        return {"buckets": buckets, "sum": self.sum, "count": self.count}
+
+
+class Counter:
+    """
+    The Counter class counts events per combination of label values, like a Prometheus counter.
+
+    :param labels: Sequence[str]: Names of the labels
+    """
+    def __init__(self, labels: Sequence[str] = ()):
+
+        """
+        The __init__ function creates a counter without any samples.
+
+        :param self: Represent the instance of the class
+        :param labels: Sequence[str]: Names of the labels
+        :return: None
+        :doc-author: Trelent
+        """
+        self.labels = tuple(labels)
+        self.values: dict[tuple, float] = {}
+
+    def inc(self, *values: str, amount: float = 1) -> None:
+
+        """
+        The inc function adds amount to the sample of the given label values.
+
+        :param self: Represent the instance of the class
+        :param values: str: One value per label, in the order of the label names
+        :param amount: float: How much to add
+        :return: None
+        :doc-author: Trelent
+        """
+        self.values[values] = self.values.get(values, 0) + amount
+
+    def samples(self) -> list[tuple[dict, float]]:
+
+        """
+        The samples function lists the labels and the value of every sample.
+
+        :param self: Represent the instance of the class
+        :return: A list of (labels, value) pairs
+        :doc-author: Trelent
+        """
+        return [(dict(zip(self.labels, values)), value) for values, value in self.values.items()]
+
+
+class RequestMetrics:
+    """
+    The RequestMetrics class keeps the per route request counters filled by MetricsMiddleware.
+    Routes are identified by their template, like /api/contacts/{contact_id}, so the number of
+    series does not grow with the ids in the URLs.
+    """
+    def __init__(self):
+
+        """
+        The __init__ function creates empty counters.
+
+        :param self: Represent the instance of the class
+        :return: None
+        :doc-author: Trelent
+        """
+        self.in_flight = Counter(("method", "route"))
+        self.responses = Counter(("method", "route", "status"))
+        self.latency: dict[tuple[str, str], Histogram] = {}
+
+    def observe(self, method: str, route: str, status: int, seconds: float) -> None:
+
+        """
+        The observe function records one finished request.
+
+        :param self: Represent the instance of the class
+        :param method: str: The HTTP method
+        :param route: str: The route template
+        :param status: int: The status code sent to the client
+        :param seconds: float: How long the request took
+        :return: None
+        :doc-author: Trelent
+        """
+        self.responses.inc(method, route, str(status))
+        histogram = self.latency.get((method, route))
+        if histogram is None:
+            histogram = self.latency[method, route] = Histogram()
+        histogram.observe(seconds)
+
+
+def route_template(scope: dict) -> str:
+
+    """
+    The route_template function finds the template of the route that will serve a request.
+    Requests that match no route are grouped under one name, so scans for random URLs
+    don't create new series.
+
+    :param scope: dict: The ASGI scope of the request
+    :return: The route template
+    :doc-author: Trelent
+    """
+    app = scope.get("app")
+    partial = None
+    for route in getattr(app, "routes", ()):
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return route.path
+        if match == Match.PARTIAL and partial is None:
+            partial = route.path
+    return partial or "unmatched"
+
+
+class MetricsMiddleware:
+    """
+    The MetricsMiddleware class is an ASGI middleware that records the latency, the status code and
+    the number of in-flight requests of every HTTP request, per route template.
+
+    :param app: The ASGI application to wrap
+    :param metrics: RequestMetrics: Where to record the requests
+    """
+    def __init__(self, app, metrics: RequestMetrics):
+
+        """
+        The __init__ function wraps the application.
+
+        :param self: Represent the instance of the class
+        :param app: The ASGI application to wrap
+        :param metrics: RequestMetrics: Where to record the requests
+        :return: None
+        :doc-author: Trelent
+        """
+        self.app = app
+        self.metrics = metrics
+
+    async def __call__(self, scope, receive, send):
+
+        """
+        The __call__ function serves a request through the wrapped application and records it.
+        A request that fails without sending a response is recorded with status 500.
+
+        :param self: Represent the instance of the class
+        :param scope: The ASGI scope
+        :param receive: The ASGI receive channel
+        :param send: The ASGI send channel
+        :return: None
+        :doc-author: Trelent
+        """
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        method = scope["method"]
+        route = route_template(scope)
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        self.metrics.in_flight.inc(method, route)
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            self.metrics.in_flight.inc(method, route, amount=-1)
+            self.metrics.observe(method, route, status, time.perf_counter() - started)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + "}"
+
+
+def format_metric(name: str, kind: str, help_text: str, samples: list[tuple[dict, float]]) -> str:
+
+    """
+    The format_metric function renders one metric in the Prometheus text exposition format.
+
+    :param name: str: The metric name
+    :param kind: str: counter or gauge
+    :param help_text: str: The HELP line
+    :param samples: list[tuple[dict, float]]: The labels and value of every sample
+    :return: The rendered lines
+    :doc-author: Trelent
+    """
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+    lines += [f"{name}{_labels(labels)} {value}" for labels, value in samples]
+    return "\n".join(lines) + "\n"
+
+
+def format_histograms(name: str, help_text: str, histograms: list[tuple[dict, dict]]) -> str:
+
+    """
+    The format_histograms function renders histograms in the Prometheus text exposition format.
+
+    :param name: str: The metric name
+    :param help_text: str: The HELP line
+    :param histograms: list[tuple[dict, dict]]: The labels and Histogram.stats() of every series
+    :return: The rendered lines
+    :doc-author: Trelent
+    """
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} histogram"]
+    for labels, stats in histograms:
+        for bound, count in stats["buckets"].items():
+            lines.append(f"{name}_bucket{_labels(dict(labels, le=bound))} {count}")
+        lines.append(f"{name}_sum{_labels(labels)} {stats['sum']}")
+        lines.append(f"{name}_count{_labels(labels)} {stats['count']}")
+    return "\n".join(lines) + "\n"
+
+
+request_metrics = RequestMetrics()
@@ -0,0 +1,308 @@
+import asyncio
+import math
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Awaitable, Callable
+
+import redis.asyncio as redis
+from fastapi import HTTPException, Request, status
+
+from src.conf import messages
+from src.conf.config import config
+from src.services.auth import auth_service
+from src.services.metrics import route_template
+
+
+@dataclass(slots=True)
+class Bucket:
+    """
+    The Bucket class is the local state of one (identity, route) limit.
+    Tokens refill continuously; pending counts the requests not yet reported to Redis,
+    sent and remote count the requests of this worker and of the other workers in the current window.
+    """
+    times: int
+    period: float
+    tokens: float
+    refilled: float
+    window: int
+    pending: int = 0
+    sent: int = 0
+    remote: int = 0
+
+
+class RateLimits:
+    """
+    The RateLimits class keeps the token buckets of the running worker and shares their use through Redis.
+    Requests are admitted or refused from memory; the buckets that were used are reported to Redis
+    in one pipeline every RATE_LIMIT_SYNC_INTERVAL seconds, or sooner once a bucket has RATE_LIMIT_SYNC_BATCH
+    unreported requests. The reply tells how many requests the other workers admitted in the same window,
+    and those are taken out of the local bucket.
+    A worker learns about the others only when it syncs a bucket it used itself, so it may admit
+    what it sees as its full bucket first: across N workers a limit is exceeded by at most (N - 1) * times.
+
+    :param maxsize: int: Number of buckets kept, the least recently used ones are dropped first
+    :param prefix: str: Prefix of the Redis keys
+    """
+    client: redis.Redis | None = None
+
+    def __init__(self, maxsize: int, prefix: str = "ratelimit"):
+
+        """
+        The __init__ function sets up an empty bucket table and zeroes the counters.
+        Limits are enforced per worker only until a Redis client is assigned to the client attribute.
+
+        :param self: Represent the instance of the class
+        :param maxsize: int: Number of buckets kept
+        :param prefix: str: Prefix of the Redis keys
+        :return: None
+        :doc-author: Trelent
+        """
+        self.maxsize = maxsize
+        self.prefix = prefix
+        self.enabled = True
+        self.allowed = 0
+        self.limited = 0
+        self.syncs = 0
+        self.errors = 0
+        self._buckets: OrderedDict[tuple[str, str], Bucket] = OrderedDict()
+        self._wake = asyncio.Event()
+        self._task: asyncio.Task | None = None
+
+    def hit(self, name: str, identity: str, times: int, period: float) -> float:
+
+        """
+        The hit function takes one token from the bucket of the identity on the named route.
+
+        :param self: Represent the instance of the class
+        :param name: str: The limited route
+        :param identity: str: Who makes the request
+        :param times: int: Requests allowed per period
+        :param period: float: Length of the period in seconds
+        :return: 0 if the request is admitted, else the seconds until a token is available
+        :doc-author: Trelent
+        """
+        now = time.monotonic()
+        window = int(time.time() // period)
+        key = (name, identity)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = Bucket(times, period, times, now, window)
+            if len(self._buckets) > self.maxsize:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+            bucket.tokens = min(times, bucket.tokens + (now - bucket.refilled) * times / period)
+            bucket.refilled = now
+            if bucket.window != window:
+                bucket.window, bucket.sent, bucket.remote = window, 0, 0
+        if bucket.tokens < 1:
+            self.limited += 1
+            return (1 - bucket.tokens) * period / times
+        bucket.tokens -= 1
+        bucket.pending += 1
+        self.allowed += 1
+        if bucket.pending >= config.RATE_LIMIT_SYNC_BATCH:
+            self._wake.set()
+        return 0
+
+    async def sync(self) -> None:
+
+        """
+        The sync function reports the requests admitted since the last sync and takes the requests
+        the other workers admitted out of the local buckets. Only the buckets used since the last sync are synced.
+        When Redis is unavailable the requests stay pending and the buckets keep working locally.
+
+        :param self: Represent the instance of the class
+        :return: None
+        :doc-author: Trelent
+        """
+        if self.client is None:
+            return
+        batch = [(key, bucket, bucket.pending) for key, bucket in self._buckets.items() if bucket.pending]
+        if not batch:
+            return
+        pipe = self.client.pipeline(transaction=False)
+        for (name, identity), bucket, pending in batch:
+            redis_key = f"{self.prefix}:{name}:{identity}:{bucket.window}"
+            pipe.incrby(redis_key, pending)
+            pipe.expire(redis_key, math.ceil(bucket.period) + 1)
+            bucket.pending -= pending
+            bucket.sent += pending
+        windows = [bucket.window for _, bucket, _ in batch]
+        try:
+            replies = await pipe.execute()
+        except redis.RedisError as e:
+            self.errors += 1
+            print(f"Rate limit sync failed: {e}")
+            for _, bucket, pending in batch:
+                bucket.pending += pending
+                bucket.sent -= pending
+            return
+        self.syncs += 1
+        for (_, bucket, _), window, total in zip(batch, windows, replies[::2]):
+            if bucket.window != window:
+                continue
+            remote = total - bucket.sent
+            if remote > bucket.remote:
+                bucket.tokens = max(0.0, bucket.tokens - (remote - bucket.remote))
+                bucket.remote = remote
+
+    async def run(self) -> None:
+
+        """
+        The run function syncs the buckets until cancelled.
+
+        :param self: Represent the instance of the class
+        :return: None
+        :doc-author: Trelent
+        """
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), config.RATE_LIMIT_SYNC_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            try:
+                await self.sync()
+            except Exception as e:
+                print(f"Rate limit sync failed: {e}")
+
+    def start(self) -> None:
+
+        """
+        The start function runs the sync loop in a background task.
+
+        :param self: Represent the instance of the class
+        :return: None
+        :doc-author: Trelent
+        """
+        if self._task is None:
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self) -> None:
+
+        """
+        The stop function cancels the sync loop and reports the pending requests one last time.
+
+        :param self: Represent the instance of the class
+        :return: None
+        :doc-author: Trelent
+        """
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.sync()
+
+    def stats(self) -> dict:
+
+        """
+        The stats function reports the number of buckets, the admitted and refused requests and the syncs.
+
+        :param self: Represent the instance of the class
+        :return: A dictionary with the counters
+        :doc-author: Trelent
+        """
+        return {"buckets": len(self._buckets), "allowed": self.allowed, "limited": self.limited,
+                "syncs": self.syncs, "errors": self.errors}
+
+
+rate_limits = RateLimits(config.RATE_LIMIT_MAX_KEYS)
+
+
+def ip_identifier(request: Request) -> str:
+
+    """
+    The ip_identifier function identifies a request by the client address, for routes used before logging in.
+    Behind a proxy, run uvicorn with --proxy-headers and --forwarded-allow-ips, so the address is taken
+    from X-Forwarded-For only when a trusted proxy set it.
+
+    :param request: Request: The incoming request
+    :return: The identity
+    :doc-author: Trelent
+    """
+    return "ip:" + (request.client.host if request.client else "unknown")
+
+
+def default_identifier(request: Request) -> str:
+
+    """
+    The default_identifier function tells who makes a request without loading the user:
+    requests with a valid access token are limited per user, the others per client address.
+    Invalid tokens count as no token, so sending a new one with each request does not get a new bucket.
+
+    :param request: Request: The incoming request
+    :return: The identity
+    :doc-author: Trelent
+    """
+    scheme, _, token = request.headers.get("Authorization", "").partition(" ")
+    if scheme.lower() == "bearer" and token:
+        email = auth_service.access_token_subject(token)
+        if email is not None:
+            return "user:" + email
+    return ip_identifier(request)
+
+
+class RateLimiter:
+    """
+    The RateLimiter class is a dependency that allows times requests per period to every identity on a route,
+    declared like fastapi_limiter's: Depends(RateLimiter(times=3, seconds=60)).
+    The decision is made from the in-process bucket, no network call is made per request.
+
+    :param times: int: Requests allowed per period
+    :param milliseconds: int: Milliseconds added to the period
+    :param seconds: int: Seconds added to the period
+    :param minutes: int: Minutes added to the period
+    :param hours: int: Hours added to the period
+    :param identifier: Callable: Returns the identity of a request, default_identifier by default
+    :param limits: RateLimits: The bucket table, rate_limits by default
+    """
+    def __init__(self, times: int = 1, milliseconds: int = 0, seconds: int = 0, minutes: int = 0, hours: int = 0,
+                 identifier: Callable[[Request], str | Awaitable[str]] | None = None,
+                 limits: RateLimits = rate_limits):
+
+        """
+        The __init__ function stores the limit. The route name is resolved on the first request.
+
+        :param self: Represent the instance of the class
+        :param times: int: Requests allowed per period
+        :param milliseconds: int: Milliseconds added to the period
+        :param seconds: int: Seconds added to the period
+        :param minutes: int: Minutes added to the period
+        :param hours: int: Hours added to the period
+        :param identifier: Callable: Returns the identity of a request
+        :param limits: RateLimits: The bucket table
+        :return: None
+        :doc-author: Trelent
+        """
+        self.times = times
+        self.period = milliseconds / 1000 + seconds + 60 * minutes + 3600 * hours
+        self.identifier = identifier or default_identifier
+        self.limits = limits
+        self.name: str | None = None
+
+    async def __call__(self, request: Request) -> None:
+
+        """
+        The __call__ function admits the request or refuses it with 429 and a Retry-After header.
+
+        :param self: Represent the instance of the class
+        :param request: Request: The incoming request
+        :return: None
+        :doc-author: Trelent
+        """
+        if not self.limits.enabled:
+            return
+        if self.name is None:
+            self.name = f"{request.method}:{route_template(request.scope)}"
+        identity = self.identifier(request)
+        if asyncio.iscoroutine(identity):
+            identity = await identity
+        retry_after = self.limits.hit(self.name, identity, self.times, self.period)
+        if retry_after:
+            raise HTTPException(status_code=status.HTTP_429_TOO_MANY_REQUESTS, detail=messages.TOO_MANY_REQUESTS,
+                                headers={"Retry-After": str(math.ceil(retry_after))})
@@ -0,0 +1,185 @@
+import time
+import uuid
+
+import redis.asyncio as redis
+from fastapi import HTTPException, status
+
+from src.conf import messages
+from src.conf.config import config
+from src.services.auth import auth_service
+
+# Moves a family to its next token if the presented one is the current one.
+# Any other token of the family was already used: the family is revoked, so neither
+# the thief nor the owner can continue it.
+ROTATE = """
+local current = redis.call('GET', KEYS[1])
+if not current then
+    return 0
+end
+if current ~= ARGV[1] then
+    redis.call('DEL', KEYS[1])
+    return -1
+end
+redis.call('SET', KEYS[1], ARGV[2], 'EX', ARGV[3])
+redis.call('EXPIRE', KEYS[2], ARGV[3])
+return 1
+"""
+
+
+class RefreshTokenStore:
+    """
+    The RefreshTokenStore class tracks refresh tokens in Redis, so issuing and refreshing tokens never writes to
+    the database. Every login starts a token family; a family holds the id of its one valid token and expires
+    with it. Refreshing rotates the family to a new token, and presenting a token of the family that was
+    already rotated away revokes the whole family.
+
+    Refresh tokens issued before families existed carry no family id. While REFRESH_ACCEPT_LEGACY is on,
+    each of them is exchanged once for a new family; turn it off once the last of them expired,
+    REFRESH_TOKEN_TTL after the deployment.
+
+    :param ttl: int: Lifetime of a refresh token in seconds
+    :param prefix: str: Prefix of the Redis keys
+    """
+    client: redis.Redis | None = None
+
+    def __init__(self, ttl: int, prefix: str = "refresh"):
+
+        """
+        The __init__ function stores the settings and zeroes the counters.
+
+        :param self: Represent the instance of the class
+        :param ttl: int: Lifetime of a refresh token in seconds
+        :param prefix: str: Prefix of the Redis keys
+        :return: None
+        :doc-author: Trelent
+        """
+        self.ttl = ttl
+        self.prefix = prefix
+        self.issued = 0
+        self.rotated = 0
+        self.reused = 0
+        self.migrated = 0
+        self._rotate = None
+
+    def _family_key(self, family: str) -> str:
+        return f"{self.prefix}:family:{family}"
+
+    def _user_key(self, email: str) -> str:
+        return f"{self.prefix}:user:{email}"
+
+    def _script(self):
+        if self._rotate is None or self._rotate.registered_client is not self.client:
+            self._rotate = self.client.register_script(ROTATE)
+        return self._rotate
+
+    async def _token(self, email: str, family: str, token_id: str) -> str:
+        return await auth_service.create_refresh_token(data={"sub": email, "fid": family, "jti": token_id},
+                                                       expires_telta=self.ttl)
+
+    async def issue(self, email: str) -> str:
+
+        """
+        The issue function starts a new token family for the user and returns its first token.
+
+        :param self: Represent the instance of the class
+        :param email: str: The user logging in
+        :return: The refresh token
+        :raises HTTPException: 503 if Redis is unavailable
+        :doc-author: Trelent
+        """
+        family, token_id = uuid.uuid4().hex, uuid.uuid4().hex
+        try:
+            async with self.client.pipeline(transaction=True) as pipe:
+                pipe.set(self._family_key(family), token_id, ex=self.ttl)
+                pipe.sadd(self._user_key(email), family)
+                pipe.expire(self._user_key(email), self.ttl)
+                await pipe.execute()
+        except redis.RedisError as e:
+            raise self._unavailable(e)
+        self.issued += 1
+        return await self._token(email, family, token_id)
+
+    async def rotate(self, token: str) -> tuple[str, str]:
+
+        """
+        The rotate function exchanges a refresh token for the next token of its family.
+
+        :param self: Represent the instance of the class
+        :param token: str: The presented refresh token
+        :return: The email of the user and the new refresh token
+        :raises HTTPException: 401 if the token is invalid, revoked or was already used, 503 if Redis is unavailable
+        :doc-author: Trelent
+        """
+        claims = await auth_service.decode_refresh_claims(token)
+        email = claims["sub"]
+        family = claims.get("fid")
+        if family is None:
+            return email, await self._migrate(token, claims)
+        token_id = uuid.uuid4().hex
+        try:
+            result = await self._script()(keys=[self._family_key(family), self._user_key(email)],
+                                          args=[claims.get("jti", ""), token_id, self.ttl])
+        except redis.RedisError as e:
+            raise self._unavailable(e)
+        if result == -1:
+            self.reused += 1
+            print(f"Refresh token reuse detected for {email}, family {family} revoked")
+            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail=messages.TOKEN_REUSED)
+        if result == 0:
+            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail=messages.TOKEN_REVOKED)
+        self.rotated += 1
+        return email, await self._token(email, family, token_id)
+
+    async def _migrate(self, token: str, claims: dict) -> str:
+        if not config.REFRESH_ACCEPT_LEGACY:
+            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail=messages.TOKEN_REVOKED)
+        ttl = int(claims["exp"] - time.time()) + 1
+        try:
+            first_use = await self.client.set(f"{self.prefix}:legacy:{auth_service.token_digest(token)}", 1,
+                                              nx=True, ex=max(ttl, 1))
+        except redis.RedisError as e:
+            raise self._unavailable(e)
+        if not first_use:
+            self.reused += 1
+            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail=messages.TOKEN_REUSED)
+        self.migrated += 1
+        return await self.issue(claims["sub"])
+
+    async def revoke_user(self, email: str) -> None:
+
+        """
+        The revoke_user function revokes every token family of the user, for example on logout.
+
+        :param self: Represent the instance of the class
+        :param email: str: The user
+        :return: None
+        :raises HTTPException: 503 if Redis is unavailable
+        :doc-author: Trelent
+        """
+        try:
+            families = await self.client.smembers(self._user_key(email))
+            await self.client.delete(self._user_key(email),
+                                     *(self._family_key(family.decode() if isinstance(family, bytes) else family)
+                                       for family in families))
+        except redis.RedisError as e:
+            raise self._unavailable(e)
+
+    @staticmethod
+    def _unavailable(error: Exception) -> HTTPException:
+        print(f"Refresh token store is unavailable: {error}")
+        return HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=messages.SERVICE_BUSY,
+                             headers={"Retry-After": "1"})
+
+    def stats(self) -> dict:
+
+        """
+        The stats function reports how many families were started, rotated, migrated and revoked for reuse.
+
+        :param self: Represent the instance of the class
+        :return: A dictionary with the counters
+        :doc-author: Trelent
+        """
+        return {"issued": self.issued, "rotated": self.rotated, "migrated": self.migrated, "reused": self.reused}
+
+
+refresh_tokens = RefreshTokenStore(config.REFRESH_TOKEN_TTL)
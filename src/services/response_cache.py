@@ -0,0 +1,124 @@
+import hashlib
+import json
+
+import redis.asyncio as redis
+from fastapi import Response
+
+from src.conf.config import config
+
+
+class ResponseCache:
+    """
+    The ResponseCache class keeps serialized JSON responses in Redis.
+    Keys hold the user id and the write version of the user's contacts, so a write makes every
+    older entry of that user unreachable at once; those entries are never looked up again
+    and simply expire, no keys have to be scanned or deleted.
+
+    :param ttl: int: Number of seconds an entry is kept
+    :param prefix: str: Prefix of the Redis keys
+    """
+    client: redis.Redis | None = None
+
+    def __init__(self, ttl: int, prefix: str = "response"):
+
+        """
+        The __init__ function stores the settings and zeroes the counters.
+        The cache stays disabled until a Redis client is assigned to the client attribute.
+
+        :param self: Represent the instance of the class
+        :param ttl: int: Number of seconds an entry is kept
+        :param prefix: str: Prefix of the Redis keys
+        :return: None
+        :doc-author: Trelent
+        """
+        self.ttl = ttl
+        self.prefix = prefix
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+        self.bytes_served = 0
+
+    def key(self, user_id: int, version: int, endpoint: str, **params) -> str:
+
+        """
+        The key function builds the Redis key of a response.
+        The parameters are hashed, so any query string fits into a short key.
+
+        :param self: Represent the instance of the class
+        :param user_id: int: The owner of the response
+        :param version: int: The write version of the owner's contacts
+        :param endpoint: str: Name of the endpoint
+        :param params: Everything else the response depends on
+        :return: The key
+        :doc-author: Trelent
+        """
+        digest = hashlib.sha1(json.dumps(params, sort_keys=True, default=str).encode()).hexdigest()
+        return f"{self.prefix}:{user_id}:{version}:{endpoint}:{digest}"
+
+    async def get(self, key: str) -> Response | None:
+
+        """
+        The get function returns the cached response for the key, ready to be sent as is.
+        Redis errors count as a miss, the cache must never fail a request.
+
+        :param self: Represent the instance of the class
+        :param key: str: The key built by the key function
+        :return: A Response object or None
+        :doc-author: Trelent
+        """
+        if self.client is None:
+            return None
+        try:
+            entry = await self.client.get(key)
+        except redis.RedisError as e:
+            self.errors += 1
+            print(f"Response cache is unavailable: {e}")
+            return None
+        if entry is None:
+            self.misses += 1
+            return None
+        headers, body = entry.split(b"\n", 1)
+        self.hits += 1
+        self.bytes_served += len(body)
+        return Response(content=body, media_type="application/json", headers=json.loads(headers))
+
+    async def put(self, key: str, body: bytes, headers: dict[str, str]) -> Response:
+
+        """
+        The put function stores a serialized response with its headers and returns it as a Response.
+
+        :param self: Represent the instance of the class
+        :param key: str: The key built by the key function
+        :param body: bytes: The JSON body
+        :param headers: dict[str, str]: Headers to send along with the body, like ETag
+        :return: A Response object
+        :doc-author: Trelent
+        """
+        if self.client is not None:
+            try:
+                await self.client.set(key, json.dumps(headers).encode() + b"\n" + body, ex=self.ttl)
+            except redis.RedisError as e:
+                self.errors += 1
+                print(f"Response cache is unavailable: {e}")
+        return Response(content=body, media_type="application/json", headers=headers)
+
+    def stats(self) -> dict:
+
+        """
+        The stats function reports the hit and miss counters, the hit ratio and the bytes served from the cache.
+
+        :param self: Represent the instance of the class
+        :return: A dictionary with the counters
+        :doc-author: Trelent
+        """
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "errors": self.errors,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "bytes_served": self.bytes_served,
+        }
+
+
+response_cache = ResponseCache(config.RESPONSE_CACHE_TTL)
@@ -0,0 +1,143 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable
+
+
+class PoolSaturated(Exception):
+    """
+    The PoolSaturated exception is raised when a BoundedPool already holds as many jobs as it may queue.
+    """
+
+
+class BoundedPool:
+    """
+    The BoundedPool class runs blocking functions on a fixed set of worker threads, off the event loop.
+    At most workers + queue_size jobs are accepted at a time; further jobs are rejected with PoolSaturated
+    instead of waiting forever, so callers can shed load early.
+
+    :param workers: int: Number of worker threads
+    :param queue_size: int: Number of jobs allowed to wait for a free worker
+    :param name: str: Prefix of the worker thread names
+    """
+    def __init__(self, workers: int, queue_size: int, name: str = "pool"):
+
+        """
+        The __init__ function stores the pool limits and zeroes the counters.
+        The worker threads are started on first use.
+
+        :param self: Represent the instance of the class
+        :param workers: int: Number of worker threads
+        :param queue_size: int: Number of jobs allowed to wait for a free worker
+        :param name: str: Prefix of the worker thread names
+        :return: None
+        :doc-author: Trelent
+        """
+        self.workers = workers
+        self.queue_size = queue_size
+        self.name = name
+        self.pending = 0
+        self.completed = 0
+        self.rejected = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self._executor: ThreadPoolExecutor | None = None
+        self._lock = threading.Lock()
+
+    @property
+    def queue_depth(self) -> int:
+
+        """
+        The queue_depth property is the number of accepted jobs still waiting for a free worker.
+
+        :param self: Represent the instance of the class
+        :return: The number of waiting jobs
+        :doc-author: Trelent
+        """
+        return max(self.pending - self.workers, 0)
+
+    async def run(self, fn: Callable[..., Any], *args: Any) -> Any:
+
+        """
+        The run function executes fn(*args) on a worker thread and returns its result.
+        The time a job spent waiting for a worker is added to the wait counters.
+
+        :param self: Represent the instance of the class
+        :param fn: Callable[..., Any]: The blocking function to run
+        :param args: Any: Positional arguments for fn
+        :return: The result of fn
+        :raises PoolSaturated: If the pool and its queue are full
+        :doc-author: Trelent
+        """
+        with self._lock:
+            if self.pending >= self.workers + self.queue_size:
+                self.rejected += 1
+                raise PoolSaturated(f"{self.name} pool is saturated")
+            self.pending += 1
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix=self.name)
+        submitted = time.perf_counter()
+
+        def job():
+            return time.perf_counter() - submitted, fn(*args)
+
+        try:
+            future = self._executor.submit(job)
+        except BaseException:
+            self._release(None)
+            raise
+        # The slot is held until the thread is done, even if the caller stops waiting for it
+        future.add_done_callback(self._release)
+        waited, result = await asyncio.wrap_future(future)
+        self.completed += 1
+        self.wait_total += waited
+        self.wait_max = max(self.wait_max, waited)
+        return result
+
+    def _release(self, future: Future | None) -> None:
+
+        """
+        The _release function frees the slot of a finished job. It runs as a done callback of the
+        executor future, on whichever thread completed or cancelled it.
+
+        :param self: Represent the instance of the class
+        :param future: Future | None: The finished executor future
+        :return: None
+        :doc-author: Trelent
+        """
+        with self._lock:
+            self.pending -= 1
+
+    def stats(self) -> dict:
+
+        """
+        The stats function reports the pool limits, its current load and the wait time counters.
+
+        :param self: Represent the instance of the class
+        :return: A dictionary with the pool statistics
+        :doc-author: Trelent
+        """
+        return {
+            "workers": self.workers,
+            "queue_size": self.queue_size,
+            "in_flight": self.pending - self.queue_depth,
+            "queue_depth": self.queue_depth,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "wait_avg": self.wait_total / self.completed if self.completed else 0.0,
+            "wait_max": self.wait_max,
+        }
+
+    def shutdown(self) -> None:
+
+        """
+        The shutdown function stops the worker threads after the running jobs finish.
+
+        :param self: Represent the instance of the class
+        :return: None
+        :doc-author: Trelent
+        """
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
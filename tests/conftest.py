@@ -3,14 +3,15 @@ import asyncio
 import pytest
 import pytest_asyncio
 from fastapi.testclient import TestClient
-from fastapi_limiter import FastAPILimiter
 from sqlalchemy.pool import StaticPool
 from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
 
 from main import app
 from src.entity.models import Base, User
-from src.database.db import get_db
+from src.database.db import get_db, get_read_db
 from src.services.auth import auth_service
+from src.services.rate_limit import rate_limits
+from src.conf.config import config
 
 SQLALCHEMY_DATABASE_URL = "sqlite+aiosqlite:///./test.db"
 
@@ -53,15 +54,36 @@ def client():
         except Exception as err:
             print(err)
             await session.rollback()
+            raise
         finally:
             await session.close()
 
     app.dependency_overrides[get_db] = override_get_db
+    app.dependency_overrides[get_read_db] = override_get_db
+    # Tests call the same route many times; test_rate_limit turns the limiter back on
+    rate_limits.enabled = False
 
     yield TestClient(app)
+    rate_limits.enabled = True
 
 
 @pytest_asyncio.fixture()
 async def get_token():
     token = await auth_service.create_access_token(data={"sub": test_user["email"]})
     return token
+
+
+@pytest.fixture()
+def query_budget(monkeypatch):
+    """
+    Turn on the X-DB-Queries debug header and return a check that fails when a response
+    needed more statements than its budget, which is how N+1 regressions show up.
+    """
+    monkeypatch.setattr(config, "DEBUG", True)
+
+    def check(response, budget: int):
+        count = int(response.headers["X-DB-Queries"])
+        assert count <= budget, f"{response.request.method} {response.request.url.path} ran {count} queries, budget {budget}"
+        return count
+
+    return check
@@ -1,10 +1,10 @@
 import pytest
 
-from unittest.mock import Mock, patch, AsyncMock
+from unittest.mock import Mock, patch
 from sqlalchemy import select
 from tests.conftest import TestingSessionLocal
 
-from src.entity.models import User
+from src.entity.models import User, OutboxEmail
 from src.services.auth import auth_service
 from tests.conftest import TestingSessionLocal, test_user
 from src.conf import messages
@@ -15,12 +15,7 @@ user_data = {"username": "Boogerman", "email": "boogerman@example.com", "passwor
 def test_signup(client, monkeypatch):
     with patch.object(auth_service, 'cache') as redis_mock:
         redis_mock.get.return_value = None
-        monkeypatch.setattr("fastapi_limiter.FastAPILimiter.redis", AsyncMock())
-        monkeypatch.setattr("fastapi_limiter.FastAPILimiter.identifier", AsyncMock())
-        monkeypatch.setattr("fastapi_limiter.FastAPILimiter.http_callback", AsyncMock())
 
-        mock_send_email = Mock()
-        monkeypatch.setattr("src.routes.auth.send_email", mock_send_email)
         response = client.post("api/auth/signup", json=user_data)
         assert response.status_code == 201, response.text
         data = response.json()
@@ -28,18 +23,21 @@ def test_signup(client, monkeypatch):
         assert data["email"] == user_data["email"]
         assert "password" not in data
         assert "avatar" in data
-        assert mock_send_email.called
+
+
+@pytest.mark.asyncio
+async def test_signup_queues_confirmation_email(client):
+    async with TestingSessionLocal() as session:
+        email = (await session.execute(select(OutboxEmail).where(OutboxEmail.recipient == user_data["email"]))
+                 ).scalar_one()
+    assert email.template == "verify_email"
+    assert email.status == "pending"
+    assert email.payload["username"] == user_data["username"]
 
 
 def test_repeat_signup(client, monkeypatch):
     with patch.object(auth_service, 'cache') as redis_mock:
         redis_mock.get.return_value = None
-        monkeypatch.setattr("fastapi_limiter.FastAPILimiter.redis", AsyncMock())
-        monkeypatch.setattr("fastapi_limiter.FastAPILimiter.identifier", AsyncMock())
-        monkeypatch.setattr("fastapi_limiter.FastAPILimiter.http_callback", AsyncMock())
-
-        mock_send_email = Mock()
-        monkeypatch.setattr("src.routes.auth.send_email", mock_send_email)
 
         class MockFastAPIError(Exception):
             status_code = 409
@@ -54,9 +52,6 @@ def test_repeat_signup(client, monkeypatch):
 def test_not_confirmed_login(client, monkeypatch):
     with patch.object(auth_service, 'cache') as redis_mock:
         redis_mock.get.return_value = None
-        monkeypatch.setattr("fastapi_limiter.FastAPILimiter.redis", AsyncMock())
-        monkeypatch.setattr("fastapi_limiter.FastAPILimiter.identifier", AsyncMock())
-        monkeypatch.setattr("fastapi_limiter.FastAPILimiter.http_callback", AsyncMock())
 
         response = client.post("api/auth/login", data={"username": user_data.get("username"),
                                                        "password": user_data.get("password")})
@@ -69,9 +64,6 @@ def test_not_confirmed_login(client, monkeypatch):
 async def test_login(client, monkeypatch):
     with patch.object(auth_service, 'cache') as redis_mock:
         redis_mock.get.return_value = None
-        monkeypatch.setattr("fastapi_limiter.FastAPILimiter.redis", AsyncMock())
-        monkeypatch.setattr("fastapi_limiter.FastAPILimiter.identifier", AsyncMock())
-        monkeypatch.setattr("fastapi_limiter.FastAPILimiter.http_callback", AsyncMock())
         async with TestingSessionLocal() as session:
             current_user = await session.execute(
                 select(User).where(User.email == user_data.get("email"))
@@ -98,9 +90,6 @@ async def test_login(client, monkeypatch):
 def test_wrong_password_login(client, monkeypatch):
     with patch.object(auth_service, 'cache') as redis_mock:
         redis_mock.get.return_value = None
-        monkeypatch.setattr("fastapi_limiter.FastAPILimiter.redis", AsyncMock())
-        monkeypatch.setattr("fastapi_limiter.FastAPILimiter.identifier", AsyncMock())
-        monkeypatch.setattr("fastapi_limiter.FastAPILimiter.http_callback", AsyncMock())
         response = client.post("api/auth/login",
                                data={"username": user_data.get("email"), "password": "password"})
         assert response.status_code == 401, response.text
@@ -111,9 +100,6 @@ def test_wrong_password_login(client, monkeypatch):
 def test_wrong_email_login(client, monkeypatch):
     with patch.object(auth_service, 'cache') as redis_mock:
         redis_mock.get.return_value = None
-        monkeypatch.setattr("fastapi_limiter.FastAPILimiter.redis", AsyncMock())
-        monkeypatch.setattr("fastapi_limiter.FastAPILimiter.identifier", AsyncMock())
-        monkeypatch.setattr("fastapi_limiter.FastAPILimiter.http_callback", AsyncMock())
         response = client.post("api/auth/login",
                                data={"username": "test@email.com", "password": user_data.get("password")})
         assert response.status_code == 401, response.text
@@ -124,11 +110,20 @@ def test_wrong_email_login(client, monkeypatch):
 def test_validation_error_login(client, monkeypatch):
     with patch.object(auth_service, 'cache') as redis_mock:
         redis_mock.get.return_value = None
-        monkeypatch.setattr("fastapi_limiter.FastAPILimiter.redis", AsyncMock())
-        monkeypatch.setattr("fastapi_limiter.FastAPILimiter.identifier", AsyncMock())
-        monkeypatch.setattr("fastapi_limiter.FastAPILimiter.http_callback", AsyncMock())
         response = client.post("api/auth/login",
                                data={"password": user_data.get("password")})
         assert response.status_code == 422, response.text
         data = response.json()
         assert "detail" in data
+
+
+@pytest.mark.asyncio
+async def test_request_email_unknown_address(client):
+    with patch.object(auth_service, 'cache') as redis_mock:
+        redis_mock.get.return_value = None
+        response = client.post("api/auth/request_email", json={"email": "nobody@example.com"})
+        assert response.status_code == 200, response.text
+        assert response.json() == {"message": "Check your email for confirmation."}
+    async with TestingSessionLocal() as session:
+        emails = await session.execute(select(OutboxEmail).where(OutboxEmail.recipient == "nobody@example.com"))
+        assert emails.scalars().all() == []
@@ -0,0 +1,301 @@
+import json
+from unittest.mock import AsyncMock, patch
+
+import pytest
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from main import app
+from src.database.db import get_read_db
+from src.entity.models import Base
+from src.services.auth import auth_service
+from src.services.response_cache import response_cache
+from src.services.rate_limit import rate_limits
+
+
+@pytest.fixture()
+def mocks():
+    with patch.object(auth_service, 'cache', AsyncMock()) as redis_mock:
+        redis_mock.get.return_value = None
+        redis_mock.exists.return_value = 0
+        yield redis_mock
+
+
+def test_import_csv(client, get_token, mocks):
+    body = (
+        "name,surname,email,phone,birthday,notes\r\n"
+        "Anna,Kovalenko,anna@example.com,380501112233,1990-12-30,\"first line\nsecond line\"\r\n"
+        "Bob,Smith,not-an-email,380501112234,1991-01-02,\r\n"
+        "Carl,Jung,anna@example.com,380501112235,1992-02-03,dup\r\n"
+    )
+    response = client.post("api/contacts/import?format=csv", content=body.encode(),
+                           headers={"Authorization": f"Bearer {get_token}", "Content-Type": "text/csv"})
+    assert response.status_code == 200, response.text
+    data = response.json()
+    assert data["imported"] == 1
+    assert data["failed"] == 2
+    assert [error["row"] for error in data["errors"]] == [2, 3]
+    assert data["errors"][0]["errors"][0].startswith("email")
+
+
+def test_import_ndjson(client, get_token, mocks):
+    rows = [
+        {"name": "Dan", "surname": "Brown", "email": "dan@example.com", "phone": "380501112236",
+         "birthday": "1993-03-04", "notes": None},
+        {"name": "Eve", "surname": "White", "email": "anna@example.com", "phone": "380501112237",
+         "birthday": "1994-04-05", "notes": None},
+        "not an object",
+    ]
+    body = "\n".join(json.dumps(row) for row in rows)
+    response = client.post("api/contacts/import?format=ndjson", content=body.encode(),
+                           headers={"Authorization": f"Bearer {get_token}"})
+    assert response.status_code == 200, response.text
+    data = response.json()
+    assert data["imported"] == 1
+    assert data["failed"] == 2
+    assert data["errors"][0] == {"row": 2, "errors": ["Contact with this email or phone already exists"]}
+    assert data["errors"][1] == {"row": 3, "errors": ["Expected a JSON object"]}
+
+
+def test_import_latin1_rows_fail(client, get_token, mocks):
+    body = (
+        "name,surname,email,phone,birthday,notes\r\n"
+        "Zoë,Müller,zoe@example.com,380501112239,1990-01-01,\r\n"
+        "José,Peña,jose@example.com,380501112240,1990-01-02,\r\n"
+    ).encode("latin-1")
+    response = client.post("api/contacts/import?format=csv", content=body,
+                           headers={"Authorization": f"Bearer {get_token}", "Content-Type": "text/csv"})
+    assert response.status_code == 200, response.text
+    data = response.json()
+    assert data["imported"] == 0
+    assert data["errors"] == [{"row": 1, "errors": ["Record is not valid UTF-8"]},
+                              {"row": 2, "errors": ["Record is not valid UTF-8"]}]
+
+
+def test_export_ndjson(client, get_token, mocks):
+    response = client.get("api/contacts/export?format=ndjson", headers={"Authorization": f"Bearer {get_token}",
+                                                                       "Accept-Encoding": "gzip"})
+    assert response.status_code == 200, response.text
+    assert response.headers["content-type"] == "application/x-ndjson"
+    assert response.headers["content-encoding"] == "gzip"
+    rows = [json.loads(line) for line in response.text.splitlines()]
+    assert [row["email"] for row in rows] == ["dan@example.com", "anna@example.com"]
+    assert rows[1]["notes"] == "first line\nsecond line"
+    # Dates and datetimes are written as the JSON API writes them
+    listed = client.get("api/contacts", headers={"Authorization": f"Bearer {get_token}"}).json()
+    api = {row["id"]: row for row in listed}
+    for row in rows:
+        assert row["birthday"] == api[row["id"]]["birthday"]
+        assert row["created_at"] == api[row["id"]]["created_at"]
+        assert "T" in row["created_at"]
+
+
+def test_export_csv_can_be_imported(client, get_token, mocks):
+    response = client.get("api/contacts/export?format=csv", headers={"Authorization": f"Bearer {get_token}"})
+    assert response.status_code == 200, response.text
+    assert response.text.splitlines()[0] == "id,name,surname,email,phone,birthday,notes,created_at,updated_at"
+    response = client.post("api/contacts/import?format=csv", content=response.content,
+                           headers={"Authorization": f"Bearer {get_token}"})
+    data = response.json()
+    assert data["imported"] == 0
+    assert data["failed"] == 2
+
+
+def test_batch_update_and_delete(client, get_token, mocks):
+    headers = {"Authorization": f"Bearer {get_token}"}
+    ids = [row["id"] for row in client.get("api/contacts", headers=headers).json()]
+    assert len(ids) == 2
+
+    response = client.patch("api/contacts/batch", headers=headers,
+                            json={"ids": ids + [999], "changes": {"notes": "batch", "birthday": "2000-01-15"}})
+    assert response.status_code == 200, response.text
+    assert response.json() == {"updated": sorted(ids), "missing": [999]}
+    rows = client.get("api/contacts", headers=headers).json()
+    assert {row["notes"] for row in rows} == {"batch"}
+
+    response = client.patch("api/contacts/batch", headers=headers, json={"ids": ids, "changes": {}})
+    assert response.status_code == 422, response.text
+
+    response = client.request("DELETE", "api/contacts/batch", headers=headers, json={"ids": [ids[0], 999]})
+    assert response.status_code == 200, response.text
+    assert response.json() == {"deleted": [ids[0]], "missing": [999]}
+    assert [row["id"] for row in client.get("api/contacts", headers=headers).json()] == [ids[1]]
+
+
+def test_create_update_delete_contact(client, get_token, mocks):
+    headers = {"Authorization": f"Bearer {get_token}"}
+    body = {"name": "Finn", "surname": "Human", "email": "finn@example.com", "phone": "380501112238",
+            "birthday": "1995-05-06", "notes": "created"}
+    response = client.post("api/contacts", headers=headers, json=body)
+    assert response.status_code == 201, response.text
+    contact = response.json()
+    assert contact["email"] == body["email"]
+    assert contact["user"]["email"] == "deadpool@example.com"
+
+    response = client.put(f"api/contacts/{contact['id']}", headers=headers, json=dict(body, notes="updated"))
+    assert response.status_code == 200, response.text
+    assert response.json()["notes"] == "updated"
+    assert response.json()["user"]["email"] == "deadpool@example.com"
+
+    response = client.delete(f"api/contacts/{contact['id']}", headers=headers)
+    assert response.status_code == 200, response.text
+    assert response.json()["id"] == contact["id"]
+    assert client.get(f"api/contacts/{contact['id']}", headers=headers).status_code == 404
+    assert client.put(f"api/contacts/{contact['id']}", headers=headers, json=body).status_code == 404
+
+
+def test_sparse_fieldsets(client, get_token, mocks):
+    headers = {"Authorization": f"Bearer {get_token}"}
+    rows = client.get("api/contacts?fields=name,user", headers=headers).json()
+    assert rows and all(set(row) == {"name", "user"} for row in rows)
+    assert rows[0]["user"]["email"] == "deadpool@example.com"
+
+    row = client.get("api/contacts", headers=headers).json()[0]
+    assert "user" not in row
+    response = client.get(f"api/contacts/{row['id']}?fields=email", headers=headers)
+    assert response.status_code == 200, response.text
+    assert response.json() == {"email": row["email"]}
+
+    for fields in ("password", ",", "name,user_id"):
+        response = client.get(f"api/contacts?fields={fields}", headers=headers)
+        assert response.status_code == 400, response.text
+
+
+def test_list_matches_validated_response(client, get_token, mocks):
+    # Lists skip validation of the rows, single contacts go through response_model
+    headers = {"Authorization": f"Bearer {get_token}"}
+    fields = "id,name,surname,email,phone,birthday,notes,created_at,updated_at,user"
+    for row in client.get(f"api/contacts?fields={fields}", headers=headers).json():
+        assert client.get(f"api/contacts/{row['id']}?fields={fields}", headers=headers).json() == row
+
+
+def test_conditional_get(client, get_token, mocks, query_budget):
+    headers = {"Authorization": f"Bearer {get_token}"}
+    response = client.get("api/contacts", headers=headers)
+    etag = response.headers["ETag"]
+    assert etag.startswith('W/"')
+    response = client.get("api/contacts", headers=dict(headers, **{"If-None-Match": etag}))
+    assert response.status_code == 304
+    assert response.content == b""
+    # Loading the user and looking up its write version, no query over the contacts
+    query_budget(response, 2)
+
+    contact = client.get("api/contacts", headers=headers).json()[0]
+    response = client.get(f"api/contacts/{contact['id']}", headers=headers)
+    contact_etag = response.headers["ETag"]
+    response = client.get(f"api/contacts/{contact['id']}", headers=dict(headers, **{"If-None-Match": contact_etag}))
+    assert response.status_code == 304
+
+    body = {key: contact[key] for key in ("name", "surname", "email", "phone", "birthday")}
+    response = client.put(f"api/contacts/{contact['id']}", headers=headers, json=dict(body, notes="changed"))
+    assert response.status_code == 200, response.text
+    for url, old in (("api/contacts", etag), (f"api/contacts/{contact['id']}", contact_etag)):
+        response = client.get(url, headers=dict(headers, **{"If-None-Match": old}))
+        assert response.status_code == 200
+        assert response.headers["ETag"] != old
+
+
+class FakeRedis:
+    def __init__(self):
+        self.data = {}
+
+    async def get(self, key):
+        return self.data.get(key)
+
+    async def set(self, key, value, ex=None):
+        self.data[key] = value
+
+
+def test_response_cache(client, get_token, mocks, monkeypatch):
+    monkeypatch.setattr(response_cache, "client", FakeRedis())
+    headers = {"Authorization": f"Bearer {get_token}"}
+    hits = response_cache.hits
+    for url in ("api/contacts?limit=10", "api/contacts/find/example", "api/contacts/upcoming_birthdays/?days=365"):
+        first = client.get(url, headers=headers)
+        assert first.status_code == 200, first.text
+        second = client.get(url, headers=headers)
+        assert second.content == first.content
+        assert second.headers.get("ETag") == first.headers.get("ETag")
+    assert response_cache.hits == hits + 3
+
+    contact = client.get("api/contacts", headers=headers).json()[0]
+    assert response_cache.hits == hits + 4
+    body = {key: contact[key] for key in ("name", "surname", "email", "phone", "birthday")}
+    response = client.put(f"api/contacts/{contact['id']}", headers=headers, json=dict(body, notes="cached"))
+    assert response.status_code == 200, response.text
+    rows = client.get("api/contacts?limit=10", headers=headers).json()
+    assert [row["notes"] for row in rows if row["id"] == contact["id"]] == ["cached"]
+    assert response_cache.hits == hits + 4
+
+
+def test_internal_stats(client, mocks, monkeypatch):
+    monkeypatch.setattr("src.services.auth.config.INTERNAL_TOKEN", None)
+    assert client.get("api/internal/stats").status_code == 404
+    monkeypatch.setattr("src.services.auth.config.INTERNAL_TOKEN", "internal")
+    assert client.get("api/internal/stats").status_code == 403
+    assert client.get("api/internal/stats", headers={"Authorization": "Bearer other"}).status_code == 403
+    response = client.get("api/internal/stats", headers={"Authorization": "Bearer internal"})
+    assert response.status_code == 200, response.text
+    assert "db_pool" in response.json()
+
+
+def test_metrics(client, get_token, mocks, monkeypatch):
+    monkeypatch.setattr("src.services.auth.config.INTERNAL_TOKEN", "internal")
+    client.get("api/users/me", headers={"Authorization": f"Bearer {get_token}"})
+    assert client.get("metrics").status_code == 403
+    response = client.get("metrics", headers={"Authorization": "Bearer internal"})
+    assert response.status_code == 200, response.text
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    assert 'http_requests_total{method="GET",route="/api/users/me",status="200"}' in response.text
+    assert "http_request_duration_seconds_bucket" in response.text
+    assert "auth_token_cache_hits_total" in response.text
+    assert 'auth_user_lookups_total{source="' in response.text
+    assert "db_pool_" in response.text
+
+
+def test_query_budgets(client, get_token, mocks, query_budget):
+    headers = {"Authorization": f"Bearer {get_token}"}
+    client.get("api/users/me", headers=headers)
+    body = {"name": "Gus", "surname": "Budget", "email": "gus@example.com", "phone": "380501112239",
+            "birthday": "1996-07-08", "notes": None}
+
+    response = client.post("api/contacts", headers=headers, json=body)
+    query_budget(response, 2)
+    contact_id = response.json()["id"]
+    query_budget(client.get("api/contacts?limit=50", headers=headers), 2)
+    query_budget(client.get(f"api/contacts/{contact_id}", headers=headers), 2)
+    query_budget(client.get("api/contacts/find/budget", headers=headers), 2)
+    query_budget(client.get("api/contacts/upcoming_birthdays/", headers=headers), 2)
+    query_budget(client.put(f"api/contacts/{contact_id}", headers=headers, json=dict(body, notes="x")), 2)
+    query_budget(client.delete(f"api/contacts/{contact_id}", headers=headers), 2)
+
+
+def test_rate_limit(client, get_token, mocks, monkeypatch):
+    monkeypatch.setattr(rate_limits, "enabled", True)
+    headers = {"Authorization": f"Bearer {get_token}"}
+    statuses = [client.get("api/contacts/upcoming_birthdays/", headers=headers).status_code for _ in range(4)]
+    assert statuses == [200, 200, 200, 429]
+    response = client.get("api/contacts/upcoming_birthdays/", headers=headers)
+    assert 0 < int(response.headers["Retry-After"]) <= 20
+    assert client.get("api/contacts/upcoming_birthdays/", headers={"Authorization": "Bearer other"}).status_code == 401
+
+
+def test_stale_replica_is_not_read(client, get_token, mocks, monkeypatch):
+    headers = {"Authorization": f"Bearer {get_token}"}
+    expected = client.get("api/contacts", headers=headers)
+    # A replica that hasn't replicated anything yet, not even the user
+    replica = create_async_engine("sqlite+aiosqlite:///:memory:", poolclass=StaticPool)
+
+    async def stale_read_db():
+        async with replica.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        async with async_sessionmaker(bind=replica)() as session:
+            yield session
+
+    monkeypatch.setitem(app.dependency_overrides, get_read_db, stale_read_db)
+    response = client.get("api/contacts", headers=headers)
+    assert response.json() == expected.json() != []
+    assert response.headers["ETag"] == expected.headers["ETag"]
+    contact = expected.json()[0]
+    assert client.get(f"api/contacts/{contact['id']}", headers=headers).json()["id"] == contact["id"]
+    assert client.get(f"api/contacts/find/{contact['email']}", headers=headers).json()[0]["id"] == contact["id"]
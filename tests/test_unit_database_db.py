@@ -0,0 +1,143 @@
+import contextlib
+import io
+import os
+import time
+import unittest
+from unittest.mock import patch
+
+from sqlalchemy import text
+
+from src.conf.config import config
+from src.database.db import DBSessionManager, InstrumentedQueuePool, track_queries, redact
+
+
+class TestAsyncDBSessionManager(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.manager = DBSessionManager("sqlite+aiosqlite:///./test_pool.db", poolclass=InstrumentedQueuePool,
+                                        pool_size=2, max_overflow=1, pool_pre_ping=True)
+
+    async def asyncTearDown(self):
+        await self.manager.close()
+        os.remove("./test_pool.db")
+
+    async def test_warm_up_fills_pool(self):
+        await self.manager.warm_up(5)
+        stats = self.manager.stats()
+        self.assertEqual(stats["checked_in"], 2)
+        self.assertEqual(stats["checked_out"], 0)
+        self.assertEqual(stats["wait_time"]["count"], 2)
+
+    async def test_warm_up_closes_opened_connections_on_failure(self):
+        pool = self.manager._engine.pool
+        create = pool._create_connection
+        calls = []
+
+        def flaky():
+            calls.append(None)
+            if len(calls) == 2:
+                raise ConnectionError("refused")
+            return create()
+
+        with patch.object(pool, "_create_connection", flaky), self.assertRaises(ConnectionError):
+            await self.manager.warm_up(2)
+        stats = self.manager.stats()
+        self.assertEqual(stats["checked_out"], 0)
+        self.assertEqual(stats["checked_in"], 1)
+
+    async def test_wait_time_excludes_connecting(self):
+        pool = self.manager._engine.pool
+        create = pool._create_connection
+
+        def slow():
+            time.sleep(0.2)
+            return create()
+
+        with patch.object(pool, "_create_connection", slow):
+            await self.manager.warm_up(1)
+        wait_time = self.manager.stats()["wait_time"]
+        self.assertEqual(wait_time["count"], 1)
+        self.assertLess(wait_time["sum"], 0.1)
+
+    async def test_stats_track_checkouts(self):
+        async with self.manager.session() as session:
+            await session.execute(text("SELECT 1"))
+            stats = self.manager.stats()
+            self.assertEqual(stats["checked_out"], 1)
+        stats = self.manager.stats()
+        self.assertEqual(stats["checked_out"], 0)
+        self.assertEqual(stats["wait_time"]["buckets"]["+Inf"], stats["wait_time"]["count"])
+
+    async def test_track_queries(self):
+        with track_queries() as outer:
+            async with self.manager.session() as session:
+                await session.execute(text("SELECT 1"))
+                with track_queries() as inner:
+                    await session.execute(text("SELECT 2"))
+                    await session.execute(text("SELECT 3"))
+        self.assertEqual(outer.count, 1)
+        self.assertEqual(inner.count, 2)
+        self.assertGreater(inner.seconds, 0)
+
+    async def test_slow_queries_are_logged_redacted(self):
+        output = io.StringIO()
+        with patch.object(config, "SLOW_QUERY_MS", 0), contextlib.redirect_stdout(output):
+            async with self.manager.session() as session:
+                await session.execute(text("SELECT :email"), {"email": "secret@example.com"})
+        self.assertIn("Slow query", output.getvalue())
+        self.assertIn("SELECT ?", output.getvalue())
+        self.assertNotIn("secret@example.com", output.getvalue())
+
+
+class TestAsyncReadReplicas(unittest.IsolatedAsyncioTestCase):
+    """
+    Two local SQLite files stand in for the primary and its replica,
+    a third URL points to a directory that does not exist and can never be opened.
+    """
+
+    async def asyncSetUp(self):
+        self.manager = DBSessionManager("sqlite+aiosqlite:///./test_primary.db",
+                                        ["sqlite+aiosqlite:///./test_replica.db",
+                                         "sqlite+aiosqlite:///./missing/test_replica.db"])
+        for name, session_maker in (("primary", self.manager._session_maker),
+                                    ("replica", self.manager._replica_session_makers[0])):
+            async with session_maker() as session:
+                await session.execute(text("CREATE TABLE IF NOT EXISTS role (name TEXT)"))
+                await session.execute(text("DELETE FROM role"))
+                await session.execute(text("INSERT INTO role VALUES (:name)"), {"name": name})
+                await session.commit()
+
+    async def asyncTearDown(self):
+        await self.manager.close()
+        os.remove("./test_primary.db")
+        os.remove("./test_replica.db")
+
+    async def read_role(self):
+        async with self.manager.read_session() as session:
+            return (await session.execute(text("SELECT name FROM role"))).scalar_one()
+
+    async def test_unhealthy_replica_is_skipped(self):
+        await self.manager.check_replicas()
+        self.assertEqual([replica["healthy"] for replica in self.manager.stats()["replicas"]], [True, False])
+        self.assertEqual([await self.read_role() for _ in range(3)], ["replica"] * 3)
+
+    async def test_falls_back_to_primary(self):
+        self.manager._replica_healthy = [False, False]
+        self.assertEqual(await self.read_role(), "primary")
+
+    async def test_writes_go_to_primary(self):
+        async with self.manager.session() as session:
+            role = (await session.execute(text("SELECT name FROM role"))).scalar_one()
+        self.assertEqual(role, "primary")
+
+
+class TestRedact(unittest.TestCase):
+
+    def test_redact(self):
+        self.assertEqual(redact({"email": "a@b.c", "id": 1}), {"email": "str", "id": "int"})
+        self.assertEqual(redact(("a@b.c", None)), ("str", "NoneType"))
+        self.assertEqual(redact([{"id": 1}] * 5), [{"id": "int"}] * 3 + ["..."])
+
+
+if __name__ == '__main__':
+    unittest.main()
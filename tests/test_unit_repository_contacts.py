@@ -1,12 +1,15 @@
 import unittest
 import asyncio
-from unittest.mock import MagicMock, AsyncMock
+from datetime import date
+from unittest.mock import MagicMock, AsyncMock, patch
 
-from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine, async_sessionmaker
+from sqlalchemy.pool import StaticPool
 
-from src.entity.models import Contact, User
+from src.entity.models import Base, Contact, User
 from src.repository.contacts import (
-    get_contacts, get_contact, create_contact, update_contact, delete_contact, find_contacts, upcoming_birthday
+    get_contacts, get_contact, create_contact, update_contact, delete_contact, find_contacts, upcoming_birthday,
+    encode_cursor, decode_cursor, birthday_key, write_version
 )
 from src.schemas.contact import ContactSchema, ContactUpdateSchema
 
@@ -17,6 +20,12 @@ class TestAsyncContacts(unittest.IsolatedAsyncioTestCase):
         self.user = User(id=1, username="test_user", password="test_password", email="test_email", confirm=True)
         self.session = AsyncMock(spec=AsyncSession)
 
+    def assert_version_bumped(self):
+        self.assertEqual(self.session.execute.await_count, 2)
+        stmt = self.session.execute.call_args_list[1].args[0]
+        self.assertEqual(stmt.table.name, "users")
+        self.assertEqual(stmt.compile().params["id_1"], self.user.id)
+
     async def test_get_contacts(self):
         limit = 10
         offset = 0
@@ -25,16 +34,45 @@ class TestAsyncContacts(unittest.IsolatedAsyncioTestCase):
                     Contact(id=2, name="test_name", surname="test_surname", email="test_email", phone="test_phone",
                             birthday="test_birthday", notes="test_notes", user=self.user)]
         mocked_contacts = MagicMock()
-        mocked_contacts.scalars.return_value.all.return_value = contacts
+        mocked_contacts.all.return_value = contacts
         self.session.execute.return_value = mocked_contacts
         result = await get_contacts(limit, offset, self.session, user=self.user)
         self.assertEqual(result, contacts)
 
+    async def test_get_contacts_with_cursor(self):
+        limit = 10
+        offset = 0
+        cursor = encode_cursor(Contact(id=7, name="test_name", surname="test_surname"))
+        contacts = [Contact(id=8, name="test_name", surname="test_surname", email="test_email", phone="test_phone",
+                            birthday="test_birthday", notes="test_notes", user=self.user)]
+        mocked_contacts = MagicMock()
+        mocked_contacts.all.return_value = contacts
+        self.session.execute.return_value = mocked_contacts
+        result = await get_contacts(limit, offset, self.session, user=self.user, cursor=cursor)
+        self.assertEqual(result, contacts)
+        stmt = self.session.execute.call_args.args[0]
+        self.assertIsNone(stmt._offset_clause)
+
+    async def test_get_contacts_invalid_cursor(self):
+        with self.assertRaises(ValueError):
+            await get_contacts(10, 0, self.session, user=self.user, cursor="not-a-cursor")
+        self.session.execute.assert_not_called()
+
+    async def test_get_contacts_selects_requested_fields(self):
+        self.session.execute.return_value = MagicMock()
+        await get_contacts(10, 0, self.session, user=self.user, fields=["email", "user"])
+        stmt = self.session.execute.call_args.args[0]
+        self.assertEqual([column.key for column in stmt.selected_columns], ["id", "surname", "name", "email"])
+
+    def test_cursor_roundtrip(self):
+        contact = Contact(id=42, name="Іван", surname="Петренко")
+        self.assertEqual(decode_cursor(encode_cursor(contact)), ("Петренко", "Іван", 42))
+
     async def test_get_contact(self):
         contact = Contact(id=1, name="test_name", surname="test_surname", email="test_email", phone="test_phone",
                           birthday="test_birthday", notes="test_notes", user=self.user)
         mocked_contact = MagicMock()
-        mocked_contact.scalar_one_or_none.return_value = contact
+        mocked_contact.one_or_none.return_value = contact
         self.session.execute.return_value = mocked_contact
         result = await get_contact(1, self.session, user=self.user)
         self.assertEqual(result, contact)
@@ -42,45 +80,71 @@ class TestAsyncContacts(unittest.IsolatedAsyncioTestCase):
     async def test_create_contact(self):
         body = ContactSchema(name="test_name", surname="test_surname", email="test@email.com", phone="9876543210",
                              birthday="1986-01-01", notes="test_notes")
+        row = MagicMock(id=1, **body.model_dump())
+        mocked_contact = MagicMock()
+        mocked_contact.one.return_value = row
+        self.session.execute.return_value = mocked_contact
         result = await create_contact(body, self.session, user=self.user)
-        self.assertIsInstance(result, Contact)
-        self.assertEqual(result.name, body.name)
-        self.assertEqual(result.surname, body.surname)
-        self.assertEqual(result.email, body.email)
-        self.assertEqual(result.phone, body.phone)
-        self.assertEqual(result.birthday, body.birthday)
-        self.assertEqual(result.notes, body.notes)
+        self.assertEqual(result, row)
+        stmt = self.session.execute.call_args_list[0].args[0]
+        params = stmt.compile().params
+        self.assertEqual(params["name"], body.name)
+        self.assertEqual(params["email"], body.email)
+        self.assertEqual(params["birthday"], body.birthday)
+        self.assertEqual(params["birthday_mmdd"], 101)
+        self.assertEqual(params["user_id"], self.user.id)
+        self.assert_version_bumped()
+        self.session.commit.assert_awaited_once()
+        self.session.refresh.assert_not_called()
 
     async def test_update_contact(self):
         body = ContactUpdateSchema(name="test_name", surname="test_surname", email="test@email.com", phone="9876543210",
                                    birthday="1986-01-01", notes="test_notes")
+        row = MagicMock(id=1, **body.model_dump())
         mocked_contact = MagicMock()
-        mocked_contact.scalar_one_or_none.return_value = Contact(id=1, name="test_name", surname="test_surname",
-                                                                 email="test_email", phone="1023456789",
-                                                                 birthday="1986-01-01", notes="test_notes",
-                                                                 user=self.user)
+        mocked_contact.one_or_none.return_value = row
+        self.session.execute.return_value = mocked_contact
+        result = await update_contact(1, body, self.session, user=self.user)
+        self.assertEqual(result, row)
+        params = self.session.execute.call_args_list[0].args[0].compile().params
+        self.assertEqual(params["name"], body.name)
+        self.assertEqual(params["surname"], body.surname)
+        self.assertEqual(params["email"], body.email)
+        self.assertEqual(params["phone"], body.phone)
+        self.assertEqual(params["birthday"], body.birthday)
+        self.assertEqual(params["notes"], body.notes)
+        self.assertEqual(params["id_1"], 1)
+        self.assertEqual(params["user_id_1"], self.user.id)
+        self.assert_version_bumped()
+        self.session.refresh.assert_not_called()
 
+    async def test_update_missing_contact(self):
+        body = ContactUpdateSchema(name="test_name", surname="test_surname", email="test@email.com", phone="9876543210",
+                                   birthday="1986-01-01", notes="test_notes")
+        mocked_contact = MagicMock()
+        mocked_contact.one_or_none.return_value = None
         self.session.execute.return_value = mocked_contact
         result = await update_contact(1, body, self.session, user=self.user)
-        self.assertIsInstance(result, Contact)
-        self.assertEqual(result.name, body.name)
-        self.assertEqual(result.surname, body.surname)
-        self.assertEqual(result.email, body.email)
-        self.assertEqual(result.phone, body.phone)
-        self.assertEqual(result.birthday, body.birthday)
-        self.assertEqual(result.notes, body.notes)
+        self.assertIsNone(result)
+        self.session.execute.assert_awaited_once()
 
     async def test_delete_contact(self):
+        row = MagicMock(id=1, name="test_name")
         mocked_contact = MagicMock()
-        mocked_contact.scalar_one_or_none.return_value = Contact(id=1, name="test_name", surname="test_surname",
-                                                                 email="test_email", phone="1023456789",
-                                                                 birthday="1986-01-01", notes="test_notes",
-                                                                 user=self.user)
+        mocked_contact.one_or_none.return_value = row
         self.session.execute.return_value = mocked_contact
         result = await delete_contact(1, self.session, user=self.user)
-        self.session.delete.assert_called_once()
+        self.assert_version_bumped()
         self.session.commit.assert_called_once()
-        self.assertIsInstance(result, Contact)
+        self.session.delete.assert_not_called()
+        self.assertEqual(result, row)
+
+    async def test_write_version_reads_only_the_user(self):
+        self.session.execute.return_value.scalar = MagicMock(return_value=7)
+        self.assertEqual(await write_version(self.session, self.user), 7)
+        stmt = self.session.execute.call_args.args[0]
+        self.assertEqual([table.name for table in stmt.get_final_froms()], ["users"])
+        self.assertEqual(stmt.compile().params["id_1"], self.user.id)
 
     async def test_find_contacts(self):
         query = "test"
@@ -89,7 +153,7 @@ class TestAsyncContacts(unittest.IsolatedAsyncioTestCase):
                     Contact(id=2, name="test_name", surname="test_surname", email="test_email", phone="test_phone",
                             birthday="test_birthday", notes="test_notes", user=self.user)]
         mocked_contacts = MagicMock()
-        mocked_contacts.scalars.return_value.all.return_value = contacts
+        mocked_contacts.all.return_value = contacts
         self.session.execute.return_value = mocked_contacts
         result = await find_contacts(query, self.session, user=self.user)
         self.assertEqual(result, contacts)
@@ -100,7 +164,7 @@ class TestAsyncContacts(unittest.IsolatedAsyncioTestCase):
                     Contact(id=2, name="test_name", surname="test_surname", email="test_email", phone="test_phone",
                             birthday="2022-01-01", notes="test_notes", user=self.user),]
         mocked_contacts = MagicMock()
-        mocked_contacts.scalars.return_value.all.return_value = contacts
+        mocked_contacts.all.return_value = contacts
         self.session.execute.return_value = mocked_contacts
         result = await upcoming_birthday(self.session, user=self.user)
         self.assertEqual(result, contacts)
@@ -110,5 +174,108 @@ class TestAsyncContacts(unittest.IsolatedAsyncioTestCase):
     #     await self.tearDown()
 
 
+
+def frozen_today(today: date):
+    """
+    Patch date.today in the contacts repository so birthday windows start on a known day.
+    """
+    class FrozenDate(date):
+        @classmethod
+        def today(cls):
+            return today
+
+    return patch("src.repository.contacts.date", FrozenDate)
+
+
+class TestContactQueries(unittest.IsolatedAsyncioTestCase):
+    """
+    Runs the search and birthday queries against SQLite, so filters and ordering are checked for real.
+    """
+
+    async def asyncSetUp(self):
+        self.engine = create_async_engine("sqlite+aiosqlite:///:memory:", poolclass=StaticPool)
+        async with self.engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        self.session = async_sessionmaker(autoflush=False, autocommit=False, expire_on_commit=False,
+                                          bind=self.engine)
+        async with self.session() as db:
+            self.user = User(username="owner", email="owner@example.com", password="secret", confirm=True)
+            self.other = User(username="other", email="other@example.com", password="secret", confirm=True)
+            db.add_all([self.user, self.other])
+            await db.commit()
+        self.phones = 0
+
+    async def asyncTearDown(self):
+        await self.engine.dispose()
+
+    async def add_contacts(self, *contacts: tuple[str, str, date | None], user: User | None = None) -> None:
+        user = user or self.user
+        async with self.session() as db:
+            for name, surname, birthday in contacts:
+                self.phones += 1
+                db.add(Contact(name=name, surname=surname, email=f"{name}.{surname}@example.com".lower(),
+                               phone=str(380500000000 + self.phones), birthday=birthday,
+                               birthday_mmdd=birthday_key(birthday), user_id=user.id))
+            await db.commit()
+
+    async def birthdays(self, today: date, days: int = 7) -> list[str]:
+        with frozen_today(today):
+            async with self.session() as db:
+                rows = await upcoming_birthday(db, self.user, days=days, fields=["name"])
+        return [row.name for row in rows]
+
+    async def find(self, query: str, limit: int = 50) -> list[str]:
+        async with self.session() as db:
+            rows = await find_contacts(query, db, self.user, limit=limit, fields=["name", "surname"])
+        return [f"{row.name} {row.surname}" for row in rows]
+
+    async def test_find_contacts_escapes_like_wildcards(self):
+        await self.add_contacts(("Pure", "100%", None), ("Under_Score", "Smith", None),
+                                ("Plain", "Jones", None), ("Back\\slash", "Lee", None))
+        self.assertEqual(await self.find("%"), ["Pure 100%"])
+        self.assertEqual(await self.find("0%"), ["Pure 100%"])
+        self.assertEqual(await self.find("_"), ["Under_Score Smith"])
+        self.assertEqual(await self.find("r_s"), ["Under_Score Smith"])
+        self.assertEqual(await self.find("\\"), ["Back\\slash Lee"])
+
+    async def test_find_contacts_matches_every_column(self):
+        await self.add_contacts(("Anna", "Kovalenko", None), ("Bob", "Annaberg", None), ("Carl", "Jung", None))
+        await self.add_contacts(("Anna", "Stranger", None), user=self.other)
+        self.assertEqual(await self.find("ANNA"), ["Bob Annaberg", "Anna Kovalenko"])
+        self.assertEqual(await self.find("kovalenko"), ["Anna Kovalenko"])
+        self.assertEqual(await self.find("carl.jung@"), ["Carl Jung"])
+        self.assertEqual(await self.find("380500000002"), ["Bob Annaberg"])
+        self.assertEqual(await self.find("missing"), [])
+
+    async def test_find_contacts_orders_by_surname_without_similarity(self):
+        await self.add_contacts(("Zed", "Example", None), ("Amy", "Example", None), ("Max", "Abbot", None),
+                                ("Amy", "Zimmer", None))
+        self.assertEqual(await self.find("example.com"),
+                         ["Max Abbot", "Amy Example", "Zed Example", "Amy Zimmer"])
+        self.assertEqual(await self.find("example.com", limit=2), ["Max Abbot", "Amy Example"])
+
+    async def test_upcoming_birthday_wraps_into_january(self):
+        await self.add_contacts(("Past", "Dec", date(1990, 12, 27)), ("Today", "Dec", date(1985, 12, 28)),
+                                ("Eve", "Dec", date(2001, 12, 31)), ("First", "Jan", date(1979, 1, 1)),
+                                ("Last", "Jan", date(1995, 1, 4)), ("Late", "Jan", date(1995, 1, 5)),
+                                ("Nobody", "None", None))
+        await self.add_contacts(("Stranger", "Jan", date(1990, 1, 1)), user=self.other)
+        self.assertEqual(await self.birthdays(date(2023, 12, 28)), ["Today", "Eve", "First", "Last"])
+
+    async def test_upcoming_birthday_orders_across_new_year(self):
+        await self.add_contacts(("Jan2", "B", date(2000, 1, 2)), ("Dec30", "B", date(1960, 12, 30)),
+                                ("Jan1", "B", date(1970, 1, 1)), ("Dec29", "B", date(2010, 12, 29)))
+        self.assertEqual(await self.birthdays(date(2023, 12, 29)), ["Dec29", "Dec30", "Jan1", "Jan2"])
+
+    async def test_upcoming_birthday_custom_days(self):
+        await self.add_contacts(("Before", "Jun", date(1990, 6, 9)), ("Start", "Jun", date(1990, 6, 10)),
+                                ("Middle", "Jun", date(1990, 6, 25)), ("End", "Jul", date(1990, 7, 10)),
+                                ("After", "Jul", date(1990, 7, 11)))
+        self.assertEqual(await self.birthdays(date(2024, 6, 10), days=30), ["Start", "Middle", "End"])
+        self.assertEqual(await self.birthdays(date(2024, 6, 10), days=0), ["Start"])
+        self.assertEqual(await self.birthdays(date(2024, 6, 10), days=365),
+                         ["Start", "Middle", "End", "After", "Before"])
+
+
 if __name__ == '__main__':
     unittest.main()
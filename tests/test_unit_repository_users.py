@@ -6,7 +6,7 @@ from sqlalchemy.ext.asyncio import AsyncSession
 
 from src.entity.models import Contact, User
 from src.repository.users import (
-    get_user_by_email, create_user, update_token, confirmed_email, update_avatar_url
+    get_user_by_email, create_user, confirmed_email, update_avatar_url
 )
 from src.schemas.user import UserSchema, UserResponseSchema, TokenSchema, LogoutResponse, RequestEmail
 
@@ -33,11 +33,6 @@ class TestAsyncUsers(unittest.IsolatedAsyncioTestCase):
         self.assertEqual(result.password, body.password)
         self.assertEqual(result.email, body.email)
 
-    async def test_update_token(self):
-        token = "test_token"
-        result = await update_token(self.user, token, self.session)
-        self.assertIsNone(result)
-
     async def test_confirmed_email(self):
         user = self.user
         mocked_user = MagicMock()
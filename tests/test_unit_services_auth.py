@@ -0,0 +1,59 @@
+import inspect
+import unittest
+from unittest.mock import AsyncMock, patch
+
+from fastapi import HTTPException
+from jose import jwt
+
+from src.database.db import get_db
+from src.services.auth import Auth
+from src.services.codec import CachedUser
+
+
+class TestAsyncAuth(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.auth = Auth()
+        self.auth.cache = AsyncMock()
+        self.auth.cache.exists.return_value = 0
+        self.auth.token_cache.clear()
+        self.auth.user_cache.clear()
+        self.user = CachedUser(id=1, username="test_user", email="test@email.com", avatar=None, confirm=True)
+        self.auth.user_cache.set(self.user.email, self.user)
+        self.token = await self.auth.create_access_token(data={"sub": self.user.email})
+
+    async def test_get_current_user_decodes_token_once(self):
+        with patch("src.services.auth.jwt.decode", wraps=jwt.decode) as decode:
+            first = await self.auth.get_current_user(self.token, AsyncMock())
+            second = await self.auth.get_current_user(self.token, AsyncMock())
+        self.assertEqual(first, self.user)
+        self.assertEqual(second, self.user)
+        decode.assert_called_once()
+        self.auth.cache.exists.assert_awaited_once()
+
+    async def test_revoked_token_is_rejected(self):
+        await self.auth.get_current_user(self.token, AsyncMock())
+        await self.auth.revoke_token(self.token)
+        key, value = self.auth.cache.set.call_args.args
+        self.assertEqual(key, f"revoked:{self.auth.token_digest(self.token)}")
+        self.assertGreater(self.auth.cache.set.call_args.kwargs["ex"], 0)
+        self.auth.cache.exists.return_value = 1
+        with self.assertRaises(HTTPException) as err:
+            await self.auth.get_current_user(self.token, AsyncMock())
+        self.assertEqual(err.exception.status_code, 401)
+
+    async def test_refresh_token_is_rejected(self):
+        token = await self.auth.create_refresh_token(data={"sub": self.user.email})
+        with self.assertRaises(HTTPException):
+            await self.auth.get_current_user(token, AsyncMock())
+        self.assertEqual(len(self.auth.token_cache), 0)
+
+
+    def test_users_are_loaded_from_primary(self):
+        # A replica may lag behind a signup or an email confirmation
+        db = inspect.signature(Auth.get_current_user).parameters["db"].default
+        self.assertIs(db.dependency, get_db)
+
+
+if __name__ == '__main__':
+    unittest.main()
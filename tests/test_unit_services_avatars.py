@@ -0,0 +1,187 @@
+import tempfile
+import unittest
+from contextlib import asynccontextmanager
+from io import BytesIO
+from pathlib import Path
+from unittest.mock import AsyncMock, MagicMock, patch
+
+from fastapi import HTTPException, Request
+from PIL import Image
+from starlette.applications import Starlette
+from starlette.routing import Mount
+from starlette.testclient import TestClient
+
+from cloudinary.exceptions import NotFound, RateLimited
+
+from src.services.avatars import (
+    AvatarPipeline, AvatarFiles, AvatarStorage, CloudinaryStorage, LocalStorage, render_avatar, IMMUTABLE
+)
+from src.services.workers import BoundedPool
+
+
+def image_bytes(size=(400, 300), color="red", fmt="PNG") -> bytes:
+    buffer = BytesIO()
+    Image.new("RGB", size, color).save(buffer, fmt)
+    return buffer.getvalue()
+
+
+def upload(data: bytes, content_type: str = "image/png", chunk_size: int = 4096,
+           content_length: bool = True, received: list | None = None) -> Request:
+    """
+    Build a multipart/form-data request with data in its file field. The body arrives in chunks,
+    every chunk read by the app is appended to received.
+    """
+    body = (b'--frontier\r\nContent-Disposition: form-data; name="file"; filename="avatar"\r\n'
+            b"Content-Type: " + content_type.encode() + b"\r\n\r\n" + data + b"\r\n--frontier--\r\n")
+    chunks = [body[start:start + chunk_size] for start in range(0, len(body), chunk_size)]
+    received = [] if received is None else received
+
+    async def receive():
+        chunk = chunks.pop(0)
+        received.append(chunk)
+        return {"type": "http.request", "body": chunk, "more_body": bool(chunks)}
+
+    headers = [(b"content-type", b"multipart/form-data; boundary=frontier")]
+    if content_length:
+        headers.append((b"content-length", str(len(body)).encode()))
+    return Request({"type": "http", "method": "PATCH", "headers": headers}, receive)
+
+
+class TestRenderAvatar(unittest.TestCase):
+
+    def test_squares(self):
+        renditions = render_avatar(BytesIO(image_bytes()), (250, 64))
+        for size, data in renditions.items():
+            with Image.open(BytesIO(data)) as image:
+                self.assertEqual((image.format, image.size), ("JPEG", (size, size)))
+
+
+class TestAvatarFiles(unittest.TestCase):
+
+    def test_cache_headers(self):
+        with tempfile.TemporaryDirectory() as directory:
+            Path(directory, "abc_250.jpg").write_bytes(b"jpeg")
+            client = TestClient(Starlette(routes=[Mount("/avatars", AvatarFiles(directory=directory))]))
+            response = client.get("/avatars/abc_250.jpg")
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.headers["cache-control"], IMMUTABLE)
+            self.assertEqual(client.get("/avatars/missing.jpg").status_code, 404)
+
+
+class TestAvatarPipeline(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.storage = LocalStorage(Path(self.directory.name), "/static/avatars")
+        self.db = MagicMock()
+
+        @asynccontextmanager
+        async def session():
+            yield self.db
+
+        self.pool = BoundedPool(workers=1, queue_size=1, name="test-avatar")
+        self.pipeline = AvatarPipeline(self.storage, self.pool, session=session)
+        self.update = patch("src.services.avatars.rep_users.update_avatar_url", AsyncMock()).start()
+        self.cache_user = patch("src.services.avatars.auth_service.cache_user", AsyncMock()).start()
+
+    def tearDown(self):
+        patch.stopall()
+        self.pool.shutdown()
+        self.directory.cleanup()
+
+    async def test_upload_is_processed_in_background(self):
+        await self.pipeline.submit("test@email.com", upload(image_bytes()))
+        self.assertEqual(self.pipeline.stats()["queued"], 1)
+        await self.pipeline.join()
+
+        url = self.update.await_args.args[1]
+        self.assertRegex(url, r"^/static/avatars/[0-9a-f]{32}_250\.jpg$")
+        self.assertEqual(self.update.await_args.args[0], "test@email.com")
+        self.cache_user.assert_awaited_once_with(self.update.return_value)
+        self.assertEqual(sorted(path.name[33:] for path in Path(self.directory.name).iterdir()),
+                         ["250.jpg", "64.jpg"])
+        self.assertEqual(self.pipeline.stats()["processed"], 1)
+
+    async def test_same_content_is_stored_once(self):
+        data = image_bytes()
+        await self.pipeline.submit("a@email.com", upload(data))
+        await self.pipeline.join()
+        with patch("src.services.avatars.render_avatar") as render:
+            await self.pipeline.submit("b@email.com", upload(data))
+            await self.pipeline.join()
+            render.assert_not_called()
+        self.assertEqual(self.update.await_args_list[0].args[1], self.update.await_args_list[1].args[1])
+        self.assertEqual(self.pipeline.stats()["deduplicated"], 1)
+
+    async def test_invalid_image_keeps_avatar(self):
+        await self.pipeline.submit("test@email.com", upload(b"not an image"))
+        await self.pipeline.join()
+        self.update.assert_not_awaited()
+        self.assertEqual(self.pipeline.stats()["failed"], 1)
+
+    async def test_large_uploads_are_refused_as_they_arrive(self):
+        data = b"x" * 200_000
+        with patch("src.services.avatars.config.AVATAR_MAX_BYTES", 100):
+            received = []
+            with self.assertRaises(HTTPException) as error:
+                await self.pipeline.submit("test@email.com", upload(data, received=received))
+            self.assertEqual(error.exception.status_code, 413)
+            self.assertEqual(received, [])
+
+            with self.assertRaises(HTTPException) as error:
+                await self.pipeline.submit("test@email.com", upload(data, content_length=False, received=received))
+            self.assertEqual(error.exception.status_code, 413)
+            self.assertLess(sum(map(len, received)), 32 * 1024)
+
+            with self.assertRaises(HTTPException) as error:
+                await self.pipeline.submit("test@email.com", upload(b"x" * 200))
+            self.assertEqual(error.exception.status_code, 413)
+        self.assertEqual(self.pipeline.stats()["queued"], 0)
+
+    async def test_rejected_uploads(self):
+        with self.assertRaises(HTTPException) as error:
+            await self.pipeline.submit("test@email.com", Request(
+                {"type": "http", "method": "PATCH", "headers": [(b"content-type", b"application/json")]}))
+        self.assertEqual(error.exception.status_code, 422)
+
+        with self.assertRaises(HTTPException) as error:
+            await self.pipeline.submit("test@email.com", upload(b"text", "text/plain"))
+        self.assertEqual(error.exception.status_code, 415)
+
+        await self.pipeline.submit("a@email.com", upload(image_bytes()))
+        await self.pipeline.submit("b@email.com", upload(image_bytes(color="blue")))
+        with self.assertRaises(HTTPException) as error:
+            await self.pipeline.submit("c@email.com", upload(image_bytes(color="green")))
+        self.assertEqual(error.exception.status_code, 503)
+        await self.pipeline.join()
+        self.assertEqual(self.pipeline.stats()["rejected"], 1)
+
+
+class TestCloudinaryStorage(unittest.TestCase):
+
+    def test_storage_interface_is_abstract(self):
+        with self.assertRaises(TypeError):
+            AvatarStorage()
+
+    @patch("src.services.avatars.cloudinary.uploader.upload")
+    @patch("src.services.avatars.cloudinary.api.resource")
+    def test_known_keys_skip_admin_api(self, resource, upload_file):
+        storage = CloudinaryStorage(folder="avatars")
+        self.assertTrue(storage.exists("abc"))
+        self.assertTrue(storage.exists("abc"))
+        resource.assert_called_once_with("avatars/abc")
+
+        resource.side_effect = NotFound("missing")
+        self.assertFalse(storage.exists("new"))
+        storage.save("new", b"jpeg")
+        upload_file.assert_called_once_with(b"jpeg", public_id="avatars/new", overwrite=True)
+        self.assertTrue(storage.exists("new"))
+        self.assertEqual(resource.call_count, 2)
+
+    @patch("src.services.avatars.cloudinary.api.resource", side_effect=RateLimited("slow down"))
+    def test_rate_limited_lookup_is_a_miss(self, resource):
+        self.assertFalse(CloudinaryStorage().exists("abc"))
+
+
+if __name__ == '__main__':
+    unittest.main()
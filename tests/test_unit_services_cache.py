@@ -0,0 +1,42 @@
+import unittest
+from unittest.mock import patch
+
+from src.services.cache import TTLCache
+
+
+class TestTTLCache(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = TTLCache(maxsize=2, ttl=30)
+
+    def test_get_hit_and_miss(self):
+        self.cache.set("a", 1)
+        self.assertEqual(self.cache.get("a"), 1)
+        self.assertIsNone(self.cache.get("b"))
+        self.assertEqual(self.cache.stats()["hits"], 1)
+        self.assertEqual(self.cache.stats()["misses"], 1)
+
+    def test_entry_expires(self):
+        with patch("src.services.cache.time.monotonic", return_value=100.0):
+            self.cache.set("a", 1)
+        with patch("src.services.cache.time.monotonic", return_value=130.0):
+            self.assertIsNone(self.cache.get("a"))
+        self.assertEqual(len(self.cache), 0)
+
+    def test_least_recently_used_is_evicted(self):
+        self.cache.set("a", 1)
+        self.cache.set("b", 2)
+        self.cache.get("a")
+        self.cache.set("c", 3)
+        self.assertEqual(self.cache.get("a"), 1)
+        self.assertIsNone(self.cache.get("b"))
+        self.assertEqual(self.cache.get("c"), 3)
+
+    def test_pop(self):
+        self.cache.set("a", 1)
+        self.assertEqual(self.cache.pop("a"), 1)
+        self.assertIsNone(self.cache.pop("a"))
+
+
+if __name__ == '__main__':
+    unittest.main()
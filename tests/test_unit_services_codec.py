@@ -0,0 +1,38 @@
+import pickle
+import unittest
+
+from src.entity.models import User
+from src.services.codec import CachedUser, encode_user, decode_user, SCHEMA_VERSION
+
+
+class TestUserCodec(unittest.TestCase):
+
+    def setUp(self):
+        self.user = User(id=1, username="test_user", password="test_password", email="test@email.com",
+                         avatar="https://example.com/avatar.png", confirm=True)
+
+    def test_roundtrip(self):
+        cached = CachedUser.from_user(self.user)
+        self.assertEqual(decode_user(encode_user(cached)), cached)
+
+    def test_roundtrip_without_avatar(self):
+        cached = CachedUser(id=2, username="Іван", email="ivan@email.com", avatar=None, confirm=False)
+        self.assertEqual(decode_user(encode_user(cached)), cached)
+
+    def test_password_is_not_cached(self):
+        self.assertNotIn(b"test_password", encode_user(CachedUser.from_user(self.user)))
+
+    def test_other_version_is_a_miss(self):
+        data = bytearray(encode_user(CachedUser.from_user(self.user)))
+        data[0] = SCHEMA_VERSION + 1
+        self.assertIsNone(decode_user(bytes(data)))
+
+    def test_pickled_user_is_a_miss(self):
+        self.assertIsNone(decode_user(pickle.dumps(self.user)))
+
+    def test_truncated_payload_is_a_miss(self):
+        self.assertIsNone(decode_user(encode_user(CachedUser.from_user(self.user))[:-1]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,108 @@
+import asyncio
+import gzip
+import unittest
+import zlib
+
+import brotli
+import zstandard
+from starlette.responses import Response, StreamingResponse
+
+from src.services.compression import CompressionMiddleware, CompressionStats, negotiate
+
+BODY = b'{"name": "Contact", "email": "contact@example.com"}' * 100
+
+
+async def call(app, accept_encoding="gzip, br, zstd", method="GET"):
+    scope = {"type": "http", "method": method, "path": "/", "query_string": b"",
+             "headers": [(b"accept-encoding", accept_encoding.encode())] if accept_encoding else []}
+    messages = []
+
+    async def receive():
+        # The client stays connected until the response is sent
+        await asyncio.Event().wait()
+
+    async def send(message):
+        messages.append(message)
+
+    await app(scope, receive, send)
+    headers = {key.decode(): value.decode() for key, value in messages[0]["headers"]}
+    return headers, [message.get("body", b"") for message in messages[1:]]
+
+
+class TestNegotiate(unittest.TestCase):
+
+    def test_negotiate(self):
+        supported = ["zstd", "br", "gzip"]
+        self.assertEqual(negotiate("gzip, deflate, br", supported), "br")
+        self.assertEqual(negotiate("gzip, br;q=0.9", supported), "gzip")
+        self.assertEqual(negotiate("gzip;q=0.5, *", supported), "zstd")
+        self.assertEqual(negotiate("ZSTD;q=0.1", supported), "zstd")
+        self.assertIsNone(negotiate("identity", supported))
+        self.assertIsNone(negotiate("*;q=0, gzip;q=0", supported))
+        self.assertIsNone(negotiate("", supported))
+
+
+class TestCompressionMiddleware(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.stats = CompressionStats()
+
+    def middleware(self, response, minimum_size=500):
+        return CompressionMiddleware(response, minimum_size=minimum_size, stats=self.stats)
+
+    async def test_codings(self):
+        zstd = zstandard.ZstdDecompressor()
+        for accept, decompress in (("gzip", gzip.decompress), ("br", brotli.decompress),
+                                   ("zstd", lambda body: zstd.decompressobj().decompress(body))):
+            headers, bodies = await call(self.middleware(Response(BODY, media_type="application/json")), accept)
+            self.assertEqual(headers["content-encoding"], accept)
+            self.assertEqual(headers["vary"], "Accept-Encoding")
+            self.assertEqual(int(headers["content-length"]), len(bodies[0]))
+            self.assertLess(len(bodies[0]), len(BODY) // 10)
+            self.assertEqual(decompress(bodies[0]), BODY)
+        self.assertEqual(self.stats.stats()["gzip"]["bytes_in"], len(BODY))
+        self.assertEqual(self.stats.stats()["br"]["responses"], 1)
+
+    async def test_left_alone(self):
+        cases = [(Response(b"{}", media_type="application/json"), "gzip, br, zstd", "GET"),
+                 (Response(BODY, media_type="image/jpeg"), "gzip", "GET"),
+                 (Response(BODY, media_type="image/png"), "gzip", "GET"),
+                 (Response(BODY, media_type="application/json", headers={"Content-Encoding": "gzip"}), "br", "GET"),
+                 (Response(BODY, status_code=206, media_type="text/plain"), "gzip", "GET"),
+                 (Response(BODY, media_type="application/json"), None, "GET"),
+                 (Response(BODY, media_type="application/json"), "identity", "GET"),
+                 (Response(BODY, media_type="application/json"), "gzip", "HEAD")]
+        for response, accept, method in cases:
+            headers, bodies = await call(self.middleware(response), accept, method)
+            self.assertNotIn("vary", headers)
+            self.assertEqual(bodies, [response.body])
+        self.assertEqual(self.stats.stats(), {})
+
+    async def test_svg_is_compressed(self):
+        headers, _ = await call(self.middleware(Response(BODY, media_type="image/svg+xml")), "gzip")
+        self.assertEqual(headers["content-encoding"], "gzip")
+
+    async def test_streaming_chunks_are_flushed(self):
+        chunks = [b'{"id": %d, "name": "Contact"}\n' % i for i in range(5)]
+
+        async def stream():
+            for chunk in chunks:
+                yield chunk
+
+        for accept, decompressor in (("gzip", lambda: zlib.decompressobj(16 + zlib.MAX_WBITS)),
+                                     ("br", brotli.Decompressor),
+                                     ("zstd", lambda: zstandard.ZstdDecompressor().decompressobj())):
+            app = self.middleware(StreamingResponse(stream(), media_type="application/x-ndjson"))
+            headers, bodies = await call(app, accept)
+            self.assertEqual(headers["content-encoding"], accept)
+            self.assertNotIn("content-length", headers)
+            decoder = decompressor()
+            decode = decoder.process if accept == "br" else decoder.decompress
+            # Every small chunk can be decoded as soon as it arrives, well below minimum_size
+            self.assertEqual([decode(body) for body in bodies[:len(chunks)]], chunks)
+            self.assertEqual(b"".join(decode(body) for body in bodies[len(chunks):]), b"")
+        self.assertEqual(self.stats.stats()["gzip"]["responses"], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+import unittest
+from unittest.mock import patch
+
+from src.services.contacts_io import BadLine, iter_lines, iter_csv_records, iter_ndjson_records
+
+
+async def stream(data: bytes, size: int = 3):
+    for start in range(0, len(data), size):
+        yield data[start:start + size]
+
+
+async def collect(iterator) -> list:
+    return [item async for item in iterator]
+
+
+class TestIterLines(unittest.IsolatedAsyncioTestCase):
+
+    async def test_lines(self):
+        data = "\ufeffname\r\nЖанна\n\nlast".encode()
+        self.assertEqual(await collect(iter_lines(stream(data), max_bytes=100)), ["name", "Жанна", "", "last"])
+
+    async def test_long_lines_are_dropped(self):
+        data = b"short\n" + b"x" * 50 + b"\nok\n" + b"y" * 50
+        self.assertEqual(await collect(iter_lines(stream(data), max_bytes=10)), ["short", BadLine.too_long, "ok", BadLine.too_long])
+        self.assertEqual(await collect(iter_lines(stream(data, size=100), max_bytes=10)),
+                         ["short", BadLine.too_long, "ok", BadLine.too_long])
+
+    async def test_undecodable_lines_are_marked(self):
+        data = "name\nJosé\nok\nRenée".encode("latin-1")
+        self.assertEqual(await collect(iter_lines(stream(data), max_bytes=100)),
+                         ["name", BadLine.not_utf8, "ok", BadLine.not_utf8])
+
+
+class TestRecords(unittest.IsolatedAsyncioTestCase):
+
+    async def test_ndjson_long_line_is_an_error(self):
+        data = b'{"name": "Ann"}\n' + b'{"notes": "' + b"x" * 100 + b'"}\n{"name": "Bob"}\n'
+        with patch("src.services.contacts_io.config.IMPORT_MAX_LINE_BYTES", 50):
+            records = await collect(iter_ndjson_records(iter_lines(stream(data))))
+        self.assertEqual(records, [(1, {"name": "Ann"}), (2, "Line is longer than 50 bytes"), (3, {"name": "Bob"})])
+
+    async def test_csv_unclosed_quote_is_capped(self):
+        data = b'name,notes\nAnn,"open\n' + b"more notes\n" * 20
+        with patch("src.services.contacts_io.config.IMPORT_MAX_LINE_BYTES", 50):
+            records = await collect(iter_csv_records(iter_lines(stream(data))))
+        self.assertEqual(records[0], (1, "Record is longer than 50 bytes"))
+        self.assertTrue(all(isinstance(row, str) for _, row in records))
+
+    async def test_csv_latin1_row_is_an_error(self):
+        data = "name,notes\nAnn,café\nBob,tea\n".encode("latin-1")
+        records = await collect(iter_csv_records(iter_lines(stream(data))))
+        self.assertEqual(records, [(1, "Record is not valid UTF-8"), (2, {"name": "Bob", "notes": "tea"})])
+
+    async def test_csv_multiline_field(self):
+        data = b'name,notes\nAnn,"first line\nsecond line"\nBob,\n'
+        records = await collect(iter_csv_records(iter_lines(stream(data))))
+        self.assertEqual(records, [(1, {"name": "Ann", "notes": "first line\nsecond line"}),
+                                   (2, {"name": "Bob", "notes": ""})])
+
+
+if __name__ == '__main__':
+    unittest.main()
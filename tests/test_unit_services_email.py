@@ -0,0 +1,162 @@
+import socket
+import unittest
+from datetime import datetime
+from unittest.mock import patch
+
+from aiosmtpd.controller import Controller
+from aiosmtplib import SMTPResponseException, SMTPServerDisconnected
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from src.entity.models import Base, OutboxEmail
+from src.repository import outbox as rep_outbox
+from src.services.email import OutboxSender, verification_email, is_permanent, render
+
+
+class Recorder:
+    """
+    An SMTP handler that keeps the messages it accepts. Recipients starting with later are refused
+    with a temporary error, recipients starting with nobody with a permanent one.
+    """
+    def __init__(self):
+        self.messages = []
+        self.sessions = 0
+
+    async def handle_EHLO(self, server, session, envelope, hostname, responses):
+        self.sessions += 1
+        session.host_name = hostname
+        return responses
+
+    async def handle_RCPT(self, server, session, envelope, address, rcpt_options):
+        if address.startswith("later"):
+            return "451 Try again later"
+        if address.startswith("nobody"):
+            return "550 No such mailbox"
+        envelope.rcpt_tos.append(address)
+        return "250 OK"
+
+    async def handle_DATA(self, server, session, envelope):
+        self.messages.append((envelope.rcpt_tos, envelope.content))
+        return "250 Message accepted"
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class TestOutboxSender(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.recorder = Recorder()
+        self.controller = Controller(self.recorder, hostname="127.0.0.1", port=free_port())
+        self.controller.start()
+        self.engine = create_async_engine("sqlite+aiosqlite:///:memory:", poolclass=StaticPool)
+        async with self.engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        self.session = async_sessionmaker(autoflush=False, autocommit=False, bind=self.engine)
+        self.sender = OutboxSender(session=self.session, hostname="127.0.0.1", port=self.controller.port,
+                                   username=None, use_tls=False, start_tls=False)
+
+    async def asyncTearDown(self):
+        await self.sender.disconnect()
+        self.controller.stop()
+        await self.engine.dispose()
+
+    async def queue(self, *recipients: str) -> None:
+        async with self.session() as db:
+            await rep_outbox.add_emails([verification_email(recipient, "user", "http://test/")
+                                         for recipient in recipients], db)
+
+    async def emails(self) -> dict[str, OutboxEmail]:
+        async with self.session() as db:
+            return {email.recipient: email for email in (await db.execute(select(OutboxEmail))).scalars()}
+
+    async def test_batch_uses_one_connection(self):
+        await self.queue("ann@example.com", "bob@example.com", "cid@example.com")
+        self.assertEqual(await self.sender.drain(), 3)
+        self.assertEqual(len(self.recorder.messages), 3)
+        self.assertEqual(self.recorder.sessions, 1)
+        self.assertEqual(self.sender.stats(), {"sent": 3, "failed": 0, "connections": 1})
+        self.assertIn(b"http://test/api/auth/confirmed_email/", self.recorder.messages[0][1])
+        self.assertTrue(all(email.status == "sent" and email.sent_at for email in (await self.emails()).values()))
+        self.assertEqual(await self.sender.drain(), 0)
+
+    async def test_temporary_error_is_retried(self):
+        await self.queue("later@example.com", "ann@example.com")
+        self.assertEqual(await self.sender.drain(), 2)
+        emails = await self.emails()
+        self.assertEqual(emails["ann@example.com"].status, "sent")
+        later = emails["later@example.com"]
+        self.assertEqual((later.status, later.attempts), ("pending", 1))
+        self.assertGreater(later.next_attempt_at, datetime.utcnow())
+        self.assertIn("451", later.last_error)
+        self.assertEqual(await self.sender.drain(), 0)
+
+        async with self.session() as db:
+            await db.execute(update(OutboxEmail).values(next_attempt_at=datetime.utcnow()))
+            await db.commit()
+        self.assertEqual(await self.sender.drain(), 1)
+        self.assertEqual((await self.emails())["later@example.com"].attempts, 2)
+        self.assertEqual(self.sender.connections, 1)
+
+    async def test_permanent_error_is_given_up(self):
+        await self.queue("nobody@example.com")
+        self.assertEqual(await self.sender.drain(), 1)
+        email = (await self.emails())["nobody@example.com"]
+        self.assertEqual((email.status, email.attempts), ("dead", 1))
+        self.assertEqual(self.recorder.messages, [])
+
+    async def test_unrenderable_email_is_given_up(self):
+        broken = verification_email("bad@example.com", "user", "http://test/")
+        broken.template = "missing_template"
+        async with self.session() as db:
+            await rep_outbox.add_emails([broken], db)
+        await self.queue("ann@example.com")
+        self.assertEqual(await self.sender.drain(), 2)
+        emails = await self.emails()
+        self.assertEqual((emails["bad@example.com"].status, emails["bad@example.com"].attempts), ("dead", 1))
+        self.assertIn("missing_template", emails["bad@example.com"].last_error)
+        self.assertEqual(emails["ann@example.com"].status, "sent")
+        self.assertEqual(len(self.recorder.messages), 1)
+
+    async def test_sent_emails_are_marked_when_batch_is_interrupted(self):
+        await self.queue("ann@example.com", "bob@example.com")
+
+        def render_first(email):
+            if email.recipient == "bob@example.com":
+                raise ValueError("broken")
+            return render(email)
+
+        with patch("src.services.email.render", render_first), \
+                patch("src.services.email.rep_outbox.mark_failed", side_effect=RuntimeError("db down")):
+            with self.assertRaises(RuntimeError):
+                await self.sender.drain()
+        emails = await self.emails()
+        self.assertEqual(sorted(email.status for email in emails.values()), ["pending", "sent"])
+
+    async def test_claimed_emails_are_leased(self):
+        await self.queue("ann@example.com")
+        async with self.session() as db:
+            self.assertEqual(len(await rep_outbox.claim_emails(db, 10, 300)), 1)
+            self.assertEqual(await rep_outbox.claim_emails(db, 10, 300), [])
+
+
+class TestRetries(unittest.TestCase):
+
+    def test_retry_at_backs_off(self):
+        first = OutboxSender.retry_at(1) - datetime.utcnow()
+        second = OutboxSender.retry_at(2) - datetime.utcnow()
+        self.assertAlmostEqual(second.total_seconds(), 2 * first.total_seconds(), delta=1)
+        self.assertIsNone(OutboxSender.retry_at(100))
+
+    def test_is_permanent(self):
+        self.assertTrue(is_permanent(SMTPResponseException(550, "No such mailbox")))
+        self.assertFalse(is_permanent(SMTPResponseException(421, "Busy")))
+        self.assertFalse(is_permanent(SMTPServerDisconnected("gone")))
+
+
+if __name__ == '__main__':
+    unittest.main()
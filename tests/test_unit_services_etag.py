@@ -0,0 +1,25 @@
+import unittest
+
+from src.services.etag import make_etag, etag_matches
+
+
+class TestETag(unittest.TestCase):
+
+    def test_make_etag(self):
+        etag = make_etag(3, 10, "2024-01-01 00:00:00")
+        self.assertTrue(etag.startswith('W/"') and etag.endswith('"'))
+        self.assertEqual(etag, make_etag(3, 10, "2024-01-01 00:00:00"))
+        self.assertNotEqual(etag, make_etag(4, 10, "2024-01-01 00:00:00"))
+
+    def test_etag_matches(self):
+        etag = make_etag(1)
+        self.assertTrue(etag_matches(etag, etag))
+        self.assertTrue(etag_matches(etag.removeprefix("W/"), etag))
+        self.assertTrue(etag_matches(f'"other", {etag}', etag))
+        self.assertTrue(etag_matches("*", etag))
+        self.assertFalse(etag_matches(None, etag))
+        self.assertFalse(etag_matches(make_etag(2), etag))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+import unittest
+
+from fastapi import FastAPI, HTTPException
+from fastapi.testclient import TestClient
+
+from src.services.metrics import (
+    Counter,
+    Histogram,
+    MetricsMiddleware,
+    RequestMetrics,
+    format_histograms,
+    format_metric,
+)
+
+
+class TestMetrics(unittest.TestCase):
+
+    def test_histogram(self):
+        histogram = Histogram(buckets=(0.1, 1.0))
+        for value in (0.05, 0.5, 0.7, 3):
+            histogram.observe(value)
+        self.assertEqual(histogram.stats(), {"buckets": {"0.1": 1, "1.0": 3, "+Inf": 4}, "sum": 4.25, "count": 4})
+
+    def test_counter(self):
+        counter = Counter(("method", "status"))
+        counter.inc("GET", "200")
+        counter.inc("GET", "200")
+        counter.inc("POST", "201", amount=3)
+        self.assertEqual(counter.samples(), [({"method": "GET", "status": "200"}, 2),
+                                             ({"method": "POST", "status": "201"}, 3)])
+
+    def test_format_metric(self):
+        text = format_metric("requests_total", "counter", "Requests.", [({"route": 'a"b\\c'}, 2)])
+        self.assertEqual(text, '# HELP requests_total Requests.\n# TYPE requests_total counter\n'
+                               'requests_total{route="a\\"b\\\\c"} 2\n')
+
+    def test_format_histograms(self):
+        histogram = Histogram(buckets=(1.0,))
+        histogram.observe(0.5)
+        text = format_histograms("latency_seconds", "Latency.", [({"route": "/"}, histogram.stats())])
+        self.assertIn('latency_seconds_bucket{route="/",le="1.0"} 1', text)
+        self.assertIn('latency_seconds_bucket{route="/",le="+Inf"} 1', text)
+        self.assertIn('latency_seconds_count{route="/"} 1', text)
+
+    def test_middleware_records_route_templates(self):
+        app = FastAPI()
+        metrics = RequestMetrics()
+        app.add_middleware(MetricsMiddleware, metrics=metrics)
+
+        @app.get("/items/{item_id}")
+        async def item(item_id: int):
+            if item_id == 0:
+                raise HTTPException(status_code=404)
+            return {"id": item_id}
+
+        client = TestClient(app)
+        client.get("/items/1")
+        client.get("/items/2")
+        client.get("/items/0")
+        client.get("/random/url")
+        client.post("/items/1")
+        samples = {tuple(labels.values()): value for labels, value in metrics.responses.samples()}
+        self.assertEqual(samples, {("GET", "/items/{item_id}", "200"): 2, ("GET", "/items/{item_id}", "404"): 1,
+                                   ("GET", "unmatched", "404"): 1, ("POST", "/items/{item_id}", "405"): 1})
+        self.assertEqual(metrics.latency["GET", "/items/{item_id}"].count, 3)
+        self.assertTrue(all(value == 0 for _, value in metrics.in_flight.samples()))
+
+
+if __name__ == '__main__':
+    unittest.main()
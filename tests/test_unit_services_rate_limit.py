@@ -0,0 +1,130 @@
+import unittest
+from unittest.mock import MagicMock, AsyncMock, patch
+
+from fastapi import HTTPException
+from redis.exceptions import ConnectionError
+
+from src.services.auth import auth_service
+from src.services.rate_limit import RateLimits, RateLimiter, default_identifier, ip_identifier
+
+
+def pipeline(replies):
+    pipe = MagicMock()
+    pipe.execute = AsyncMock(side_effect=replies if isinstance(replies, Exception) else [replies])
+    return pipe
+
+
+def request(authorization=None, host="10.0.0.1"):
+    req = MagicMock()
+    req.method = "GET"
+    req.headers = {"Authorization": authorization} if authorization else {}
+    req.client.host = host
+    req.scope = {"app": None}
+    return req
+
+
+class TestRateLimits(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.limits = RateLimits(maxsize=100)
+        self.limits.client = MagicMock()
+
+    def test_bucket(self):
+        with patch("src.services.rate_limit.time") as clock:
+            clock.monotonic.return_value = 100.0
+            clock.time.return_value = 1000.0
+            self.assertEqual([self.limits.hit("route", "ann", 3, 60) for _ in range(3)], [0, 0, 0])
+            self.assertAlmostEqual(self.limits.hit("route", "ann", 3, 60), 20)
+            self.assertEqual(self.limits.hit("route", "bob", 3, 60), 0)
+            self.assertEqual(self.limits.hit("other", "ann", 3, 60), 0)
+
+            clock.monotonic.return_value = 120.0
+            self.assertEqual(self.limits.hit("route", "ann", 3, 60), 0)
+            self.assertGreater(self.limits.hit("route", "ann", 3, 60), 0)
+        self.assertEqual(self.limits.stats(), {"buckets": 3, "allowed": 6, "limited": 2, "syncs": 0, "errors": 0})
+
+    def test_least_recently_used_buckets_are_dropped(self):
+        limits = RateLimits(maxsize=2)
+        for identity in ("ann", "bob", "ann", "cid"):
+            limits.hit("route", identity, 1, 60)
+        self.assertEqual(limits.stats()["buckets"], 2)
+        self.assertGreater(limits.hit("route", "ann", 1, 60), 0)
+        self.assertEqual(limits.hit("route", "bob", 1, 60), 0)
+
+    async def test_sync_takes_remote_use_out_of_bucket(self):
+        self.limits.hit("route", "ann", 10, 60)
+        self.limits.hit("route", "ann", 10, 60)
+        pipe = self.limits.client.pipeline.return_value = pipeline([8, True])
+        await self.limits.sync()
+        key = pipe.incrby.call_args.args[0]
+        self.assertTrue(key.startswith("ratelimit:route:ann:"))
+        self.assertEqual(pipe.incrby.call_args.args[1], 2)
+        # 2 of the 8 requests were ours, the other 6 leave 2 tokens
+        self.assertEqual([self.limits.hit("route", "ann", 10, 60) for _ in range(3)][:2], [0, 0])
+        self.assertGreater(self.limits.hit("route", "ann", 10, 60), 0)
+
+        pipe = self.limits.client.pipeline.return_value = pipeline([10, True])
+        await self.limits.sync()
+        self.assertEqual(pipe.incrby.call_args.args[1], 2)
+
+    async def test_nothing_to_sync(self):
+        await self.limits.sync()
+        self.limits.client.pipeline.assert_not_called()
+
+    async def test_redis_errors_keep_requests_pending(self):
+        self.limits.hit("route", "ann", 10, 60)
+        self.limits.client.pipeline.return_value = pipeline(ConnectionError("down"))
+        await self.limits.sync()
+        self.assertEqual(self.limits.stats()["errors"], 1)
+        pipe = self.limits.client.pipeline.return_value = pipeline([1, True])
+        await self.limits.sync()
+        self.assertEqual(pipe.incrby.call_args.args[1], 1)
+        self.assertEqual(self.limits.stats()["syncs"], 1)
+
+
+class TestRateLimiter(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.token = await auth_service.create_access_token(data={"sub": "ann@example.com"})
+        self.other = await auth_service.create_access_token(data={"sub": "bob@example.com"})
+
+    async def test_limit(self):
+        limiter = RateLimiter(times=2, seconds=30, limits=RateLimits(maxsize=10))
+        req = request(f"Bearer {self.token}")
+        await limiter(req)
+        await limiter(req)
+        with self.assertRaises(HTTPException) as error:
+            await limiter(req)
+        self.assertEqual(error.exception.status_code, 429)
+        self.assertEqual(error.exception.headers["Retry-After"], "15")
+        await limiter(request(f"Bearer {self.other}"))
+        self.assertEqual(limiter.name, "GET:unmatched")
+
+    async def test_invalid_tokens_share_the_address_bucket(self):
+        limits = RateLimits(maxsize=10)
+        limiter = RateLimiter(times=1, seconds=15, limits=limits)
+        await limiter(request("Bearer x0"))
+        for i in range(1, 5):
+            with self.assertRaises(HTTPException):
+                await limiter(request(f"Bearer x{i}"))
+        self.assertEqual(limits.stats()["buckets"], 1)
+
+    async def test_disabled(self):
+        limits = RateLimits(maxsize=10)
+        limits.enabled = False
+        limiter = RateLimiter(times=1, seconds=30, limits=limits)
+        for _ in range(3):
+            await limiter(request())
+        self.assertEqual(limits.stats()["buckets"], 0)
+
+    async def test_default_identifier(self):
+        self.assertEqual(default_identifier(request(f"Bearer {self.token}")), "user:ann@example.com")
+        self.assertEqual(default_identifier(request("Bearer junk")), "ip:10.0.0.1")
+        refresh = await auth_service.create_refresh_token(data={"sub": "ann@example.com"})
+        self.assertEqual(default_identifier(request(f"Bearer {refresh}")), "ip:10.0.0.1")
+        self.assertEqual(default_identifier(request()), "ip:10.0.0.1")
+        self.assertEqual(ip_identifier(request(f"Bearer {self.token}", host="10.0.0.2")), "ip:10.0.0.2")
+
+
+if __name__ == '__main__':
+    unittest.main()
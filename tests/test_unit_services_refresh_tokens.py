@@ -0,0 +1,155 @@
+import unittest
+from unittest.mock import AsyncMock, patch
+
+from fastapi import HTTPException
+from redis.exceptions import ConnectionError
+
+from src.services.auth import auth_service
+from src.services.refresh_tokens import RefreshTokenStore
+
+
+class MemoryRedis:
+    """
+    The commands the refresh token store uses, with the rotation script run in Python.
+    """
+    def __init__(self):
+        self.data = {}
+        self.ttl = {}
+
+    async def set(self, key, value, ex=None, nx=False):
+        if nx and key in self.data:
+            return None
+        self.data[key] = str(value)
+        self.ttl[key] = ex
+        return True
+
+    async def smembers(self, key):
+        return {member.encode() for member in self.data.get(key, set())}
+
+    async def delete(self, *keys):
+        return sum(self.data.pop(key, None) is not None for key in keys)
+
+    def pipeline(self, transaction=True):
+        memory = self
+
+        class Pipeline:
+            def __init__(self):
+                self.commands = []
+
+            async def __aenter__(self):
+                return self
+
+            async def __aexit__(self, *args):
+                pass
+
+            def set(self, key, value, ex=None):
+                self.commands.append(lambda: memory.data.__setitem__(key, value))
+                self.commands.append(lambda: memory.ttl.__setitem__(key, ex))
+
+            def sadd(self, key, member):
+                self.commands.append(lambda: memory.data.setdefault(key, set()).add(member))
+
+            def expire(self, key, seconds):
+                self.commands.append(lambda: memory.ttl.__setitem__(key, seconds))
+
+            async def execute(self):
+                return [command() for command in self.commands]
+
+        return Pipeline()
+
+    def register_script(self, script):
+        memory = self
+
+        class Script:
+            registered_client = memory
+
+            async def __call__(self, keys, args):
+                current = memory.data.get(keys[0])
+                if current is None:
+                    return 0
+                if current != args[0]:
+                    del memory.data[keys[0]]
+                    return -1
+                memory.data[keys[0]] = args[1]
+                return 1
+
+        return Script()
+
+
+class TestRefreshTokenStore(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.store = RefreshTokenStore(ttl=3600)
+        self.store.client = MemoryRedis()
+
+    async def test_rotation(self):
+        first = await self.store.issue("ann@example.com")
+        claims = await auth_service.decode_refresh_claims(first)
+        self.assertEqual(claims["sub"], "ann@example.com")
+        self.assertEqual(self.store.client.ttl[f"refresh:family:{claims['fid']}"], 3600)
+
+        email, second = await self.store.rotate(first)
+        self.assertEqual(email, "ann@example.com")
+        second_claims = await auth_service.decode_refresh_claims(second)
+        self.assertEqual(second_claims["fid"], claims["fid"])
+        self.assertNotEqual(second_claims["jti"], claims["jti"])
+        _, third = await self.store.rotate(second)
+        self.assertEqual(self.store.stats(), {"issued": 1, "rotated": 2, "migrated": 0, "reused": 0})
+
+    async def test_reuse_revokes_family(self):
+        first = await self.store.issue("ann@example.com")
+        _, second = await self.store.rotate(first)
+        with self.assertRaises(HTTPException) as error:
+            await self.store.rotate(first)
+        self.assertEqual(error.exception.status_code, 401)
+        with self.assertRaises(HTTPException):
+            await self.store.rotate(second)
+        self.assertEqual(self.store.stats()["reused"], 1)
+
+    async def test_families_are_independent(self):
+        laptop = await self.store.issue("ann@example.com")
+        phone = await self.store.issue("ann@example.com")
+        await self.store.rotate(laptop)
+        with self.assertRaises(HTTPException):
+            await self.store.rotate(laptop)
+        await self.store.rotate(phone)
+
+    async def test_revoke_user(self):
+        first = await self.store.issue("ann@example.com")
+        other = await self.store.issue("bob@example.com")
+        await self.store.revoke_user("ann@example.com")
+        with self.assertRaises(HTTPException):
+            await self.store.rotate(first)
+        await self.store.rotate(other)
+
+    async def test_legacy_token_is_exchanged_once(self):
+        legacy = await auth_service.create_refresh_token(data={"sub": "ann@example.com"})
+        email, token = await self.store.rotate(legacy)
+        self.assertEqual(email, "ann@example.com")
+        self.assertIn("fid", await auth_service.decode_refresh_claims(token))
+        with self.assertRaises(HTTPException):
+            await self.store.rotate(legacy)
+        await self.store.rotate(token)
+        self.assertEqual(self.store.stats()["migrated"], 1)
+
+        other = await auth_service.create_refresh_token(data={"sub": "bob@example.com"})
+        with patch("src.services.refresh_tokens.config.REFRESH_ACCEPT_LEGACY", False):
+            with self.assertRaises(HTTPException):
+                await self.store.rotate(other)
+
+    async def test_access_token_is_rejected(self):
+        token = await auth_service.create_access_token(data={"sub": "ann@example.com"})
+        with self.assertRaises(HTTPException) as error:
+            await self.store.rotate(token)
+        self.assertEqual(error.exception.status_code, 401)
+
+    async def test_redis_unavailable(self):
+        self.store.client = AsyncMock()
+        self.store.client.smembers.side_effect = ConnectionError("down")
+        with self.assertRaises(HTTPException) as error:
+            await self.store.revoke_user("ann@example.com")
+        self.assertEqual(error.exception.status_code, 503)
+
+
+if __name__ == '__main__':
+    unittest.main()
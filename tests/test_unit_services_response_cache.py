@@ -0,0 +1,55 @@
+import json
+import unittest
+from unittest.mock import AsyncMock
+
+from redis.exceptions import ConnectionError
+
+from src.services.response_cache import ResponseCache
+
+
+class TestResponseCache(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.cache = ResponseCache(ttl=60)
+        self.cache.client = AsyncMock()
+
+    def test_key(self):
+        key = self.cache.key(1, 3, "find_contacts", query="ann", limit=10)
+        self.assertTrue(key.startswith("response:1:3:find_contacts:"))
+        self.assertEqual(key, self.cache.key(1, 3, "find_contacts", limit=10, query="ann"))
+        self.assertNotEqual(key, self.cache.key(1, 4, "find_contacts", query="ann", limit=10))
+        self.assertNotEqual(key, self.cache.key(1, 3, "find_contacts", query="bob", limit=10))
+
+    async def test_put_and_get(self):
+        response = await self.cache.put("key", b'[{"id":1}]', {"ETag": 'W/"abc"'})
+        self.assertEqual(response.body, b'[{"id":1}]')
+        stored = self.cache.client.set.call_args.args[1]
+        self.assertEqual(self.cache.client.set.call_args.kwargs["ex"], 60)
+
+        self.cache.client.get.return_value = stored
+        response = await self.cache.get("key")
+        self.assertEqual(response.body, b'[{"id":1}]')
+        self.assertEqual(response.headers["etag"], 'W/"abc"')
+        self.assertEqual(response.media_type, "application/json")
+
+        self.cache.client.get.return_value = None
+        self.assertIsNone(await self.cache.get("other"))
+        self.assertEqual(self.cache.stats(), {"hits": 1, "misses": 1, "errors": 0, "hit_ratio": 0.5,
+                                              "bytes_served": 10})
+
+    async def test_redis_errors_are_misses(self):
+        self.cache.client.get.side_effect = ConnectionError("down")
+        self.cache.client.set.side_effect = ConnectionError("down")
+        self.assertIsNone(await self.cache.get("key"))
+        response = await self.cache.put("key", b"[]", {})
+        self.assertEqual(json.loads(response.body), [])
+        self.assertEqual(self.cache.stats()["errors"], 2)
+
+    async def test_disabled_without_client(self):
+        self.cache.client = None
+        self.assertIsNone(await self.cache.get("key"))
+        self.assertEqual(self.cache.stats()["misses"], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,58 @@
+import asyncio
+import threading
+import unittest
+
+from src.services.workers import BoundedPool, PoolSaturated
+
+
+class TestBoundedPool(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.pool = BoundedPool(workers=1, queue_size=1, name="test")
+
+    def tearDown(self):
+        self.pool.shutdown()
+
+    async def test_run_returns_result(self):
+        result = await self.pool.run(pow, 2, 10)
+        self.assertEqual(result, 1024)
+        self.assertEqual(self.pool.stats()["completed"], 1)
+
+    async def test_saturated_pool_rejects(self):
+        release = threading.Event()
+        running = [asyncio.create_task(self.pool.run(release.wait)) for _ in range(2)]
+        await asyncio.sleep(0)
+        self.assertEqual(self.pool.queue_depth, 1)
+        with self.assertRaises(PoolSaturated):
+            await self.pool.run(release.wait)
+        release.set()
+        await asyncio.gather(*running)
+        stats = self.pool.stats()
+        self.assertEqual(stats["rejected"], 1)
+        self.assertEqual(stats["completed"], 2)
+        self.assertEqual(stats["queue_depth"], 0)
+
+    async def test_cancelled_waiter_keeps_slot_until_thread_finishes(self):
+        started, release = threading.Event(), threading.Event()
+
+        def block():
+            started.set()
+            release.wait()
+
+        waiter = asyncio.create_task(self.pool.run(block))
+        await asyncio.get_running_loop().run_in_executor(None, started.wait)
+        waiter.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await waiter
+        self.assertEqual(self.pool.pending, 1)
+        queued = asyncio.create_task(self.pool.run(pow, 2, 3))
+        await asyncio.sleep(0)
+        with self.assertRaises(PoolSaturated):
+            await self.pool.run(pow, 2, 4)
+        release.set()
+        self.assertEqual(await queued, 8)
+        self.assertEqual(self.pool.pending, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()